@@ -1,9 +1,20 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from typing import List
-from app.services.image_service import ImageService
-from app.models.schemas import GroupResult, ImageGroup, GroupRequest
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, FileResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional, TYPE_CHECKING
+from app.models.schemas import (GroupResult, ImageGroup, GroupRequest, GroupJob, ImagePage,
+                               FaceSearchRequest, FaceSearchResult, FaceSearchResponse)
+from app.services.job_manager import (JobManager, SharedJobQueue, JOB_FAILED, JOB_KIND_GROUP, JOB_KIND_EXTRACT,
+                                      JOB_KIND_PROBE)
 import os
+import json
 import shutil
+import asyncio
+import threading
+
+if TYPE_CHECKING:
+    from app.services.image_service import ImageService
 
 router = APIRouter()
 
@@ -12,29 +23,136 @@ UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
-# 初始化 ImageService
-image_service = ImageService(upload_dir=UPLOAD_DIR)
+# 后台人脸特征提取进程数（0 表示关闭）与队列长度
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", "2"))
+EXTRACTION_QUEUE_SIZE = int(os.environ.get("EXTRACTION_QUEUE_SIZE", "1000"))
+# 分组时人脸识别的批大小
+RECOGNITION_BATCH_SIZE = int(os.environ.get("RECOGNITION_BATCH_SIZE", "64"))
+# 金字塔检测的缩小倍数（1/2/4/8），大于 1 时在缩小解码的图片上检测人脸，1 表示在原图上检测
+DETECTION_SCALE = int(os.environ.get("DETECTION_SCALE", "1"))
+# 上传时同时写入磁盘的文件数
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "4"))
+# 近似重复图片的 dHash 汉明距离阈值（0~64），未设置时只按内容哈希精确去重
+NEAR_DUPLICATE_DISTANCE = os.environ.get("NEAR_DUPLICATE_DISTANCE")
+# 生成缩略图的进程数（0 表示在请求时按需生成）
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", "1"))
+# 人脸索引类型：auto（按人脸数选择）/ flat / ivf_flat / ivf_sq8 / ivf_pq / hnsw
+FACE_INDEX_TYPE = os.environ.get("FACE_INDEX_TYPE", "auto")
+# 量化索引（ivf_sq8 / ivf_pq）查询时是否用原始特征重排候选
+FACE_INDEX_RERANK = os.environ.get("FACE_INDEX_RERANK", "1") not in ("0", "false", "False")
+# 缩略图内容由原图内容哈希决定，不会变化，允许客户端长期缓存
+DERIVATIVE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 分组任务进度事件（SSE）的推送间隔（秒）
+JOB_EVENTS_INTERVAL = float(os.environ.get("JOB_EVENTS_INTERVAL", "0.5"))
+# local: 在本进程中加载模型并执行分组；remote: 多进程部署，本进程不加载模型，
+# 分组和特征提取通过共享任务队列交给专用推理进程（app.inference_worker）执行
+INFERENCE_MODE = os.environ.get("INFERENCE_MODE", "local")
+REMOTE_INFERENCE = INFERENCE_MODE == "remote"
+
+# ImageService 依赖 OpenCV、Faiss、scikit-learn 等较重的模块，首次使用时再导入和初始化，
+# 保证服务启动后立即可以响应健康检查
+_image_service: Optional["ImageService"] = None
+_image_service_lock = threading.Lock()
+
+# 分组是 CPU 密集型操作，在后台线程中执行，避免阻塞事件循环
+job_manager = JobManager()
+_job_queue: Optional[SharedJobQueue] = None
+
+
+def create_image_service(remote_inference: bool = False) -> "ImageService":
+    """按环境变量配置创建 ImageService；remote_inference 时不启动本进程的特征提取进程池"""
+    from app.services.image_service import ImageService
+
+    return ImageService(
+        upload_dir=UPLOAD_DIR,
+        extraction_workers=0 if remote_inference else EXTRACTION_WORKERS,
+        extraction_queue_size=EXTRACTION_QUEUE_SIZE,
+        recognition_batch_size=RECOGNITION_BATCH_SIZE,
+        upload_concurrency=UPLOAD_CONCURRENCY,
+        near_duplicate_distance=int(NEAR_DUPLICATE_DISTANCE) if NEAR_DUPLICATE_DISTANCE else None,
+        detection_scale=DETECTION_SCALE,
+        thumbnail_workers=THUMBNAIL_WORKERS,
+        remote_inference=remote_inference,
+        index_type=FACE_INDEX_TYPE,
+        index_rerank=FACE_INDEX_RERANK
+    )
+
+
+def get_image_service() -> "ImageService":
+    """获取 ImageService 单例（延迟初始化）"""
+    global _image_service
+    if _image_service is None:
+        with _image_service_lock:
+            if _image_service is None:
+                _image_service = create_image_service(remote_inference=REMOTE_INFERENCE)
+    return _image_service
+
+
+def get_job_queue() -> SharedJobQueue:
+    """多进程部署时的共享任务队列（与 ImageService 使用同一个数据库）"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = SharedJobQueue(get_image_service().metadata)
+    return _job_queue
+
+
+def _jobs():
+    """当前部署模式下保存分组任务的对象，两者都提供 get 和 is_finished"""
+    return get_job_queue() if REMOTE_INFERENCE else job_manager
+
+
+async def _run_remote_job(kind: str, payload: dict):
+    """提交到共享任务队列，轮询等待推理进程执行完成并返回结果，任务失败时抛出 ValueError"""
+    queue = get_job_queue()
+    job_id = queue.submit(kind, payload)
+    job = queue.get(job_id)
+    while not queue.is_finished(job):
+        await asyncio.sleep(JOB_EVENTS_INTERVAL)
+        job = queue.get(job_id)
+    if job['status'] == JOB_FAILED:
+        raise ValueError(job['error'])
+    return job['result']
+
+
+def warm_up_image_service():
+    """初始化 ImageService、加载人脸模型并执行一次预推理；remote 模式下模型由推理进程加载"""
+    from app.services.model_registry import warm_up, FACE_MODEL_NAME, FACE_DET_SIZE
+
+    get_image_service()
+    if not REMOTE_INFERENCE:
+        warm_up(FACE_MODEL_NAME, FACE_DET_SIZE)
+
+
+def shutdown_image_service():
+    """关闭分组任务线程和已创建的 ImageService（未创建时不做任何事）"""
+    job_manager.shutdown()
+    if _image_service is not None:
+        _image_service.shutdown()
+
+def _clear_uploads_and_reset():
+    """删除上传的图片并重置 ImageService；reset 需要等待跨进程分组锁，只能在线程池中调用"""
+    # 清除上传目录中的所有文件
+    uploads_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
+    if os.path.exists(uploads_dir):
+        for filename in os.listdir(uploads_dir):
+            file_path = os.path.join(uploads_dir, filename)
+            try:
+                if os.path.isfile(file_path):
+                    os.unlink(file_path)
+                elif os.path.isdir(file_path):
+                    shutil.rmtree(file_path)
+            except Exception as e:
+                print(f"Error deleting {file_path}: {e}")
+
+    # 重置 ImageService 的状态
+    get_image_service().reset()
 
 @router.post("/clear-cache")
 async def clear_cache():
     """清除缓存和上传的图片"""
     try:
-        # 清除上传目录中的所有文件
-        uploads_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
-        if os.path.exists(uploads_dir):
-            for filename in os.listdir(uploads_dir):
-                file_path = os.path.join(uploads_dir, filename)
-                try:
-                    if os.path.isfile(file_path):
-                        os.unlink(file_path)
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
-                except Exception as e:
-                    print(f"Error deleting {file_path}: {e}")
-
-        # 重置 ImageService 的状态
-        image_service.reset()
-
+        # 分组任务持有分组锁时 reset 会一直等待，不能阻塞事件循环
+        await run_in_threadpool(_clear_uploads_and_reset)
         return {"message": "缓存已清除"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -56,7 +174,10 @@ async def upload_images(files: List[UploadFile] = File(...)):
                     detail=f"文件 {file.filename} 不是有效的图片文件类型"
                 )
         #print(f"Attempting to save {len(files)} files...")
-        image_ids = await image_service.save_images(files)
+        image_ids = await get_image_service().save_images(files)
+        if REMOTE_INFERENCE:
+            # 交给推理进程提前提取人脸特征
+            get_job_queue().submit(JOB_KIND_EXTRACT, {'image_ids': image_ids})
         print(f"Successfully saved {len(image_ids)} files")
         return image_ids
         
@@ -67,6 +188,27 @@ async def upload_images(files: List[UploadFile] = File(...)):
         print(f"Unexpected error during upload: {str(e)}")
         raise HTTPException(status_code=500, detail="服务器处理文件时发生错误")
 
+@router.get("/images/extraction-status")
+async def get_extraction_status(image_ids: Optional[List[str]] = Query(None)):
+    """
+    获取后台人脸特征提取进度
+    """
+    try:
+        # remote 模式下逐张检查共享的特征缓存文件，放到线程池中执行，不阻塞事件循环
+        return await run_in_threadpool(get_image_service().get_extraction_status, image_ids)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/images/{image_id}/extraction")
+async def get_image_extraction_status(image_id: str):
+    """
+    获取单张图片的人脸特征提取状态
+    """
+    status = (await run_in_threadpool(get_image_service().get_extraction_status, [image_id]))['items'].get(image_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"No extraction task for image: {image_id}")
+    return status
+
 @router.post("/images/group", response_model=List[GroupResult])
 async def group_images(request: GroupRequest):
     """
@@ -77,29 +219,149 @@ async def group_images(request: GroupRequest):
         List[GroupResult]: 分组结果列表
     """
     try:
-        groups =  image_service.auto_group_images(
-            request.image_ids,
-            request.similarity_threshold
-        )
+        if REMOTE_INFERENCE:
+            # 提交给推理进程，轮询任务结果
+            groups = await _run_remote_job(JOB_KIND_GROUP, request.dict())
+        else:
+            # 与分组任务共用同一个后台线程，等待结果时不阻塞其他请求
+            _, future = job_manager.submit(
+                get_image_service().auto_group_images,
+                request.image_ids,
+                request.similarity_threshold,
+                incremental=request.incremental
+            )
+            groups = await asyncio.wrap_future(future)
         print(f"Grouping result: {groups}")
         return groups
     except Exception as e:
         print(f"Error during grouping: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/images")
-async def get_images():
+@router.post("/jobs/group", response_model=GroupJob, status_code=202)
+async def create_group_job(request: GroupRequest):
+    """
+    创建后台分组任务，立即返回任务信息
+    Args:
+        request: GroupRequest - 包含图片ID列表和相似度阈值的请求对象
+    Returns:
+        GroupJob: 任务信息，可通过 /jobs/{job_id} 轮询或 /jobs/{job_id}/events 订阅进度
     """
-    获取所有图片列表
+    if REMOTE_INFERENCE:
+        job_id = get_job_queue().submit(JOB_KIND_GROUP, request.dict())
+    else:
+        job_id, _ = job_manager.submit(
+            get_image_service().auto_group_images,
+            request.image_ids,
+            request.similarity_threshold,
+            incremental=request.incremental
+        )
+    return _jobs().get(job_id)
+
+@router.get("/jobs/{job_id}", response_model=GroupJob)
+async def get_group_job(job_id: str):
     """
+    获取分组任务的状态、阶段进度和结果
+    """
+    job = _jobs().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+@router.get("/jobs/{job_id}/events")
+async def stream_group_job(job_id: str):
+    """
+    以 Server-Sent Events 推送分组任务进度，任务结束后发送 done / failed 事件并关闭连接
+    """
+    jobs = _jobs()
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    async def events():
+        last_version = None
+        while True:
+            job = jobs.get(job_id)
+            if job is None:
+                return
+            finished = jobs.is_finished(job)
+            if job['version'] != last_version:
+                last_version = job['version']
+                event = job['status'] if finished else 'progress'
+                data = json.dumps(jsonable_encoder(GroupJob(**job)), ensure_ascii=False)
+                yield f"event: {event}\ndata: {data}\n\n"
+            if finished:
+                return
+            await asyncio.sleep(JOB_EVENTS_INTERVAL)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/faces/search", response_model=FaceSearchResponse)
+async def search_faces(request: FaceSearchRequest):
+    """
+    以图搜人：查找与图库中指定人脸相似的图片，可一次查询多个人脸
+    使用已持久化的人脸索引和已提取的特征，不会对图库重新推理；
+    设置 min_similarity 时返回相似度不低于该值的图片，否则返回最相似的 k 张
+    """
+    probes = [probe.dict() for probe in request.probes]
     try:
-        images = []
-        for filename in os.listdir(UPLOAD_DIR):
-            if os.path.isfile(os.path.join(UPLOAD_DIR, filename)):
-                images.append({"filename": filename})
-        return images
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        results = await run_in_threadpool(
+            get_image_service().search_faces, probes, request.k, request.min_similarity)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return FaceSearchResponse(results=[
+        FaceSearchResult(image_id=probe['image_id'], face_index=probe['face_index'], matches=matches)
+        for probe, matches in zip(probes, results)
+    ])
+
+@router.post("/faces/search/upload", response_model=FaceSearchResponse)
+async def search_faces_by_photo(
+    file: UploadFile = File(...),
+    k: int = Query(50, ge=1, le=1000),
+    min_similarity: Optional[float] = Query(None, ge=-1.0, le=1.0)
+):
+    """
+    以图搜人：上传一张照片（不加入图库），照片中检测到的每个人脸都作为一个探针
+    """
+    if not file.content_type or not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail=f"文件 {file.filename} 不是有效的图片文件类型")
+    service = get_image_service()
+    path = await service.save_probe(file)
+    try:
+        if REMOTE_INFERENCE:
+            # 本进程不加载模型，交给推理进程识别照片中的人脸
+            faces = await _run_remote_job(JOB_KIND_PROBE, {'image_path': path})
+        else:
+            faces = await run_in_threadpool(service.probe_faces, path)
+        results = await run_in_threadpool(service.search_faces, faces, k, min_similarity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.remove(path)
+    return FaceSearchResponse(results=[
+        FaceSearchResult(face_index=face_index, bbox=face['bbox'], matches=matches)
+        for face_index, (face, matches) in enumerate(zip(faces, results))
+    ])
+
+@router.get("/images", response_model=ImagePage)
+async def get_images(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    sort: str = Query("created_at"),
+    order: str = Query("desc"),
+    group_id: Optional[str] = None
+):
+    """
+    分页获取图片列表，可按 created_at / size / score 排序、按分组过滤；
+    下一页使用上一页返回的 next_cursor
+    """
+    try:
+        items, next_cursor = get_image_service().list_images(sort, order, limit, cursor, group_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ImagePage(items=items, next_cursor=next_cursor)
 
 @router.get("/images/{image_id}")
 async def get_image(image_id: str):
@@ -107,18 +369,53 @@ async def get_image(image_id: str):
     获取单个图片的信息
     """
     try:
-        image = await image_service.get_image(image_id)
+        image = await get_image_service().get_image(image_id)
         return image
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
 
+def _derivative_response(request: Request, path: str, key: str):
+    """返回缩略图文件，带强 ETag；客户端缓存的版本一致时返回 304"""
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": DERIVATIVE_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
+
+@router.get("/images/{image_id}/thumbnail")
+async def get_image_thumbnail(request: Request, image_id: str, size: int = Query(256)):
+    """
+    获取图片缩略图（长边 size 像素）
+    """
+    from app.services.derivatives import THUMBNAIL_SIZES
+
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"不支持的缩略图尺寸: {size}，可选 {list(THUMBNAIL_SIZES)}")
+    try:
+        path, key = await get_image_service().get_thumbnail(image_id, size)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return _derivative_response(request, path, key)
+
+@router.get("/images/{image_id}/faces/{face_index}/thumbnail")
+async def get_face_thumbnail(request: Request, image_id: str, face_index: int):
+    """
+    获取图片中第 face_index 个人脸的正方形头像，用作分组封面
+    """
+    try:
+        path, key = await get_image_service().get_face_thumbnail(image_id, face_index)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return _derivative_response(request, path, key)
+
 @router.delete("/images/{image_id}")
 async def delete_image(image_id: str):
     """
     删除单个图片
     """
     try:
-        await image_service.delete_image(image_id)
+        await get_image_service().delete_image(image_id)
         return {"message": "Image deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -129,7 +426,7 @@ async def create_group(group: ImageGroup):
     创建新的图片分组
     """
     try:
-        created_group = await image_service.create_group(group)
+        created_group = await get_image_service().create_group(group)
         return created_group
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -140,7 +437,7 @@ async def get_groups():
     获取所有图片分组
     """
     try:
-        groups = await image_service.get_groups()
+        groups = await get_image_service().get_groups()
         return groups
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -151,7 +448,7 @@ async def update_group(group_id: str, group: ImageGroup):
     更新图片分组信息
     """
     try:
-        updated_group = await image_service.update_group(group_id, group)
+        updated_group = await get_image_service().update_group(group_id, group)
         return updated_group
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -162,7 +459,7 @@ async def delete_group(group_id: str):
     删除图片分组
     """
     try:
-        await image_service.delete_group(group_id)
+        await get_image_service().delete_group(group_id)
         return {"message": "Group deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e)) 
\ No newline at end of file
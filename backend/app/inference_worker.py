@@ -0,0 +1,52 @@
+"""专用推理进程：加载人脸模型，依次执行共享任务队列中的分组、特征提取和以图搜人的人脸识别任务
+
+多进程部署时（API_WORKERS > 1）由 run.py 启动，API 进程以 INFERENCE_MODE=remote 运行，
+不加载模型，只把任务写入共享数据库。也可以单独启动：
+    python -m app.inference_worker
+"""
+import os
+import signal
+import threading
+
+from app.api.routes import create_image_service
+from app.services.job_manager import SharedJobQueue, JOB_KIND_GROUP, JOB_KIND_EXTRACT, JOB_KIND_PROBE
+from app.services.model_registry import warm_up, FACE_MODEL_NAME, FACE_DET_SIZE
+from app.services.metrics import REGISTRY
+
+# 没有任务时轮询数据库的间隔（秒）
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "0.5"))
+
+
+def main():
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    # 推理进程自己持有模型和特征提取进程池
+    service = create_image_service(remote_inference=False)
+    queue = SharedJobQueue(service.metadata)
+    interrupted = service.metadata.fail_running_jobs("推理进程重启，任务已中断")
+    if interrupted:
+        print(f"已将 {interrupted} 个中断的任务标记为失败")
+    warm_up(FACE_MODEL_NAME, FACE_DET_SIZE)
+
+    handlers = {
+        JOB_KIND_GROUP: service.auto_group_images,
+        JOB_KIND_EXTRACT: service.prefetch_features,
+        JOB_KIND_PROBE: service.probe_faces,
+    }
+    print(f"推理进程 {os.getpid()} 已就绪")
+    try:
+        while not stop.is_set():
+            ran = queue.run_next(handlers)
+            # 指标快照由 API 进程的 /metrics 读取
+            REGISTRY.flush()
+            if not ran:
+                stop.wait(JOB_POLL_INTERVAL)
+    finally:
+        service.shutdown()
+        print(f"推理进程 {os.getpid()} 已退出")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,19 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from app.api.routes import router
+from app.api.routes import router, warm_up_image_service, shutdown_image_service
+from app.services.warmup import warmup
+from app.services.model_registry import get_load_stats
+from app.services.metrics import REGISTRY
 import os
+import logging
+
+# 日志级别，默认 WARNING；未启用的 debug 日志只有一次级别判断的开销
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "WARNING").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
 
 app = FastAPI(
     title="Image Grouping API",
@@ -26,4 +37,33 @@ if not os.path.exists(uploads_dir):
 app.mount("/uploads", StaticFiles(directory=uploads_dir), name="uploads")
 
 # 包含路由
-app.include_router(router, prefix="/api") 
\ No newline at end of file
+app.include_router(router, prefix="/api") 
+
+@app.on_event("startup")
+def startup_event():
+    """在后台预热模型，不阻塞端口绑定"""
+    warmup.start(warm_up_image_service)
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """关闭后台人脸特征提取进程"""
+    shutdown_image_service()
+
+@app.get("/health")
+def health():
+    """存活检查：进程可以响应请求即返回"""
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    """就绪检查：模型加载并完成一次预推理后返回 200，否则返回 503"""
+    status = warmup.status()
+    status['models'] = get_load_stats()
+    if not status['ready']:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus 文本格式的指标，合并 API、特征提取和推理进程"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
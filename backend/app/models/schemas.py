@@ -16,6 +16,15 @@ class Image(BaseModel):
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     score:float
+    content_hash: Optional[str] = None  # 文件内容的 SHA-256
+    perceptual_hash: Optional[str] = None  # dHash（十六进制），仅在开启近似去重时计算
+    thumbnail_url: Optional[str] = None  # 网格缩略图
+    preview_url: Optional[str] = None  # 大图预览
+
+class ImagePage(BaseModel):
+    """图片列表分页结果"""
+    items: List[Image]
+    next_cursor: Optional[str] = None  # 没有下一页时为 None
 
 class ImageGroup(BaseModel):
     """图片分组模型"""
@@ -47,4 +56,45 @@ class GroupResult(BaseModel):
 class GroupRequest(BaseModel):
     """分组请求模型"""
     image_ids: List[str]
-    similarity_threshold: float = Field(default=0.55, ge=0.0, le=1.0) 
\ No newline at end of file
+    similarity_threshold: float = Field(default=0.55, ge=0.0, le=1.0)
+    incremental: bool = False  # 只把新图片分配到已有分组，不重新全量聚类 
+
+class GroupJob(BaseModel):
+    """分组任务模型"""
+    job_id: str
+    status: str  # queued / running / done / failed
+    stage: Optional[str] = None  # extraction / indexing / distance_matrix / threshold_sweep / clustering / assigning
+    current: int = 0
+    total: int = 0
+    result: Optional[List[GroupResult]] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class FaceProbe(BaseModel):
+    """以图搜人的探针：图库中某张图片的第 face_index 个人脸"""
+    image_id: str
+    face_index: int = Field(default=0, ge=0)
+
+class FaceSearchRequest(BaseModel):
+    """以图搜人请求，多个探针合并为一次批量查询"""
+    probes: List[FaceProbe] = Field(..., min_items=1, max_items=100)
+    k: int = Field(default=50, ge=1, le=1000)  # 每个探针最多返回的图片数
+    min_similarity: Optional[float] = Field(default=None, ge=-1.0, le=1.0)  # 设置时按相似度阈值检索
+
+class FaceMatch(BaseModel):
+    """以图搜人的一张匹配图片"""
+    image_id: str
+    face_index: int  # 图片中最相似的人脸
+    score: float  # 余弦相似度
+
+class FaceSearchResult(BaseModel):
+    """单个探针的检索结果，matches 按相似度降序"""
+    image_id: Optional[str] = None  # 上传的照片为 None
+    face_index: int
+    bbox: Optional[List[float]] = None  # 上传照片中探针人脸的位置
+    matches: List[FaceMatch]
+
+class FaceSearchResponse(BaseModel):
+    """以图搜人结果，与请求中的探针一一对应"""
+    results: List[FaceSearchResult]
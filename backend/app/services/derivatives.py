@@ -0,0 +1,118 @@
+import os
+import math
+import tempfile
+from typing import List, Sequence
+from PIL import Image, ImageOps
+
+# 缩略图尺寸（长边像素）：网格缩略图与大图预览
+THUMBNAIL_SIZES = (256, 1024)
+# 人脸头像尺寸（正方形边长）
+FACE_CROP_SIZE = 160
+# 人脸头像在人脸框四周扩展的比例
+FACE_CROP_MARGIN = 0.3
+JPEG_QUALITY = 85
+# 衍生图格式版本，生成方式变化时递增，旧文件自动失效
+DERIVATIVE_FORMAT_VERSION = 1
+
+
+class DerivativeStore:
+    """按原图内容哈希寻址的缩略图与人脸头像
+
+    文件名由原图内容哈希和生成参数决定，同一个文件名的内容永远不变，
+    因此可以直接作为强 ETag 并允许客户端长期缓存。
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        if not os.path.exists(root):
+            os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def thumbnail_key(content_hash: str, size: int) -> str:
+        return f"{content_hash}-t{size}-v{DERIVATIVE_FORMAT_VERSION}"
+
+    @staticmethod
+    def face_key(content_hash: str, face_index: int, size: int = FACE_CROP_SIZE) -> str:
+        return f"{content_hash}-f{face_index}-s{size}-v{DERIVATIVE_FORMAT_VERSION}"
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.jpg")
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def save(self, key: str, image: Image.Image):
+        """保存 JPEG（先写临时文件再原子替换，避免并发读到半个文件）"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def generate_thumbnails(image_path: str, root: str, content_hash: str,
+                        sizes: Sequence[int] = THUMBNAIL_SIZES) -> List[str]:
+    """生成一张图片的各尺寸缩略图（已存在的跳过），返回生成的文件路径
+
+    JPEG 使用 draft 模式按比例直接解码缩小后的图像；小尺寸由大尺寸的结果继续缩小。
+    可在进程池中执行。
+    """
+    store = DerivativeStore(root)
+    todo = sorted((size for size in sizes if not store.exists(store.thumbnail_key(content_hash, size))), reverse=True)
+    if not todo:
+        return []
+
+    paths = []
+    with Image.open(image_path) as img:
+        img.draft('RGB', (todo[0], todo[0]))
+        # 按 EXIF 方向旋转，与 OpenCV 读取的方向一致
+        current = ImageOps.exif_transpose(img).convert('RGB')
+    for size in todo:
+        current.thumbnail((size, size), Image.LANCZOS)
+        key = store.thumbnail_key(content_hash, size)
+        store.save(key, current)
+        paths.append(store.path(key))
+    return paths
+
+
+def generate_face_crop(image_path: str, root: str, content_hash: str, face_index: int,
+                       bbox: Sequence[float], size: int = FACE_CROP_SIZE) -> str:
+    """按人脸框（原图坐标）裁剪正方形人脸头像，返回文件路径
+
+    只按人脸大小需要的分辨率解码：人脸边长远大于头像尺寸时使用 draft 缩小解码。
+    """
+    store = DerivativeStore(root)
+    key = store.face_key(content_hash, face_index, size)
+    if store.exists(key):
+        return store.path(key)
+
+    x0, y0, x1, y1 = [float(v) for v in bbox[:4]]
+    side = max(x1 - x0, y1 - y0) * (1 + 2 * FACE_CROP_MARGIN)
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+
+    with Image.open(image_path) as img:
+        raw_width, raw_height = img.size
+        scale = max(1.0, side / size)
+        img.draft('RGB', (math.ceil(raw_width / scale), math.ceil(raw_height / scale)))
+        # draft 实际缩小的倍数（非 JPEG 时为 1）
+        factor = raw_width / img.size[0]
+        oriented = ImageOps.exif_transpose(img).convert('RGB')
+
+    half = side / 2 / factor
+    box = tuple(int(round(v)) for v in (cx / factor - half, cy / factor - half, cx / factor + half, cy / factor + half))
+    face = oriented.crop(box).resize((size, size), Image.LANCZOS)
+    store.save(key, face)
+    return store.path(key)
+
+
+def generate_face_crops(image_path: str, root: str, content_hash: str,
+                        faces: Sequence[dict], size: int = FACE_CROP_SIZE) -> List[str]:
+    """为提取结果中的每个人脸生成头像（已存在的跳过），人脸序号即其在 faces 中的下标；可在进程池中执行"""
+    return [generate_face_crop(image_path, root, content_hash, face_index, face['bbox'], size)
+            for face_index, face in enumerate(faces)]
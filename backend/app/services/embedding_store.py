@@ -0,0 +1,153 @@
+import os
+import ast
+import pickle
+import struct
+import numpy as np
+from typing import List, Optional
+
+# .npy 文件头固定占用的字节数（预留足够空间，追加数据时原地改写 shape 而不移动数据）
+NPY_HEADER_SIZE = 128
+# image_id 以定长 UTF-8 字节串存储
+IMAGE_ID_DTYPE = np.dtype('S64')
+
+
+class _NpyColumn:
+    """可追加写入的单列 .npy 文件
+
+    文件头长度固定为 NPY_HEADER_SIZE，追加数据时只需在末尾写入新行并改写头部的 shape，
+    读取时可直接 np.load(mmap_mode='r')。
+    """
+
+    def __init__(self, path: str, dtype, row_shape=()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape, dtype=np.int64))
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                self._write_header(f, 0)
+
+    def _write_header(self, f, count: int):
+        header = {
+            'descr': np.lib.format.dtype_to_descr(self.dtype),
+            'fortran_order': False,
+            'shape': (count,) + self.row_shape,
+        }
+        text = repr(header).encode('latin1')
+        text = text.ljust(NPY_HEADER_SIZE - 10 - 1) + b'\n'
+        f.seek(0)
+        f.write(b'\x93NUMPY\x01\x00')
+        f.write(struct.pack('<H', len(text)))
+        f.write(text)
+
+    def __len__(self) -> int:
+        with open(self.path, 'rb') as f:
+            f.seek(10)
+            header = ast.literal_eval(f.read(NPY_HEADER_SIZE - 10).decode('latin1'))
+        return header['shape'][0]
+
+    def load(self) -> np.ndarray:
+        """以只读内存映射方式加载，耗时与数据量无关"""
+        if len(self) == 0:
+            return np.empty((0,) + self.row_shape, dtype=self.dtype)
+        return np.load(self.path, mmap_mode='r')
+
+    def append(self, rows: np.ndarray, start: Optional[int] = None):
+        """在第 start 行（默认为当前行数）之后写入，覆盖之后残留的数据"""
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        count = len(self) if start is None else start
+        with open(self.path, 'r+b') as f:
+            f.seek(NPY_HEADER_SIZE + count * self.row_bytes)
+            f.write(rows.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+            self._write_header(f, count + len(rows))
+
+
+class EmbeddingStore:
+    """列式人脸特征存储
+
+    特征、image_id 与质量分数分别存为连续的 .npy 文件：
+    - embeddings.npy      (N, dim) float32
+    - image_ids.npy       (N,)     S64
+    - quality_scores.npy  (N,)     float64
+    加载时使用 mmap，只追加写入，不需要把整个列表反序列化到内存。
+    """
+
+    def __init__(self, root: str, dim: int = 512):
+        self.root = root
+        self.dim = dim
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self._embeddings = _NpyColumn(os.path.join(root, 'embeddings.npy'), np.float32, (dim,))
+        self._quality_scores = _NpyColumn(os.path.join(root, 'quality_scores.npy'), np.float64)
+        # image_ids 最后写入，作为一次追加的提交标记
+        self._image_ids = _NpyColumn(os.path.join(root, 'image_ids.npy'), IMAGE_ID_DTYPE)
+        self.reload()
+
+    @staticmethod
+    def exists(root: str) -> bool:
+        return os.path.exists(os.path.join(root, 'image_ids.npy'))
+
+    def reload(self):
+        """重新映射磁盘上的数据"""
+        count = len(self._image_ids)
+        self.embeddings = self._embeddings.load()[:count]
+        self.quality_scores = self._quality_scores.load()[:count]
+        self._raw_image_ids = self._image_ids.load()[:count]
+        self._decoded_ids: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self._raw_image_ids)
+
+    @property
+    def image_ids(self) -> List[str]:
+        """解码后的 image_id 列表（首次访问时解码并缓存）"""
+        if self._decoded_ids is None:
+            self._decoded_ids = [image_id.decode('utf-8') for image_id in self._raw_image_ids]
+        return self._decoded_ids
+
+    def append(self, embeddings, image_ids: List[str], quality_scores):
+        """追加一批人脸记录"""
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        quality_scores = np.asarray(quality_scores, dtype=np.float64).reshape(-1)
+        if not (len(embeddings) == len(image_ids) == len(quality_scores)):
+            raise ValueError("embeddings、image_ids 和 quality_scores 的数量必须一致")
+        encoded_ids = [str(image_id).encode('utf-8') for image_id in image_ids]
+        for image_id in encoded_ids:
+            if len(image_id) > IMAGE_ID_DTYPE.itemsize:
+                raise ValueError(f"image_id 过长（最多 {IMAGE_ID_DTYPE.itemsize} 字节）: {image_id!r}")
+        if len(embeddings) == 0:
+            return
+
+        # 以已提交的记录数为起点写入各列，上次写入中断留下的半条记录会被覆盖
+        count = len(self._image_ids)
+        self._embeddings.append(embeddings, start=count)
+        self._quality_scores.append(quality_scores, start=count)
+        self._image_ids.append(np.array(encoded_ids, dtype=IMAGE_ID_DTYPE), start=count)
+        self.reload()
+
+    def clear(self):
+        """删除全部记录（先清空提交标记 image_ids，再截断其余各列）"""
+        self._image_ids.append(np.empty(0, dtype=IMAGE_ID_DTYPE), start=0)
+        self._embeddings.append(np.empty((0, self.dim), dtype=np.float32), start=0)
+        self._quality_scores.append(np.empty(0, dtype=np.float64), start=0)
+        self.reload()
+
+
+def migrate_pickle(pickle_path: str, store_root: str, dim: int = 512) -> EmbeddingStore:
+    """把旧版 pickle 格式（特征/ID/质量分数三个 list）一次性迁移为列式存储"""
+    with open(pickle_path, 'rb') as f:
+        model_data = pickle.load(f)
+    image_ids = model_data['image_ids']
+    quality_scores = model_data.get('quality_scores', [1.0] * len(image_ids))
+    features = model_data['face_features']
+
+    store = EmbeddingStore(store_root, dim=dim)
+    if len(store) > 0:
+        raise ValueError(f"目标存储已存在数据，拒绝重复迁移: {store_root}")
+    if features:
+        store.append(np.stack(features), image_ids, quality_scores)
+    print(f"已将 {pickle_path} 迁移到 {store_root}，共 {len(store)} 个人脸")
+    return store
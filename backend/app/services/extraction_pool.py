@@ -0,0 +1,212 @@
+import os
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+# 提取状态
+STATUS_PENDING = 'pending'        # 已进入队列，等待调度
+STATUS_PROCESSING = 'processing'  # 已提交给工作进程
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'        # 队列已满，留到分组时同步提取
+
+# 工作进程内的全局对象，每个进程各自持有一个 FaceAnalysis 会话
+_worker_analyzer = None
+_worker_assessor = None
+_worker_cache = None
+_worker_detection_scale = 1
+_worker_derivatives_root = None
+
+
+def _init_worker(model_name: str, det_size: Tuple[int, int], cache_dir: str, model_version: str,
+                 detection_scale: int = 1, metrics_dir: Optional[str] = None,
+                 derivatives_root: Optional[str] = None):
+    """工作进程初始化：加载人脸模型"""
+    global _worker_analyzer, _worker_assessor, _worker_cache, _worker_detection_scale, _worker_derivatives_root
+    from app.services.face_quality import FaceQualityAssessor
+    from app.services.feature_cache import FeatureCache
+    from app.services.model_registry import get_face_analyzer
+    from app.services.metrics import REGISTRY
+
+    if metrics_dir is not None:
+        REGISTRY.share(metrics_dir)
+
+    _worker_analyzer = get_face_analyzer(model_name, det_size)
+    _worker_assessor = FaceQualityAssessor()
+    _worker_cache = FeatureCache(cache_dir=cache_dir, model_name=model_name, model_version=model_version)
+    _worker_detection_scale = detection_scale
+    _worker_derivatives_root = derivatives_root
+    print(f"提取进程 {os.getpid()} 已就绪")
+
+
+def _extract_in_worker(image_path: str, content_hash: Optional[str] = None) -> int:
+    """在工作进程中提取单张图片的人脸特征，结果写入磁盘缓存，返回人脸数量
+
+    配置了衍生图目录时随后生成每个人脸的头像，分组封面不需要再按需裁剪。
+    """
+    from app.services.derivatives import generate_face_crops
+    from app.services.face_extraction import extract_face_features
+    from app.services.metrics import REGISTRY
+
+    if content_hash is None:
+        content_hash = _worker_cache.compute_hash(image_path)
+    try:
+        result = extract_face_features(_worker_analyzer, _worker_assessor, _worker_cache, image_path,
+                                       content_hash=content_hash, detection_scale=_worker_detection_scale)
+    finally:
+        REGISTRY.flush()
+    if result is None:
+        raise ValueError(f"无法读取图片: {image_path}")
+    if _worker_derivatives_root is not None and result.get('faces'):
+        try:
+            generate_face_crops(image_path, _worker_derivatives_root, content_hash, result['faces'])
+        except Exception as e:
+            print(f"生成人脸头像失败 ({image_path}): {str(e)}")
+    return result['total_faces']
+
+
+class ExtractionPool:
+    """上传后在后台提取人脸特征的进程池
+
+    上传接口把图片放入有界队列，调度线程按工作进程数量控制并发，
+    提取结果写入共享的 FeatureCache，分组时直接命中缓存。
+    """
+
+    def __init__(self, model_name: str, det_size: Tuple[int, int], cache_dir: str,
+                 model_version: str, num_workers: int = 2, queue_size: int = 1000, detection_scale: int = 1,
+                 metrics_dir: Optional[str] = None, derivatives_root: Optional[str] = None):
+        self.num_workers = num_workers
+        # metrics_dir 不为空时工作进程把指标快照写入该目录（见 metrics.MetricsRegistry.share）；
+        # derivatives_root 不为空时提取后生成人脸头像（见 derivatives.DerivativeStore）
+        self._initargs = (model_name, det_size, cache_dir, model_version, detection_scale, metrics_dir,
+                          derivatives_root)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        # 同时提交给进程池的任务数，避免一次性把整个队列塞进进程池
+        self._slots = threading.Semaphore(num_workers * 2)
+        self._lock = threading.Lock()
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._events: Dict[str, threading.Event] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+
+    def _ensure_started(self):
+        """首次提交任务时再启动进程池，避免拖慢服务启动"""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=self._initargs
+            )
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='extraction-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _set_status(self, image_id: str, status: str, **extra):
+        """更新任务状态；提取完成的结果已在特征缓存中，不再保留状态，失败和跳过的状态保留到 wait() 返回"""
+        with self._lock:
+            if status == STATUS_DONE:
+                self._status.pop(image_id, None)
+            else:
+                self._status[image_id] = {'status': status, **extra}
+            if status in (STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED) and image_id in self._events:
+                self._events.pop(image_id).set()
+
+    def submit(self, image_id: str, image_path: str, content_hash: Optional[str] = None) -> bool:
+        """将图片加入提取队列，队列已满时返回 False；已知内容哈希时工作进程不再重新读取文件计算"""
+        self._ensure_started()
+        with self._lock:
+            self._events[image_id] = threading.Event()
+        self._set_status(image_id, STATUS_PENDING)
+        try:
+            self._queue.put_nowait((image_id, image_path, content_hash))
+            return True
+        except queue.Full:
+            self._set_status(image_id, STATUS_SKIPPED)
+            return False
+
+    def _dispatch_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            image_id, image_path, content_hash = item
+            self._slots.acquire()
+            with self._lock:
+                cancelled = image_id not in self._status
+            if cancelled:
+                self._slots.release()
+                continue
+            self._set_status(image_id, STATUS_PROCESSING)
+            try:
+                future = self._executor.submit(_extract_in_worker, image_path, content_hash)
+            except Exception as e:
+                self._slots.release()
+                self._set_status(image_id, STATUS_FAILED, error=str(e))
+                continue
+            future.add_done_callback(lambda f, image_id=image_id: self._on_done(image_id, f))
+
+    def _on_done(self, image_id: str, future):
+        self._slots.release()
+        with self._lock:
+            if image_id not in self._status:
+                return
+        try:
+            face_count = future.result()
+            self._set_status(image_id, STATUS_DONE, faces=face_count)
+        except Exception as e:
+            print(f"后台提取失败 ({image_id}): {str(e)}")
+            self._set_status(image_id, STATUS_FAILED, error=str(e))
+
+    def wait(self, image_id: str, timeout: Optional[float] = None) -> bool:
+        """等待图片的后台提取结束，未在队列中的图片立即返回；结束后丢弃该图片的状态"""
+        with self._lock:
+            event = self._events.get(image_id)
+        if event is not None and not event.wait(timeout):
+            return False
+        with self._lock:
+            if image_id not in self._events:
+                self._status.pop(image_id, None)
+        return True
+
+    def get_status(self, image_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            status = self._status.get(image_id)
+            return dict(status) if status else None
+
+    def get_summary(self, image_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """汇总排队、进行中、失败和跳过的任务，已完成的任务见特征缓存"""
+        with self._lock:
+            ids = list(self._status.keys()) if image_ids is None else image_ids
+            items = {image_id: dict(self._status[image_id]) for image_id in ids if image_id in self._status}
+        counts = {status: 0 for status in (STATUS_PENDING, STATUS_PROCESSING, STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED)}
+        for item in items.values():
+            counts[item['status']] += 1
+        return {
+            'total': len(items),
+            **counts,
+            'items': items
+        }
+
+    def clear(self):
+        """清除提取状态；队列中尚未调度的任务会被跳过"""
+        with self._lock:
+            events = list(self._events.values())
+            self._status.clear()
+            self._events.clear()
+        for event in events:
+            event.set()
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+            executor.shutdown(wait=False, cancel_futures=True)
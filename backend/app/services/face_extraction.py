@@ -0,0 +1,336 @@
+import cv2
+import time
+import numpy as np
+from typing import List, Dict, Any, Optional, Callable
+from tqdm import tqdm
+
+from app.services.face_quality import FaceQualityAssessor
+from app.services.feature_cache import FeatureCache
+from app.services.metrics import DECODE_SECONDS, DETECTION_SECONDS, RECOGNITION_SECONDS
+
+# 金字塔检测支持的缩小倍数，JPEG 由 libjpeg 在解码时直接按比例缩小
+REDUCED_IMREAD_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+# 原图上截取人脸区域时向四周扩展的比例（相对人脸框宽高），保证对齐变换用到的像素都在区域内
+FACE_REGION_MARGIN = 0.5
+
+
+def read_image(image_path: str, flags: int = cv2.IMREAD_COLOR):
+    """解码图片并记录解码耗时，无法读取时返回 None"""
+    with DECODE_SECONDS.time():
+        return cv2.imread(image_path, flags)
+
+
+def detect_faces(face_analyzer, quality_assessor: FaceQualityAssessor, image) -> List[Dict[str, Any]]:
+    """检测图片中的人脸，过滤低质量人脸后识别，转换为可序列化的字典
+
+    与 BatchFaceExtractor 一样只运行检测和识别两个模型，检测和识别分别计时；
+    同一张图片的人脸一次性送入识别模型，低质量人脸不做识别。
+    """
+    from insightface.utils import face_align
+
+    if len(image.shape) == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    rec_model = face_analyzer.models['recognition']
+    with DETECTION_SECONDS.time():
+        bboxes, kpss = face_analyzer.det_model.detect(image, max_num=0, metric='default')
+    keep = bboxes[:, 4] > 0.5
+    if not keep.any():
+        return []
+    bboxes = bboxes[keep]
+    kpss = kpss[keep] if kpss is not None else None
+
+    # 同一张图片的人脸一次性评估质量
+    is_good, quality_scores, _ = quality_assessor.is_good_quality_batch(image, bboxes, kpss)
+    good = np.flatnonzero(is_good)
+    if len(good) == 0:
+        return []
+
+    crops = [face_align.norm_crop(image, landmark=kpss[i], image_size=rec_model.input_size[0]) for i in good]
+    with RECOGNITION_SECONDS.time():
+        embeddings = rec_model.get_feat(crops)
+
+    quality_faces = []
+    for i, embedding in zip(good, embeddings):
+        # 转换为可序列化的字典
+        quality_faces.append({
+            'bbox': bboxes[i, 0:4].tolist(),
+            'kps': kpss[i].tolist(),
+            'det_score': float(bboxes[i, 4]),
+            'features': embedding.flatten().tolist(),
+            'quality_score': float(quality_scores[i]),
+        })
+    return quality_faces
+
+
+def detect_faces_pyramid(det_model, quality_assessor: FaceQualityAssessor, image_path: str,
+                         scale: int, align_size: int) -> Optional[List[Any]]:
+    """在缩小解码的图片上检测人脸，在原分辨率的人脸区域上评估质量并对齐
+
+    返回 (人脸字典, 对齐后的人脸图像) 列表，人脸字典中的坐标为原图坐标，features 为 None；
+    图片无法读取时返回 None。只有检测到人脸的图片才会解码原分辨率图像，
+    解码后立即截取人脸区域，不在内存中保留整张原图。
+    """
+    from insightface.utils import face_align
+
+    small = read_image(image_path, REDUCED_IMREAD_FLAGS[scale])
+    if small is None:
+        return None
+    with DETECTION_SECONDS.time():
+        bboxes, kpss = det_model.detect(small, max_num=0, metric='default')
+    candidates = [i for i in range(bboxes.shape[0]) if bboxes[i, 4] > 0.5]
+    if not candidates:
+        return []
+
+    full = read_image(image_path)
+    if full is None:
+        return None
+    height, width = full.shape[:2]
+    # 缩小解码的尺寸向上取整，按实际尺寸换算坐标
+    ratio = np.array([width / small.shape[1], height / small.shape[0]], dtype=np.float32)
+    regions = []
+    for i in candidates:
+        bbox = bboxes[i, 0:4] * np.tile(ratio, 2)
+        kps = kpss[i] * ratio if kpss is not None else None
+        margin_x = (bbox[2] - bbox[0]) * FACE_REGION_MARGIN
+        margin_y = (bbox[3] - bbox[1]) * FACE_REGION_MARGIN
+        x0 = int(max(0, np.floor(bbox[0] - margin_x)))
+        y0 = int(max(0, np.floor(bbox[1] - margin_y)))
+        x1 = int(min(width, np.ceil(bbox[2] + margin_x)))
+        y1 = int(min(height, np.ceil(bbox[3] + margin_y)))
+        regions.append((i, bbox, kps, x0, y0, full[y0:y1, x0:x1].copy()))
+    del full
+
+    detected = []
+    for i, bbox, kps, x0, y0, region in regions:
+        offset = np.array([x0, y0], dtype=np.float32)
+        # 质量评估和对齐都在区域坐标系中进行
+        region_bbox = bbox - np.tile(offset, 2)
+        region_kps = kps - offset if kps is not None else None
+        is_good, quality_scores, _ = quality_assessor.is_good_quality_batch(
+            region, region_bbox[None], region_kps[None] if region_kps is not None else None)
+        if is_good[0]:
+            face_dict = {
+                'bbox': bbox.tolist(),
+                'kps': kps.tolist(),
+                'det_score': float(bboxes[i, 4]),
+                'features': None,
+                'quality_score': float(quality_scores[0]),
+            }
+            aimg = face_align.norm_crop(region, landmark=region_kps, image_size=align_size)
+            detected.append((face_dict, aimg))
+    return detected
+
+
+def extract_face_features(face_analyzer, quality_assessor: FaceQualityAssessor,
+                          feature_cache: FeatureCache, image_path: str,
+                          content_hash: Optional[str] = None,
+                          detection_scale: int = 1) -> Optional[Dict[str, Any]]:
+    """读取图片并提取人脸特征，优先使用磁盘缓存
+
+    供 ImageService 与后台提取进程共用，保证两条路径写入的缓存完全一致。
+    detection_scale 大于 1 时使用金字塔模式（见 detect_faces_pyramid）。
+    """
+    if content_hash is None:
+        content_hash = feature_cache.compute_hash(image_path)
+    cached = feature_cache.get(content_hash)
+    if cached is not None:
+        return cached
+
+    if detection_scale > 1:
+        rec_model = face_analyzer.models['recognition']
+        detected = detect_faces_pyramid(face_analyzer.det_model, quality_assessor, image_path,
+                                        detection_scale, rec_model.input_size[0])
+        if detected is None:
+            return None
+        faces = [face_dict for face_dict, _ in detected]
+        if detected:
+            with RECOGNITION_SECONDS.time():
+                embeddings = rec_model.get_feat([aimg for _, aimg in detected])
+            for face_dict, embedding in zip(faces, embeddings):
+                face_dict['features'] = embedding.flatten().tolist()
+    else:
+        # 读取图片
+        image = read_image(image_path)
+        if image is None:
+            return None
+
+        faces = detect_faces(face_analyzer, quality_assessor, image)
+    if not faces:
+        print("没0人脸！")
+        result = {'total_faces': 0, 'features': []}
+    else:
+        print(f"{len(faces)}人脸！")
+        result = {
+            'faces': faces,
+            'total_faces': len(faces)
+        }
+    try:
+        feature_cache.put(content_hash, result)
+    except Exception as e:
+        print(f"写入特征缓存失败: {str(e)}")
+    return result
+
+
+class BatchFaceExtractor:
+    """批量提取人脸特征
+
+    检测仍逐张图片进行，但对齐后的人脸会跨图片累积，凑满 batch_size 后
+    一次性送入 ArcFace 识别模型，避免识别模型以"单张照片人脸数"为批大小运行。
+    只运行检测和识别两个模型，跳过 buffalo_l 中分组用不到的关键点/性别年龄模型。
+    detection_scale 大于 1 时在缩小解码的图片上检测（见 detect_faces_pyramid）。
+    """
+
+    def __init__(self, face_analyzer, quality_assessor: FaceQualityAssessor,
+                 feature_cache: FeatureCache, batch_size: int = 64, detection_scale: int = 1):
+        from insightface.utils import face_align
+
+        self._norm_crop = face_align.norm_crop
+        self.det_model = face_analyzer.det_model
+        self.rec_model = face_analyzer.models['recognition']
+        self.quality_assessor = quality_assessor
+        self.feature_cache = feature_cache
+        self.batch_size = batch_size
+        self.detection_scale = detection_scale
+        self.stats = {}
+
+    def _reset_stats(self):
+        self.stats = {
+            'images': 0,
+            'cached_images': 0,
+            'cached_faces': 0,
+            'faces': 0,
+            'batches': 0,
+            'detect_seconds': 0.0,
+            'recognize_seconds': 0.0,
+            'total_seconds': 0.0,
+            'faces_per_sec': 0.0,
+        }
+
+    def _detect(self, image):
+        """检测并过滤人脸，返回 (人脸字典, 对齐后的人脸图像) 列表"""
+        if len(image.shape) == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+        with DETECTION_SECONDS.time():
+            bboxes, kpss = self.det_model.detect(image, max_num=0, metric='default')
+        detected = []
+        keep = bboxes[:, 4] > 0.5
+        if not keep.any():
+            return detected
+        bboxes = bboxes[keep]
+        kpss = kpss[keep] if kpss is not None else None
+        is_good, quality_scores, _ = self.quality_assessor.is_good_quality_batch(image, bboxes, kpss)
+        for i in np.flatnonzero(is_good):
+            face_dict = {
+                'bbox': bboxes[i, 0:4].tolist(),
+                'kps': kpss[i].tolist(),
+                'det_score': float(bboxes[i, 4]),
+                'features': None,
+                'quality_score': float(quality_scores[i]),
+            }
+            aimg = self._norm_crop(image, landmark=kpss[i], image_size=self.rec_model.input_size[0])
+            detected.append((face_dict, aimg))
+        return detected
+
+    def _recognize(self, pending_faces: List[Dict[str, Any]], pending_crops: List[np.ndarray]):
+        """对累积的人脸做一次批量识别"""
+        start = time.perf_counter()
+        embeddings = self.rec_model.get_feat(pending_crops)
+        elapsed = time.perf_counter() - start
+        self.stats['recognize_seconds'] += elapsed
+        RECOGNITION_SECONDS.observe(elapsed)
+        self.stats['batches'] += 1
+        for face_dict, embedding in zip(pending_faces, embeddings):
+            face_dict['features'] = embedding.flatten().tolist()
+
+    def extract(self, image_paths: List[str],
+                progress: Optional[Callable[[int, int], None]] = None,
+                content_hashes: Optional[Dict[str, str]] = None) -> Dict[str, Optional[Dict[str, Any]]]:
+        """批量提取多张图片的人脸特征，返回 {图片路径: 结果}，结果格式与 extract_face_features 一致
+
+        progress(已处理图片数, 图片总数) 在处理每张图片前以及全部完成后调用。
+        content_hashes 为上传时已计算的 {图片路径: 内容哈希}，命中时不再重新读取文件计算哈希。
+        """
+        content_hashes = content_hashes or {}
+        self._reset_stats()
+        total_start = time.perf_counter()
+        results: Dict[str, Optional[Dict[str, Any]]] = {}
+        # 等待识别的图片：路径 -> (内容哈希, 人脸字典列表)
+        waiting: Dict[str, Any] = {}
+        pending_faces: List[Dict[str, Any]] = []
+        pending_crops: List[np.ndarray] = []
+
+        def finish(path, content_hash, faces):
+            if faces:
+                result = {'faces': faces, 'total_faces': len(faces)}
+            else:
+                result = {'total_faces': 0, 'features': []}
+            try:
+                self.feature_cache.put(content_hash, result)
+            except Exception as e:
+                print(f"写入特征缓存失败: {str(e)}")
+            results[path] = result
+
+        def flush():
+            if pending_crops:
+                self._recognize(pending_faces, pending_crops)
+                pending_faces.clear()
+                pending_crops.clear()
+            for path, (content_hash, faces) in waiting.items():
+                finish(path, content_hash, faces)
+            waiting.clear()
+
+        for done, image_path in enumerate(tqdm(image_paths)):
+            if progress is not None:
+                progress(done, len(image_paths))
+            self.stats['images'] += 1
+            try:
+                content_hash = content_hashes.get(image_path) or self.feature_cache.compute_hash(image_path)
+                cached = self.feature_cache.get(content_hash)
+                if cached is not None:
+                    self.stats['cached_images'] += 1
+                    self.stats['cached_faces'] += cached['total_faces']
+                    results[image_path] = cached
+                    continue
+
+                start = time.perf_counter()
+                if self.detection_scale > 1:
+                    detected = detect_faces_pyramid(self.det_model, self.quality_assessor, image_path,
+                                                    self.detection_scale, self.rec_model.input_size[0])
+                else:
+                    image = read_image(image_path)
+                    detected = self._detect(image) if image is not None else None
+                self.stats['detect_seconds'] += time.perf_counter() - start
+                if detected is None:
+                    results[image_path] = None
+                    continue
+            except Exception as e:
+                print(f"Error extracting face features: {str(e)}")
+                results[image_path] = None
+                continue
+
+            faces = [face_dict for face_dict, _ in detected]
+            waiting[image_path] = (content_hash, faces)
+            pending_faces.extend(faces)
+            pending_crops.extend(aimg for _, aimg in detected)
+            self.stats['faces'] += len(faces)
+
+            if len(pending_crops) >= self.batch_size:
+                flush()
+        flush()
+        if progress is not None:
+            progress(len(image_paths), len(image_paths))
+
+        self.stats['total_seconds'] = time.perf_counter() - total_start
+        if self.stats['total_seconds'] > 0:
+            self.stats['faces_per_sec'] = self.stats['faces'] / self.stats['total_seconds']
+        print(f"批量提取完成: {self.stats['images']} 张图片 (缓存命中 {self.stats['cached_images']} 张), "
+              f"新提取 {self.stats['faces']} 个人脸, "
+              f"{self.stats['batches']} 个识别批次, {self.stats['faces_per_sec']:.1f} faces/sec")
+        return results
@@ -1,5 +1,24 @@
 import cv2
 import numpy as np
+from app.services.metrics import QUALITY_SECONDS, FACES_KEPT, FACES_REJECTED
+
+# 质量问题位掩码，与 assess_quality 返回的原因字符串一一对应
+QUALITY_FACE_TOO_SMALL = 1
+QUALITY_FACE_BLURRY = 2
+QUALITY_POOR_LIGHTING = 4
+QUALITY_FACE_TILTED = 8
+QUALITY_REASONS = (
+    (QUALITY_FACE_TOO_SMALL, "face_too_small"),
+    (QUALITY_FACE_BLURRY, "face_blurry"),
+    (QUALITY_POOR_LIGHTING, "poor_lighting"),
+    (QUALITY_FACE_TILTED, "face_tilted"),
+)
+
+
+def reasons_from_mask(mask) -> list:
+    """把位掩码转换为原因字符串列表（顺序与 assess_quality 一致）"""
+    return [name for bit, name in QUALITY_REASONS if int(mask) & bit]
+
 
 class FaceQualityAssessor:
     def __init__(self):
@@ -56,4 +75,75 @@ class FaceQualityAssessor:
     def is_good_quality(self, image, face, threshold=0.6):
         """判断人脸质量是否合格"""
         score, reasons = self.assess_quality(image, face)
-        return score >= threshold, score, reasons 
\ No newline at end of file
+        return score >= threshold, score, reasons
+
+    def assess_quality_batch(self, image, bboxes, kpss=None):
+        """批量评估同一张图片中所有人脸的质量，结果与逐个调用 assess_quality 完全一致
+
+        每个人脸的模糊度与亮度共用一次灰度转换，尺寸、阈值判断和姿态对所有人脸向量化计算。
+        Args:
+            image: BGR 图片
+            bboxes: (N, 4) 人脸框，多余的列（如检测分数）会被忽略
+            kpss: (N, 5, 2) 关键点，为 None 时跳过姿态检查
+        Returns:
+            (scores, reasons): float64 质量分数数组与 uint8 原因位掩码数组（见 QUALITY_* 常量）
+        """
+        bboxes = np.asarray(bboxes)
+        n = len(bboxes)
+        scores = np.ones(n, dtype=np.float64)
+        reasons = np.zeros(n, dtype=np.uint8)
+        if n == 0:
+            return scores, reasons
+        
+        # 1. 检查人脸大小
+        boxes = bboxes[:, :4].astype(int)
+        face_width = boxes[:, 2] - boxes[:, 0]
+        face_height = boxes[:, 3] - boxes[:, 1]
+        too_small = (face_width < self.min_face_size) | (face_height < self.min_face_size)
+        scores[too_small] *= 0.5
+        reasons[too_small] |= QUALITY_FACE_TOO_SMALL
+        
+        # 2/3. 检查模糊度和亮度（每个人脸只做一次灰度转换，两项检查共用）
+        blur_scores = np.full(n, np.inf)
+        brightness = np.full(n, (self.min_brightness + self.max_brightness) / 2)
+        for i, (x0, y0, x1, y1) in enumerate(boxes):
+            face_img = image[y0:y1, x0:x1]
+            if face_img.size > 0:
+                gray_face = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
+                blur_scores[i] = cv2.Laplacian(gray_face, cv2.CV_64F).var()
+                brightness[i] = np.mean(gray_face)
+        blurry = blur_scores < self.blur_threshold
+        scores[blurry] *= 0.7
+        reasons[blurry] |= QUALITY_FACE_BLURRY
+        poor_lighting = (brightness < self.min_brightness) | (brightness > self.max_brightness)
+        scores[poor_lighting] *= 0.8
+        reasons[poor_lighting] |= QUALITY_POOR_LIGHTING
+        
+        # 4. 检查人脸姿态
+        if kpss is not None:
+            kpss = np.asarray(kpss)
+            left_eye = kpss[:, 0]
+            right_eye = kpss[:, 1]
+            eye_angle = np.abs(np.arctan2(right_eye[:, 1] - left_eye[:, 1],
+                                          right_eye[:, 0] - left_eye[:, 0]) * 180 / np.pi)
+            tilted = eye_angle > 20  # 如果倾斜角度大于20度
+            scores[tilted] *= 0.9
+            reasons[tilted] |= QUALITY_FACE_TILTED
+        
+        return scores, reasons
+
+    def is_good_quality_batch(self, image, bboxes, kpss=None, threshold=0.6):
+        """批量判断人脸质量是否合格，返回 (是否合格, 质量分数, 原因位掩码) 三个数组"""
+        with QUALITY_SECONDS.time():
+            scores, reasons = self.assess_quality_batch(image, bboxes, kpss)
+        is_good = scores >= threshold
+        kept = int(is_good.sum())
+        if kept:
+            FACES_KEPT.inc(kept)
+        if kept < len(is_good):
+            rejected = reasons[~is_good]
+            for bit, name in QUALITY_REASONS:
+                count = int(np.count_nonzero(rejected & bit))
+                if count:
+                    FACES_REJECTED.inc(count, reason=name)
+        return is_good, scores, reasons
@@ -1,104 +1,625 @@
+import os
+import json
+import time
+import logging
 import numpy as np
 import faiss
 from sklearn.cluster import DBSCAN
-import pickle
-import os
-import insightface
-import onnxruntime as ort
+from scipy.sparse import csr_matrix
+from app.services.threshold_sweep import ThresholdSweep
+from app.services.embedding_store import EmbeddingStore, migrate_pickle
+from app.services.metrics import (INDEX_BUILD_SECONDS, INDEX_UPDATE_SECONDS, INDEX_SIZE,
+                                  DISTANCE_MATRIX_SECONDS, DBSCAN_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+# 超过该人脸数时改用基于 Faiss 近邻的稀疏聚类，避免 O(N²) 内存
+DENSE_CLUSTER_MAX_FACES = 20000
+# 稀疏聚类时每个人脸查询的近邻数
+SPARSE_NEIGHBORS = 32
+# 只对部分人脸聚类时，近邻中有一部分不在聚类范围内，按比例多取近邻，最多 SPARSE_SUBSET_OVERFETCH 倍
+SPARSE_SUBSET_OVERFETCH = 8
+# IVF 索引查询时访问的聚类中心数
+IVF_NPROBE = 16
+# 人脸索引类型（特征归一化后均使用内积，即余弦相似度）：
+#   flat      精确检索，保存原始 float32 向量（每个人脸 2KB）
+#   ivf_flat  倒排 + 原始向量
+#   ivf_sq8   倒排 + 8 位标量量化（每个人脸 512 字节）
+#   ivf_pq    倒排 + 乘积量化（每个人脸 PQ_SUBQUANTIZERS 字节）
+#   hnsw      图索引，保存原始向量和近邻图，内存最大、查询最快
+#   auto      按人脸数选择 flat / ivf_sq8 / ivf_pq
+INDEX_TYPES = ('auto', 'flat', 'ivf_flat', 'ivf_sq8', 'ivf_pq', 'hnsw')
+# 保存量化向量的索引，相似度是近似值，可以用原始特征重排
+QUANTIZED_INDEX_TYPES = ('ivf_sq8', 'ivf_pq')
+# auto 模式下人脸数低于该值使用精确索引，低于 SQ8_INDEX_MAX_FACES 使用 ivf_sq8，否则使用 ivf_pq
+FLAT_INDEX_MAX_FACES = 10000
+SQ8_INDEX_MAX_FACES = 200000
+PQ_SUBQUANTIZERS = 64
+# 训练 8 位 PQ 码本（每个子量化器 256 个中心）所需的最少人脸数（faiss 建议每个中心至少 39 个样本），
+# 显式指定 ivf_pq 但人脸数不足时使用精确索引
+PQ_MIN_TRAINING_FACES = 39 * 256
+HNSW_NEIGHBORS = 32
+HNSW_EF_SEARCH = 64
+# 重排时从量化索引取回 k * RERANK_FACTOR 个候选，再用原始特征计算精确相似度
+RERANK_FACTOR = 4
+# 重排时半径检索的阈值放宽量，覆盖量化相似度的误差
+RERANK_MARGIN = 0.05
+# 训练 IVF / PQ 时最多使用的样本数，以及向索引逐批添加特征的批大小
+INDEX_TRAIN_SAMPLE = 100000
+INDEX_ADD_BATCH = 65536
+# IVF 倒排列表的不均衡系数（faiss imbalance_factor，完全均衡时为 1）超过该值时重新训练索引
+IVF_IMBALANCE_THRESHOLD = 3.0
+# 持久化的索引保存在列式存储目录中：元数据文件记录当前版本，
+# 索引与其中的人脸行号按版本号命名，元数据最后原子替换，读取方始终看到一致的一组文件
+INDEX_META_FILE = 'faces_index.json'
+# 增量更新后不立即保存索引：未保存的新增/删除人脸数达到索引大小的 INDEX_SAVE_FRACTION，
+# 或距上次保存超过 INDEX_SAVE_INTERVAL 秒时才重新写入；其余变更由 flush_index（进程退出时）保存
+INDEX_SAVE_FRACTION = 0.05
+INDEX_SAVE_INTERVAL = 60.0
 
 class FaceRecognizer:
-    def __init__(self):
+    def __init__(self, store_path=None, index_type='auto', rerank=True):
+        """
+        Args:
+            store_path: 人脸特征的列式存储目录，为 None 时使用默认目录并迁移旧版 pickle 模型
+            index_type: 人脸索引类型，见 INDEX_TYPES
+            rerank: 量化索引（ivf_sq8 / ivf_pq）查询时是否用原始特征重排候选
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"不支持的索引类型: {index_type}，可选 {INDEX_TYPES}")
         self.index = None
-        self.face_features = []
-        self.image_ids = []
-        self.quality_scores = []
+        # 索引中的人脸行号（即 add_with_ids 的 id，EmbeddingStore 中的行号），升序
+        self.index_ids = np.empty(0, dtype=np.int64)
+        # 索引以只读内存映射方式加载时为 True，修改前需要重新完整读取
+        self._index_mmap = False
+        # 内存中的索引相对持久化版本尚未保存的新增/删除人脸数，以及上次保存的时间
+        self._unsaved_changes = 0
+        self._last_index_save = time.monotonic()
+        # 现存但不在索引中的人脸（持久化的索引落后于人脸记录时），查询时对它们做精确比较
+        self._unindexed_rows = np.empty(0, dtype=np.int64)
+        self._unindexed_features = None
+        # 配置的索引类型，以及最近一次实际构建的索引类型
+        self.index_type = index_type
+        self.built_index_type = None
+        self.rerank = rerank
+        self.feature_dim = 512
+        # 已持久化的人脸（内存映射，只读）
+        self.store = None
+        # 尚未保存的新增人脸
+        self._pending_features = []
+        self._pending_ids = []
+        self._pending_quality = []
+        self._merged = None
+        # 人脸登记表：image_id -> {人脸序号: 行号}，只包含现存的人脸；
+        # 列式存储只追加，重新登记或删除的人脸的旧行仍在存储中，但不再参与索引和聚类
+        self._registry = None
+        # 最近一次聚类的结果：每个人脸的分组标签（-1 为噪声）、所用阈值，以及各分组中心的索引
+        self.labels = None
+        # 最近一次 cluster_faces / assign_new_faces 中标签有变化的行号，保存聚类结果时只写这些行；
+        # None 表示全部行都需要写入
+        self.label_changes = None
+        self.cluster_threshold = None
+        self.centroid_index = None
+        self.centroid_labels = []
+        self._centroid_sums = None
+        self._centroid_counts = None
         
         # 使用相对路径
         model_dir = os.path.join(os.path.dirname(__file__), "..", "models")
         if not os.path.exists(model_dir):
             os.makedirs(model_dir)
+        # 旧版 pickle 模型，首次启动时迁移为同名的列式存储目录；指定 store_path 时只使用该存储
         self.model_path = os.path.join(model_dir, "face_model.pkl")
-        
-        # 根据系统选择最佳执行提供程序
-        providers = ort.get_available_providers()
-        if 'CoreMLExecutionProvider' in providers:
-            self.providers = ['CoreMLExecutionProvider']
-        else:
-            self.providers = ['CPUExecutionProvider']
-            
-        print(f"Using providers: {self.providers}")
-        
-        # 初始化人脸分析模型
-        self.face_analyzer = insightface.app.FaceAnalysis(
-            providers=self.providers,
-            allowed_modules=['detection', 'recognition']
-        )
-        self.face_analyzer.prepare(ctx_id=0)
+        self.store_path = store_path or os.path.splitext(self.model_path)[0] + "_store"
         
         # 确保在M2上使用优化的CPU实现
         faiss.omp_set_num_threads(4)
         
         # 如果存在模型文件，加载现有模型
-        if os.path.exists(self.model_path):
+        if EmbeddingStore.exists(self.store_path):
+            self.load_model(self.store_path)
+        elif store_path is None and os.path.exists(self.model_path):
             self.load_model(self.model_path)
     
-    def add_face(self, face_dict, image_id):
-        """添加人脸特征向量到索引"""
-        print("**添加人脸****")
-        self.face_features.append(np.array(face_dict['features'], dtype=np.float32))
-        self.image_ids.append(image_id)
-        self.quality_scores.append(face_dict['quality_score'])
+    def _merged_columns(self):
+        """合并已持久化和新增的人脸，返回 (特征矩阵, image_id 列表, 质量分数数组)
+
+        没有新增人脸时直接返回内存映射数组，不产生拷贝；结果缓存到下一次 upsert_face。
+        """
+        if self._merged is None:
+            if self.store is not None:
+                base_features = self.store.embeddings
+                base_ids = self.store.image_ids
+                base_quality = self.store.quality_scores
+            else:
+                base_features = np.empty((0, self.feature_dim), dtype=np.float32)
+                base_ids = []
+                base_quality = np.empty(0, dtype=np.float64)
+            if self._pending_features:
+                features = np.vstack([base_features, np.stack(self._pending_features)])
+                quality = np.concatenate([base_quality, np.asarray(self._pending_quality, dtype=np.float64)])
+                image_ids = base_ids + self._pending_ids
+            else:
+                features, quality, image_ids = base_features, base_quality, list(base_ids)
+            self._merged = (features, image_ids, quality)
+        return self._merged
+
+    @property
+    def face_features(self):
+        """全部人脸特征 (N, d) float32"""
+        return self._merged_columns()[0]
+
+    @property
+    def image_ids(self):
+        """每个人脸对应的图片ID"""
+        return self._merged_columns()[1]
+
+    @property
+    def quality_scores(self):
+        """每个人脸的质量分数"""
+        return self._merged_columns()[2]
     
-    def build_index(self):
-        """构建Faiss索引"""
+    @property
+    def registry(self):
+        """人脸登记表 image_id -> {人脸序号: 行号}；未调用 set_registry 时按存储中的行顺序生成（每行都是现存人脸）"""
+        if self._registry is None:
+            registry = {}
+            for row, image_id in enumerate(self.image_ids):
+                faces = registry.setdefault(image_id, {})
+                faces[len(faces)] = row
+            self._registry = registry
+        return self._registry
+
+    def set_registry(self, entries):
+        """用持久化的人脸记录 [(image_id, 人脸序号, 行号)] 替换登记表"""
+        registry = {}
+        for image_id, face_index, row in entries:
+            registry.setdefault(image_id, {})[int(face_index)] = int(row)
+        self._registry = registry
+
+    def upsert_face(self, image_id, face_index, face_dict):
+        """登记 (image_id, face_index) 的人脸特征，返回其行号
+
+        特征追加为新行（列式存储只追加）。该人脸已登记时替换为新行：旧行注销（见 _unregister_rows），
+        已加载的可写索引中旧行用 remove_ids 删除、新行用 add_with_ids 加入。
+        """
+        logger.debug("登记人脸: image_id=%s, face_index=%s", image_id, face_index)
+        old_row = self.registry.get(image_id, {}).get(face_index)
+        row = (len(self.store) if self.store is not None else 0) + len(self._pending_features)
+        self._pending_features.append(np.array(face_dict['features'], dtype=np.float32))
+        self._pending_ids.append(image_id)
+        self._pending_quality.append(face_dict['quality_score'])
+        self._merged = None
+        self.registry.setdefault(image_id, {})[face_index] = row
+        if old_row is not None:
+            self._unregister_rows(np.array([old_row], dtype=np.int64))
+            self._replace_index_row(old_row, row)
+        return row
+
+    def delete_face(self, image_id, face_index):
+        """注销单个人脸，返回其行号（未登记时返回 None）"""
+        faces = self.registry.get(image_id, {})
+        row = faces.pop(face_index, None)
+        if not faces:
+            self.registry.pop(image_id, None)
+        if row is not None:
+            self._unregister_rows(np.array([row], dtype=np.int64))
+        return row
+
+    def delete_image(self, image_id):
+        """注销图片的全部人脸，返回它们的行号"""
+        rows = np.array(sorted(self.registry.pop(image_id, {}).values()), dtype=np.int64)
+        self._unregister_rows(rows)
+        return rows.tolist()
+
+    def _unregister_rows(self, rows):
+        """注销的人脸标签置为 -1 并从所属分组的中心中减去，之后的增量分组不再受它们影响；
+        索引中的对应行在下次 update_index 时删除"""
+        if self.labels is None or len(rows) == 0:
+            return
+        rows_with_labels = rows[rows < len(self.labels)]
+        labels = self.labels[rows_with_labels]
+        clustered = labels >= 0
+        if clustered.any() and self._centroid_sums is not None:
+            np.subtract.at(self._centroid_sums, labels[clustered],
+                           self._normalize(self.face_features[rows_with_labels[clustered]]))
+            np.subtract.at(self._centroid_counts, labels[clustered], 1)
+            self._rebuild_centroid_index()
+        self.labels[rows_with_labels] = -1
+
+    def _replace_index_row(self, old_row, new_row):
+        """在已加载的可写索引中用新行替换旧行；只读映射的索引和 HNSW（不支持 remove_ids）留给 update_index 处理"""
+        if self.index is None or self._index_mmap or self.built_index_type == 'hnsw':
+            return
+        if old_row not in self.index_ids:
+            return
+        self.index.remove_ids(np.array([old_row], dtype=np.int64))
+        self._add_rows(self.index, np.array([new_row], dtype=np.int64))
+        self.index_ids = np.union1d(self.index_ids[self.index_ids != old_row], [new_row]).astype(np.int64)
+        self._unsaved_changes += 2
+
+    def has_image(self, image_id):
+        """图片是否已有登记的人脸"""
+        return bool(self.registry.get(image_id))
+
+    def rows_for_images(self, image_ids=None):
+        """登记表中指定图片（默认全部图片）的人脸行号，升序"""
+        registry = self.registry
+        if image_ids is None:
+            faces = registry.values()
+        else:
+            faces = [registry[image_id] for image_id in dict.fromkeys(image_ids) if image_id in registry]
+        rows = [row for image_faces in faces for row in image_faces.values()]
+        return np.array(sorted(rows), dtype=np.int64)
+    
+    @staticmethod
+    def choose_index_type(n):
+        """auto 模式下按人脸数选择索引类型"""
+        if n < FLAT_INDEX_MAX_FACES:
+            return 'flat'
+        if n < SQ8_INDEX_MAX_FACES:
+            return 'ivf_sq8'
+        return 'ivf_pq'
+
+    def _target_index_type(self, n):
+        """n 个人脸应使用的索引类型：auto 按人脸数选择；ivf_pq 在样本不足以训练码本时改用 flat"""
+        if self.index_type == 'auto':
+            return self.choose_index_type(n)
+        if self.index_type == 'ivf_pq' and n < PQ_MIN_TRAINING_FACES:
+            return 'flat'
+        return self.index_type
+
+    @staticmethod
+    def _ivf_nlist(n):
+        """IVF 聚类中心数：约 4·sqrt(N)，并保证每个中心至少有 39 个训练样本"""
+        return int(max(1, min(4 * np.sqrt(n), n // 39)))
+
+    @staticmethod
+    def _index_description(index_type, n):
+        """索引类型对应的 faiss.index_factory 描述串（不支持自定义 id 的索引外包 IDMap）"""
+        nlist = FaceRecognizer._ivf_nlist(n)
+        return {
+            'flat': 'IDMap,Flat',
+            'ivf_flat': f'IVF{nlist},Flat',
+            'ivf_sq8': f'IVF{nlist},SQ8',
+            # np：不做多义码训练（查询不使用汉明距离过滤，训练耗时却高出数倍）
+            'ivf_pq': f'IVF{nlist},PQ{PQ_SUBQUANTIZERS}np',
+            'hnsw': f'IDMap,HNSW{HNSW_NEIGHBORS}',
+        }[index_type]
+
+    @staticmethod
+    def _normalize(features):
+        """按行 L2 归一化，返回 float32"""
+        features = np.asarray(features, dtype=np.float32)
+        return features / np.linalg.norm(features, axis=1)[:, np.newaxis]
+
+    def _training_sample(self, rows):
+        """训练索引用的归一化特征，人脸数超过 INDEX_TRAIN_SAMPLE 时随机抽样"""
+        if len(rows) > INDEX_TRAIN_SAMPLE:
+            rows = np.sort(np.random.default_rng(0).choice(rows, INDEX_TRAIN_SAMPLE, replace=False))
+        return self._normalize(self.face_features[rows])
+
+    def _live_rows(self, live_offsets):
+        """应在索引中的人脸行号（升序去重），默认登记表中的全部人脸"""
+        n = len(self.face_features)
+        if live_offsets is None:
+            return self.rows_for_images()
+        rows = np.unique(np.asarray(live_offsets, dtype=np.int64))
+        return rows[(rows >= 0) & (rows < n)]
+
+    def _add_rows(self, index, rows):
+        """分批归一化并以行号为 id 加入索引，不会在内存中复制完整的特征矩阵"""
+        for batch_start in range(0, len(rows), INDEX_ADD_BATCH):
+            batch = rows[batch_start:batch_start + INDEX_ADD_BATCH]
+            index.add_with_ids(self._normalize(self.face_features[batch]), batch)
+
+    @staticmethod
+    def _configure_index(index, index_type):
+        """设置查询参数（不随索引文件保存）"""
+        if index_type.startswith('ivf'):
+            ivf = faiss.extract_index_ivf(index)
+            ivf.nprobe = min(ivf.nlist, IVF_NPROBE)
+        elif index_type == 'hnsw':
+            faiss.downcast_index(index.index).hnsw.efSearch = HNSW_EF_SEARCH
+
+    def build_index(self, live_offsets=None):
+        """重新训练并构建Faiss索引，完成后持久化
+
+        特征先做 L2 归一化，内积即余弦相似度；每个人脸以其行号为 id 加入索引。
+        live_offsets 为应加入索引的人脸行号，默认全部人脸。
+        """
         try:
-            if not self.face_features:
+            rows = self._live_rows(live_offsets)
+            n = len(rows)
+            if n == 0:
                 print("没有人脸特征，跳过索引构建")
                 return
                 
-            print(f"开始构建索引，特征数量: {len(self.face_features)}")
-            features = np.array(self.face_features).astype('float32')
-            d = features.shape[1]  # 特征维度
-            print(f"特征维度: {d}")
+            print(f"开始构建索引，特征数量: {n}")
+            start = time.perf_counter()
+            d = self.face_features.shape[1]  # 特征维度
             
             # 根据数据量选择合适的索引类型
-            if len(self.face_features) < 10:
-                print("使用 IndexFlatL2 索引")
-                self.index = faiss.IndexFlatL2(d)
-                self.index.add(features)
-            else:
-                print("使用 IndexIVFFlat 索引")
-                nlist = min(int(len(self.face_features) / 10), 100)
-                print(f"聚类中心数量: {nlist}")
-                
-                # 创建和训练量化器
-                quantizer = faiss.IndexFlatL2(d)
-                self.index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_L2)
-                
-                if not self.index.is_trained:
-                    print("开始训练索引...")
-                    try:
-                        self.index.train(features)
-                    except Exception as e:
-                        print(f"索引训练失败: {str(e)}")
-                        # 如果训练失败，回退到简单索引
-                        print("回退到 IndexFlatL2 索引")
-                        self.index = faiss.IndexFlatL2(d)
-                
-                print("添加特征到索引...")
-                self.index.add(features)
+            index_type = self._target_index_type(n)
+            if index_type != self.index_type and self.index_type != 'auto':
+                print(f"人脸数 {n} 少于训练 {self.index_type} 所需的 {PQ_MIN_TRAINING_FACES}，暂时使用 {index_type} 索引")
+            description = self._index_description(index_type, n)
+            print(f"使用 {index_type} 索引: {description}")
+            index = faiss.index_factory(d, description, faiss.METRIC_INNER_PRODUCT)
             
+            if not index.is_trained:
+                print("开始训练索引...")
+                try:
+                    index.train(self._training_sample(rows))
+                except Exception as e:
+                    print(f"索引训练失败: {str(e)}")
+                    # 如果训练失败（样本太少），回退到精确索引
+                    print("回退到 IndexFlatIP 索引")
+                    index_type = 'flat'
+                    index = faiss.IndexIDMap(faiss.IndexFlatIP(d))
+            self._configure_index(index, index_type)
+            
+            print("添加特征到索引...")
+            self._add_rows(index, rows)
+            self.index = index
+            self.index_ids = rows
+            self._index_mmap = False
+            self.built_index_type = index_type
+            
+            INDEX_BUILD_SECONDS.observe(time.perf_counter() - start)
+            INDEX_SIZE.set(self.index.ntotal)
+            self._save_index()
             print("索引构建完成")
             
         except Exception as e:
             print(f"构建索引时发生错误: {str(e)}")
             # 确保即使发生错误也能继续运行
             self.index = None
-    
-    def cluster_faces(self, threshold=0.7):
-        """使用DBSCAN聚类人脸"""
-        features = np.array(self.face_features)
-        quality_weights = np.array(self.quality_scores)
+            self.index_ids = np.empty(0, dtype=np.int64)
+            self.built_index_type = None
+
+    def update_index(self, live_offsets=None):
+        """增量维护Faiss索引，耗时与新增/删除的人脸数成正比
+
+        新人脸用 add_with_ids 加入，不在 live_offsets（默认全部人脸）中的人脸用 remove_ids 删除。
+        增量更新按 INDEX_SAVE_FRACTION / INDEX_SAVE_INTERVAL 合并后再持久化，重新构建时立即持久化。
+        以下情况改为调用 build_index 重新训练：没有可用的持久化索引；auto 模式下人脸数跨过了
+        索引类型的分界，或 ivf_pq 的人脸数达到 PQ_MIN_TRAINING_FACES；HNSW 索引需要删除人脸（不支持 remove_ids）；IVF 倒排列表的不均衡系数
+        超过 IVF_IMBALANCE_THRESHOLD。
+        """
+        rows = self._live_rows(live_offsets)
+        if (self.index is None or self._index_mmap) and not self.load_index(mmap=False):
+            return self.build_index(rows)
+        expected_type = self._target_index_type(len(rows))
+        if self.built_index_type != expected_type:
+            print(f"索引类型由 {self.built_index_type} 变为 {expected_type}，重新构建索引")
+            return self.build_index(rows)
+        
+        to_remove = np.setdiff1d(self.index_ids, rows, assume_unique=True)
+        to_add = np.setdiff1d(rows, self.index_ids, assume_unique=True)
+        if len(to_remove) == 0 and len(to_add) == 0:
+            return
+        if len(to_remove) > 0 and self.built_index_type == 'hnsw':
+            return self.build_index(rows)
+        
+        start = time.perf_counter()
+        if len(to_remove) > 0:
+            self.index.remove_ids(to_remove)
+        self._add_rows(self.index, to_add)
+        self.index_ids = rows
+        print(f"索引增量更新: 新增 {len(to_add)} 个人脸, 删除 {len(to_remove)} 个人脸")
+        
+        if self.built_index_type.startswith('ivf') and self.index.ntotal > 0:
+            imbalance = faiss.extract_index_ivf(self.index).invlists.imbalance_factor()
+            if imbalance > IVF_IMBALANCE_THRESHOLD:
+                print(f"倒排列表不均衡系数 {imbalance:.2f} 超过 {IVF_IMBALANCE_THRESHOLD}，重新训练索引")
+                return self.build_index(rows)
+        
+        INDEX_UPDATE_SECONDS.observe(time.perf_counter() - start)
+        INDEX_SIZE.set(self.index.ntotal)
+        self._unsaved_changes += len(to_add) + len(to_remove)
+        if (self._unsaved_changes >= INDEX_SAVE_FRACTION * self.index.ntotal
+                or time.monotonic() - self._last_index_save >= INDEX_SAVE_INTERVAL):
+            self._save_index()
+
+    def flush_index(self):
+        """保存尚未持久化的增量更新"""
+        if self._unsaved_changes > 0:
+            self._save_index()
+
+    def _read_index_meta(self):
+        try:
+            with open(os.path.join(self.store_path, INDEX_META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _index_files(self, version):
+        """(索引文件, 行号文件)"""
+        return (os.path.join(self.store_path, f'faces_index.{version}.faiss'),
+                os.path.join(self.store_path, f'faces_index.{version}.ids.npy'))
+
+    def _save_index(self):
+        """把索引写入新版本的文件并切换元数据，再删除旧版本的文件
+
+        只保存与列式存储一致的索引：还有未保存的新增人脸时跳过。
+        """
+        if self.store is None or self._pending_features or self.index is None:
+            return
+        meta = self._read_index_meta()
+        version = meta['version'] + 1 if meta else 1
+        index_path, ids_path = self._index_files(version)
+        faiss.write_index(self.index, index_path)
+        np.save(ids_path, self.index_ids)
+        meta_path = os.path.join(self.store_path, INDEX_META_FILE)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'version': version, 'index_type': self.built_index_type,
+                       'ntotal': int(self.index.ntotal)}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        if meta:
+            # 其他进程已映射的旧文件在删除后仍然可读
+            for path in self._index_files(meta['version']):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._unsaved_changes = 0
+        self._last_index_save = time.monotonic()
+
+    def load_index(self, mmap=True):
+        """加载持久化的索引，成功时返回 True
+
+        mmap 为 True 时以 IO_FLAG_MMAP 只读映射索引文件，加载耗时和内存与索引大小基本无关，
+        适合只做查询的进程；需要增量更新时由 update_index 重新完整读取。
+        """
+        meta = self._read_index_meta()
+        if meta is None:
+            return False
+        index_path, ids_path = self._index_files(meta['version'])
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP if mmap else 0)
+            ids = np.load(ids_path)
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"加载索引失败: {str(e)}")
+            return False
+        if index.ntotal != len(ids) or index.ntotal != meta['ntotal']:
+            print("索引文件不完整，忽略")
+            return False
+        self._configure_index(index, meta['index_type'])
+        self.index = index
+        self.index_ids = ids
+        self._index_mmap = mmap
+        self.built_index_type = meta['index_type']
+        self._unsaved_changes = 0
+        INDEX_SIZE.set(index.ntotal)
+        return True
+
+    def set_unindexed(self, live_offsets):
+        """记录现存人脸中不在索引里的部分（持久化的索引还没有保存最近的增量更新），
+        之后的 search / range_search 对它们做精确比较并合并进结果"""
+        rows = np.setdiff1d(self._live_rows(live_offsets), self.index_ids, assume_unique=True)
+        self._unindexed_rows = rows
+        self._unindexed_features = self._normalize(self.face_features[rows]) if len(rows) > 0 else None
+
+    def searchable_count(self):
+        """可查询的人脸数（索引中的人脸加上未入索引的现存人脸）"""
+        return (self.index.ntotal if self.index is not None else 0) + len(self._unindexed_rows)
+
+    def clear_index(self):
+        """删除内存中和持久化的索引（列式存储被清空时调用）"""
+        meta = self._read_index_meta()
+        if meta:
+            os.remove(os.path.join(self.store_path, INDEX_META_FILE))
+            for path in self._index_files(meta['version']):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.index = None
+        self.index_ids = np.empty(0, dtype=np.int64)
+        self._index_mmap = False
+        self.built_index_type = None
+        self._unsaved_changes = 0
+        self._unindexed_rows = np.empty(0, dtype=np.int64)
+        self._unindexed_features = None
+
+    def search(self, queries, k, batch_size=128):
+        """在人脸索引中查询归一化特征的 k 近邻
+
+        返回 (余弦相似度 (b, k), 人脸下标 (b, k))，近邻不足时下标为 -1。
+        量化索引且开启 rerank 时先取 k * RERANK_FACTOR 个候选，
+        再读取（内存映射的）原始特征计算精确相似度，保留最相似的 k 个。
+        set_unindexed 记录的人脸与索引结果合并。
+        """
+        similarities, neighbors = self._search_index(queries, k, batch_size)
+        if len(self._unindexed_rows) == 0:
+            return similarities, neighbors
+        extra = queries @ self._unindexed_features.T
+        similarities = np.hstack([similarities, extra])
+        neighbors = np.hstack([neighbors, np.broadcast_to(self._unindexed_rows, extra.shape)])
+        order = np.argsort(-similarities, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(similarities, order, axis=1), np.take_along_axis(neighbors, order, axis=1)
+
+    def _search_index(self, queries, k, batch_size):
+        if self.index.ntotal == 0:
+            return (np.full((len(queries), k), -1.0, dtype=np.float32),
+                    np.full((len(queries), k), -1, dtype=np.int64))
+        if not (self.rerank and self.built_index_type in QUANTIZED_INDEX_TYPES):
+            return self.index.search(queries, k)
+        
+        _, candidates = self.index.search(queries, min(k * RERANK_FACTOR, self.index.ntotal))
+        features = self.face_features
+        similarities = np.full(candidates.shape, -1.0, dtype=np.float32)
+        for start in range(0, len(queries), batch_size):
+            end = min(start + batch_size, len(queries))
+            block = candidates[start:end]
+            valid = block >= 0
+            vectors = self._normalize(features[np.where(valid, block, 0).ravel()])
+            sims = np.einsum('bcd,bd->bc', vectors.reshape(block.shape + (-1,)), queries[start:end])
+            similarities[start:end] = np.where(valid, sims, -1.0)
+        
+        order = np.argsort(-similarities, axis=1, kind='stable')[:, :k]
+        neighbors = np.take_along_axis(candidates, order, axis=1)
+        similarities = np.take_along_axis(similarities, order, axis=1)
+        return similarities, neighbors
+
+    def range_search(self, queries, min_similarity):
+        """在人脸索引中查询与归一化特征的余弦相似度不低于 min_similarity 的全部人脸
+
+        返回每个查询的 (余弦相似度, 人脸下标)，按相似度降序。
+        量化索引且开启 rerank 时先以 min_similarity - RERANK_MARGIN 取候选，
+        再用原始特征计算精确相似度过滤，避免量化误差漏掉阈值附近的人脸。
+        set_unindexed 记录的人脸与索引结果合并。
+        """
+        rerank = self.rerank and self.built_index_type in QUANTIZED_INDEX_TYPES
+        radius = min_similarity - RERANK_MARGIN if rerank else min_similarity
+        lims, similarities, neighbors = self.index.range_search(queries, radius)
+        features = self.face_features if rerank else None
+        results = []
+        for i in range(len(queries)):
+            sims = similarities[lims[i]:lims[i + 1]]
+            ids = neighbors[lims[i]:lims[i + 1]]
+            if rerank and len(ids) > 0:
+                sims = self._normalize(features[ids]) @ queries[i]
+            if len(self._unindexed_rows) > 0:
+                sims = np.concatenate([sims, self._unindexed_features @ queries[i]])
+                ids = np.concatenate([ids, self._unindexed_rows])
+            keep = sims >= min_similarity
+            sims, ids = sims[keep], ids[keep]
+            order = np.argsort(-sims, kind='stable')
+            results.append((sims[order], ids[order]))
+        return results
+
+    @staticmethod
+    def _apply_quality_weights(distances, quality_weights, block_size=1024):
+        """按质量权重就地调整距离矩阵
+
+        对每对 i<j：weight = sqrt(min(q_i, q_j))，d_ij = d_ji = max(d_ij / max(weight, 0.5), 0)。
+        按 block_size x block_size 的分块处理上三角，只在块内使用 float64 计算，
+        不会生成完整的 float64 N×N 矩阵。结果与逐对循环完全一致。
+        """
+        n = len(quality_weights)
+        weights = np.asarray(quality_weights, dtype=np.float64)
+        for row_start in range(0, n, block_size):
+            row_end = min(row_start + block_size, n)
+            row_weights = weights[row_start:row_end, np.newaxis]
+            for col_start in range(row_start, n, block_size):
+                col_end = min(col_start + block_size, n)
+                # 使用平方根减小权重影响，并限制最小权重
+                weight = np.sqrt(np.minimum(row_weights, weights[np.newaxis, col_start:col_end]))
+                block = distances[row_start:row_end, col_start:col_end] / np.maximum(weight, 0.5)
+                np.maximum(block, 0, out=block)
+                block = block.astype(distances.dtype, copy=False)
+                if col_start == row_start:
+                    # 对角块只更新严格上三角，并镜像到下三角
+                    upper = np.triu(np.ones(block.shape, dtype=bool), k=1)
+                    tile = distances[row_start:row_end, col_start:col_end]
+                    tile[upper] = block[upper]
+                    tile.T[upper] = block[upper]
+                else:
+                    distances[row_start:row_end, col_start:col_end] = block
+                    distances[col_start:col_end, row_start:row_end] = block.T
+
+    def _dense_distance_matrix(self, rows):
+        """计算 rows 中人脸两两之间的 N×N 质量加权余弦距离矩阵，返回 (距离矩阵, 分组平均相似度函数)"""
+        features = self.face_features[rows]
+        quality_weights = self.quality_scores[rows]
         
         print(f"开始计算 {len(features)} 个人脸的距离矩阵...")
         
@@ -113,34 +634,129 @@ class FaceRecognizer:
         distances = 1 - similarities  # 直接使用相似度的补值作为距离
         
         # 应用质量权重，但减小权重的影响
-        for i in range(len(features)):
-            for j in range(i + 1, len(features)):
-                weight = np.sqrt(min(quality_weights[i], quality_weights[j]))  # 使用平方根减小权重影响
-                adjusted_dist = distances[i][j] / max(weight, 0.5)  # 限制最小权重
-                distances[i][j] = distances[j][i] = max(adjusted_dist, 0)
-        
-        print("开始DBSCAN聚类...")
+        self._apply_quality_weights(distances, quality_weights)
         
         # 打印距离统计信息以帮助调试
         print(f"距离矩阵统计: min={distances.min():.4f}, max={distances.max():.4f}, "
               f"mean={distances.mean():.4f}, median={np.median(distances):.4f}")
         
+        def group_similarity(group_indices):
+            return np.mean(similarities[group_indices])
+        
+        return distances, group_similarity
+
+    def _sparse_distance_graph(self, face_rows, max_eps, k=SPARSE_NEIGHBORS, batch_size=4096):
+        """通过 Faiss 索引查询 face_rows 中每个人脸的 k 近邻，构建稀疏的质量加权距离图
+
+        只保留距离不超过 max_eps、且两端都在 face_rows 中的边，内存为 O(N·k)；
+        图中第 i 个节点对应 face_rows[i]。返回 (CSR 距离图, 分组平均相似度函数)。
+        """
+        n = len(face_rows)
+        if self.index is None:
+            self.update_index()
+        if self.index is None:
+            raise RuntimeError("Faiss 索引不可用，无法进行稀疏聚类")
+        
+        # 索引中的人脸行号 -> 图中的节点号，不参与聚类的人脸为 -1
+        positions = np.full(len(self.face_features), -1, dtype=np.int64)
+        positions[face_rows] = np.arange(n)
+        quality_weights = np.asarray(self.quality_scores[face_rows], dtype=np.float64)
+        # 索引中还有其他人脸时多取近邻，过滤后每个人脸仍有约 k 个聚类范围内的近邻
+        overfetch = min(SPARSE_SUBSET_OVERFETCH, int(np.ceil(self.index.ntotal / n)))
+        k = min(k * overfetch, self.index.ntotal)
+        
+        print(f"开始查询 {n} 个人脸的 {k} 近邻...")
+        rows, cols, dists, sims = [], [], [], []
+        for start in range(0, n, batch_size):
+            end = min(start + batch_size, n)
+            scores, neighbors = self.search(self._normalize(self.face_features[face_rows[start:end]]), k)
+            row_idx = np.repeat(np.arange(start, end), k)
+            col_idx = np.where(neighbors >= 0, positions[neighbors], -1).ravel()
+            valid = (col_idx >= 0) & (col_idx != row_idx)
+            row_idx, col_idx = row_idx[valid], col_idx[valid]
+            
+            # 内积即余弦相似度，按与稠密模式相同的规则转为加权距离
+            similarity = np.clip(scores.ravel()[valid], 0, 1)
+            weight = np.sqrt(np.minimum(quality_weights[row_idx], quality_weights[col_idx]))
+            distance = np.maximum((1 - similarity) / np.maximum(weight, 0.5), 0)
+            
+            keep = distance <= max_eps
+            rows.append(row_idx[keep])
+            cols.append(col_idx[keep])
+            dists.append(distance[keep].astype(np.float32))
+            sims.append(similarity[keep].astype(np.float32))
+        
+        # 近邻关系不一定对称，这里取并集；再为每个点加上自身（距离 0）
+        diag = np.arange(n)
+        rows_all = np.concatenate(rows + cols + [diag])
+        cols_all = np.concatenate(cols + rows + [diag])
+        dists_all = np.concatenate(dists + dists + [np.zeros(n, dtype=np.float32)])
+        sims_all = np.concatenate(sims + sims + [np.ones(n, dtype=np.float32)])
+        
+        # 去除重复边，保留距离最小的一条
+        keys = rows_all.astype(np.int64) * n + cols_all
+        order = np.lexsort((dists_all, keys))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = keys[order][1:] != keys[order][:-1]
+        order = order[first]
+        
+        shape = (n, n)
+        distances = csr_matrix((dists_all[order], (rows_all[order], cols_all[order])), shape=shape)
+        similarities = csr_matrix((sims_all[order], (rows_all[order], cols_all[order])), shape=shape)
+        print(f"稀疏距离图: {distances.nnz} 条边 (平均每个人脸 {distances.nnz / n:.1f} 条)")
+        
+        def group_similarity(group_indices):
+            return similarities[group_indices].data.mean()
+        
+        return distances, group_similarity
+
+    def cluster_faces(self, threshold=0.7, method='auto', progress=None, rows=None):
+        """使用DBSCAN聚类人脸
+
+        Args:
+            rows: 参与聚类的人脸行号（升序），默认登记表中的全部人脸；
+                聚类结果替换上一次的结果，不在 rows 中的人脸标签为 -1
+            method: 'dense' 计算完整的 N×N 距离矩阵；'sparse' 通过 Faiss 索引查询近邻
+                构建稀疏距离图，内存为 O(N·k)；'auto' 在人脸数超过 DENSE_CLUSTER_MAX_FACES 时使用 sparse
+            progress: 可选的进度回调 progress(阶段, 当前, 总数)，阶段依次为
+                'distance_matrix'、'threshold_sweep'、'clustering'
+        """
+        if progress is None:
+            progress = lambda stage, current=0, total=0: None
         # 自适应确定最佳阈值
         test_thresholds = np.linspace(0.3, 0.8, 10)
         best_threshold = None
         best_num_clusters = float('inf')
         target_clusters = 8  # 目标分组数
         
+        rows = self.rows_for_images() if rows is None else np.asarray(rows, dtype=np.int64)
+        if method == 'auto':
+            method = 'sparse' if len(rows) > DENSE_CLUSTER_MAX_FACES else 'dense'
+        
+        progress('distance_matrix', 0, 1)
+        with DISTANCE_MATRIX_SECONDS.time(method=method):
+            if method == 'sparse':
+                distances, group_similarity = self._sparse_distance_graph(rows, max_eps=test_thresholds.max())
+            else:
+                distances, group_similarity = self._dense_distance_matrix(rows)
+        progress('distance_matrix', 1, 1)
+        
+        print("开始DBSCAN聚类...")
+        
         print("\n寻找最佳聚类阈值...")
-        for test_threshold in test_thresholds:
-            clustering = DBSCAN(
-                eps=test_threshold,
-                min_samples=3,  # 增加最小样本数，使分组更稳定
-                metric='precomputed'
+        progress('threshold_sweep', 0, len(test_thresholds))
+        # 只扫描一次距离矩阵，得到每个候选阈值下 DBSCAN 的分组数
+        sweep_builder = ThresholdSweep.from_sparse if method == 'sparse' else ThresholdSweep.from_dense
+        with DBSCAN_SECONDS.time(phase='threshold_sweep'):
+            sweep = sweep_builder(
+                distances,
+                max_eps=test_thresholds.max(),
+                min_samples=3  # 增加最小样本数，使分组更稳定
             )
-            test_labels = clustering.fit_predict(distances)
-            num_clusters = len(set(test_labels)) - (1 if -1 in test_labels else 0)
+            cluster_counts = sweep.cluster_counts(test_thresholds)
+        for i, (test_threshold, num_clusters) in enumerate(zip(test_thresholds, cluster_counts), 1):
             print(f"阈值 {test_threshold:.2f} -> 分组数 {num_clusters}")
+            progress('threshold_sweep', i, len(test_thresholds))
             
             # 选择最接近目标分组数的阈值
             if abs(num_clusters - target_clusters) < abs(best_num_clusters - target_clusters):
@@ -150,12 +766,15 @@ class FaceRecognizer:
         print(f"\n选择最佳阈值: {best_threshold:.2f}")
         
         # 使用最佳阈值进行最终聚类
+        progress('clustering', 0, 1)
         clustering = DBSCAN(
             eps=best_threshold,
             min_samples=3,
             metric='precomputed'
         )
-        labels = clustering.fit_predict(distances)
+        with DBSCAN_SECONDS.time(phase='final'):
+            labels = clustering.fit_predict(distances)
+        progress('clustering', 1, 1)
         
         # 统计聚类结果
         unique_labels = set(labels)
@@ -163,9 +782,33 @@ class FaceRecognizer:
         print(f"聚类完成: 找到 {len(unique_labels) - (1 if -1 in unique_labels else 0)} 个分组")
         print(f"未分组的人脸: {noise_count} 个")
         
+        # 记录聚类结果（按存储中的行号），供增量分组使用
+        previous = self.labels
+        self.labels = np.full(len(self.face_features), -1, dtype=np.int64)
+        self.labels[rows] = labels
+        if previous is None:
+            self.label_changes = None
+        else:
+            # 上次聚类之后新增的行原来没有标签（-1）
+            compared = np.full(len(self.labels), -1, dtype=np.int64)
+            compared[:min(len(previous), len(compared))] = previous[:len(compared)]
+            self.label_changes = np.flatnonzero(self.labels != compared)
+        self.cluster_threshold = float(best_threshold)
+        self._update_centroids()
+        
+        return self._format_groups(rows, np.asarray(labels), group_similarity)
+
+    def _format_groups(self, rows, labels, group_similarity):
+        """将聚类标签整理为 API 需要的分组格式
+
+        labels[i] 为人脸 rows[i] 的标签，group_similarity 接收分组成员在 rows 中的下标。
+        """
         groups = {}
-        # 计算每个分组的平均相似度和人脸数量
-        for label, image_id, quality in zip(labels, self.image_ids, self.quality_scores):
+        image_ids = self.image_ids
+        quality_scores = self.quality_scores
+        # 计算每个分组的人脸数量
+        for label, row in zip(labels, rows):
+            image_id, quality = image_ids[row], quality_scores[row]
             if label == -1:  # 未分组的人脸
                 continue
             if label not in groups:
@@ -173,24 +816,18 @@ class FaceRecognizer:
                 groups[label] = {
                     'image_ids': [],
                     'quality_scores': [],
-                    'similarity_scores': [],
                     'face_count': 0
                 }
             groups[label]['image_ids'].append(image_id)
             groups[label]['quality_scores'].append(quality)
             groups[label]['face_count'] += 1
-            
-            # 计算该人脸与分组内其他人脸的平均相似度
-            group_indices = [i for i, l in enumerate(labels) if l == label]
-            if len(group_indices) > 1:
-                group_similarities = similarities[group_indices]
-                avg_similarity = np.mean(group_similarities)
-                groups[label]['similarity_scores'].append(avg_similarity)
         
         # 转换为API需要的格式
         result_groups = []
         for label, group_data in groups.items():
-            avg_similarity = np.mean(group_data['similarity_scores']) if group_data['similarity_scores'] else 0.0
+            # 分组内人脸与其他人脸的平均相似度
+            group_indices = np.flatnonzero(labels == label)
+            avg_similarity = group_similarity(group_indices) if len(group_indices) > 1 else 0.0
             result_groups.append({
                 'group_id': str(label),
                 'name': f'Group {label}',
@@ -206,21 +843,150 @@ class FaceRecognizer:
                   f"相似度: {group['similarity_score']:.2f}")
         
         return result_groups
+
+    def _update_centroids(self):
+        """根据当前标签重新计算各分组的中心向量，并重建中心索引（只读取已分组人脸的特征）"""
+        labels = self.labels
+        clustered = np.flatnonzero(labels >= 0)
+        num_labels = int(labels.max()) + 1 if len(clustered) > 0 else 0
+        self._centroid_sums = np.zeros((num_labels, self.feature_dim), dtype=np.float64)
+        self._centroid_counts = np.bincount(labels[clustered], minlength=num_labels)
+        if len(clustered) > 0:
+            np.add.at(self._centroid_sums, labels[clustered], self._normalize(self.face_features[clustered]))
+        self._rebuild_centroid_index()
+
+    def _rebuild_centroid_index(self):
+        """用归一化后的分组中心构建内积索引"""
+        valid = np.flatnonzero(self._centroid_counts > 0)
+        self.centroid_labels = valid.tolist()
+        if len(valid) == 0:
+            self.centroid_index = None
+            return
+        centroids = self._centroid_sums[valid]
+        centroids = (centroids / np.linalg.norm(centroids, axis=1)[:, np.newaxis]).astype('float32')
+        self.centroid_index = faiss.IndexFlatIP(centroids.shape[1])
+        self.centroid_index.add(centroids)
+
+    def restore_clusters(self, labels, threshold):
+        """恢复持久化的聚类结果（每个人脸的标签和阈值），用于重启后继续增量分组"""
+        labels = np.asarray(labels)
+        if len(labels) != len(self.face_features):
+            raise ValueError(f"聚类标签数量 {len(labels)} 与人脸数量 {len(self.face_features)} 不一致")
+        self.labels = labels
+        self.cluster_threshold = float(threshold)
+        self._update_centroids()
+
+    def has_clusters(self):
+        """是否已有可用于增量分组的聚类结果"""
+        return self.labels is not None and self.centroid_index is not None
+
+    def assign_new_faces(self, min_samples=3, rows=None):
+        """增量分组：把上次聚类之后登记的人脸分配到已有分组
+
+        新人脸与最近分组中心的（质量加权）余弦距离不超过上次聚类阈值时直接归入该分组，
+        其余人脸只在彼此之间做一次小规模 DBSCAN，形成新分组或保留为噪声。
+        没有可用的聚类结果时退化为全量聚类。rows 为返回结果包含的人脸行号，默认登记表中的全部人脸。
+        """
+        if rows is None:
+            rows = self.rows_for_images()
+        rows = np.asarray(rows, dtype=np.int64)
+        if not self.has_clusters():
+            return self.cluster_faces(rows=rows)
+        
+        n = len(self.face_features)
+        start = len(self.labels)
+        if start < n:
+            # 上次聚类之后新增的行中仍登记在册的人脸（重新登记的人脸已替换为新行）
+            new_rows = self.rows_for_images()
+            new_rows = new_rows[new_rows >= start]
+            self.labels = np.concatenate([self.labels, np.full(n - start, -1, dtype=self.labels.dtype)])
+        else:
+            new_rows = np.empty(0, dtype=np.int64)
+        # 只有新人脸的标签会变化
+        self.label_changes = new_rows
+        if len(new_rows) > 0:
+            new_features = self._normalize(self.face_features[new_rows])
+            new_quality = np.asarray(self.quality_scores[new_rows], dtype=np.float64)
+            print(f"增量分组: {len(new_rows)} 个新人脸, 阈值 {self.cluster_threshold:.2f}")
+            
+            # 1. 与已有分组中心比较
+            sims, nearest = self.centroid_index.search(new_features, 1)
+            similarity = np.clip(sims[:, 0], 0, 1)
+            weight = np.maximum(np.sqrt(new_quality), 0.5)
+            distance = (1 - similarity) / weight
+            new_labels = np.full(len(new_rows), -1, dtype=self.labels.dtype)
+            assigned = distance <= self.cluster_threshold
+            new_labels[assigned] = np.asarray(self.centroid_labels)[nearest[assigned, 0]]
+            print(f"分配到已有分组: {int(assigned.sum())} 个")
+            
+            # 2. 未分配的人脸做局部聚类
+            rest = np.flatnonzero(~assigned)
+            if len(rest) >= min_samples:
+                rest_features = new_features[rest]
+                rest_distances = 1 - np.clip(np.dot(rest_features, rest_features.T), 0, 1)
+                self._apply_quality_weights(rest_distances, new_quality[rest])
+                with DBSCAN_SECONDS.time(phase='incremental'):
+                    local_labels = DBSCAN(
+                        eps=self.cluster_threshold,
+                        min_samples=min_samples,
+                        metric='precomputed'
+                    ).fit_predict(rest_distances)
+                next_label = len(self._centroid_counts)
+                clustered = local_labels >= 0
+                new_labels[rest[clustered]] = local_labels[clustered] + next_label
+                print(f"新建分组: {len(set(local_labels[clustered]))} 个")
+            
+            # 3. 更新分组中心
+            self.labels[new_rows] = new_labels
+            num_labels = int(self.labels.max()) + 1 if (self.labels >= 0).any() else 0
+            if num_labels > len(self._centroid_counts):
+                extra = num_labels - len(self._centroid_counts)
+                self._centroid_sums = np.vstack([self._centroid_sums, np.zeros((extra, self._centroid_sums.shape[1]))])
+                self._centroid_counts = np.concatenate([self._centroid_counts, np.zeros(extra, dtype=self._centroid_counts.dtype)])
+            mask = new_labels >= 0
+            np.add.at(self._centroid_sums, new_labels[mask], new_features[mask])
+            np.add.at(self._centroid_counts, new_labels[mask], 1)
+            self._rebuild_centroid_index()
+        
+        def group_similarity(group_indices):
+            # 增量模式下使用分组成员与分组中心的平均相似度
+            group_rows = rows[group_indices]
+            label = self.labels[group_rows[0]]
+            centroid = self._centroid_sums[label] / np.linalg.norm(self._centroid_sums[label])
+            return np.mean(np.dot(self._normalize(self.face_features[group_rows]), centroid))
+        
+        return self._format_groups(rows, self.labels[rows], group_similarity)
     
     def save_model(self, path):
-        """保存模型到文件"""
-        model_data = {
-            'face_features': self.face_features,
-            'image_ids': self.image_ids,
-            'quality_scores': self.quality_scores
-        }
-        with open(path, 'wb') as f:
-            pickle.dump(model_data, f)
+        """保存模型到列式存储目录（只追加新增的人脸）"""
+        if self.store is not None and os.path.abspath(path) == os.path.abspath(self.store.root):
+            store = self.store
+            store.append(self._pending_features, self._pending_ids, self._pending_quality)
+        else:
+            store = EmbeddingStore(path, dim=self.feature_dim)
+            if len(store) > 0:
+                raise ValueError(f"目标存储已存在数据: {path}")
+            store.append(self.face_features, self.image_ids, self.quality_scores)
+        self.store = store
+        self._pending_features = []
+        self._pending_ids = []
+        self._pending_quality = []
+        self._merged = None
     
     def load_model(self, path):
-        """从文件加载模型"""
-        with open(path, 'rb') as f:
-            model_data = pickle.load(f)
-        self.face_features = model_data['face_features']
-        self.image_ids = model_data['image_ids']
-        self.quality_scores = model_data.get('quality_scores', [1.0] * len(self.image_ids)) 
\ No newline at end of file
+        """从文件加载模型
+
+        path 为列式存储目录时以内存映射方式打开；为旧版 .pkl 文件时先迁移到同级的
+        <name>_store 目录（只迁移一次），之后都从列式存储加载。
+        """
+        if path.endswith('.pkl'):
+            store_root = os.path.splitext(path)[0] + "_store"
+            if not EmbeddingStore.exists(store_root) or len(EmbeddingStore(store_root, dim=self.feature_dim)) == 0:
+                migrate_pickle(path, store_root, dim=self.feature_dim)
+            path = store_root
+        self.store = EmbeddingStore(path, dim=self.feature_dim)
+        self._pending_features = []
+        self._pending_ids = []
+        self._pending_quality = []
+        self._merged = None
+        self._registry = None
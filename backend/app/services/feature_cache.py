@@ -0,0 +1,94 @@
+import os
+import hashlib
+import tempfile
+import numpy as np
+from typing import Dict, Any, Optional
+
+# 缓存格式版本，修改存储字段时递增，旧缓存会自动失效
+CACHE_FORMAT_VERSION = 1
+
+
+class FeatureCache:
+    """基于文件内容哈希的人脸特征磁盘缓存
+
+    每张图片的检测与识别结果（bbox、kps、det_score、quality_score 和 512 维特征）
+    以 npz 形式保存，键为 文件内容哈希 + 模型名称/版本，重复分组时无需再次推理。
+    """
+
+    def __init__(self, cache_dir: str, model_name: str = 'buffalo_l', model_version: str = '1'):
+        self.model_key = f"{model_name}-{model_version}-f{CACHE_FORMAT_VERSION}"
+        self.cache_dir = os.path.join(cache_dir, self.model_key)
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def compute_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+        """分块计算文件内容的 SHA-256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _cache_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, content_hash[:2], f"{content_hash}.npz")
+
+    def contains(self, content_hash: str) -> bool:
+        return os.path.exists(self._cache_path(content_hash))
+
+    def get(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """读取缓存的特征，格式与 ImageService.extract_face_features 的返回值一致"""
+        path = self._cache_path(content_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                bboxes = data['bboxes']
+                kps = data['kps']
+                det_scores = data['det_scores']
+                quality_scores = data['quality_scores']
+                embeddings = data['embeddings']
+        except Exception as e:
+            print(f"读取特征缓存失败 ({content_hash}): {str(e)}")
+            return None
+
+        if len(embeddings) == 0:
+            return {'total_faces': 0, 'features': []}
+
+        faces = []
+        for i in range(len(embeddings)):
+            faces.append({
+                'bbox': bboxes[i].tolist(),
+                'kps': kps[i].tolist(),
+                'det_score': float(det_scores[i]),
+                'features': embeddings[i].tolist(),
+                'quality_score': float(quality_scores[i]),
+            })
+        return {
+            'faces': faces,
+            'total_faces': len(faces)
+        }
+
+    def put(self, content_hash: str, result: Dict[str, Any]):
+        """写入特征缓存（先写临时文件再原子替换，避免并发读到半个文件）"""
+        faces = result.get('faces', []) if result else []
+        path = self._cache_path(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f,
+                    bboxes=np.array([face['bbox'] for face in faces], dtype=np.float32).reshape(-1, 4),
+                    kps=np.array([face['kps'] for face in faces], dtype=np.float32).reshape(-1, 5, 2),
+                    det_scores=np.array([face['det_score'] for face in faces], dtype=np.float32),
+                    quality_scores=np.array([face['quality_score'] for face in faces], dtype=np.float64),
+                    embeddings=np.array([face['features'] for face in faces], dtype=np.float32).reshape(-1, 512),
+                )
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
@@ -1,20 +1,25 @@
 import os
 import uuid
-import cv2
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Callable
 from PIL import Image
 from datetime import datetime
-import torch
-import insightface
-from insightface.app import FaceAnalysis
-import faiss
 from pathlib import Path
 import io
-import json
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from tqdm import tqdm
 from fastapi import UploadFile
 
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只支持单进程运行
+    fcntl = None
+
 # Set environment variables to control threading
 os.environ['OMP_NUM_THREADS'] = '1'
 os.environ['OPENBLAS_NUM_THREADS'] = '1'
@@ -28,28 +33,173 @@ from app.models.schemas import Image as ImageModel
 from app.models.schemas import ImageGroup, GroupResult, ImageFeatures
 from app.services.face_quality import FaceQualityAssessor
 from app.services.face_recognizer import FaceRecognizer
+from app.services.embedding_store import EmbeddingStore
+from app.services.feature_cache import FeatureCache
+from app.services.face_extraction import detect_faces, extract_face_features, BatchFaceExtractor, REDUCED_IMREAD_FLAGS
+from app.services.extraction_pool import ExtractionPool, STATUS_PENDING, STATUS_DONE
+from app.services.perceptual_hash import PerceptualHashIndex, dhash
+from app.services.derivatives import (DerivativeStore, generate_thumbnails, generate_face_crop, generate_face_crops,
+                                      THUMBNAIL_SIZES)
+from app.services.metadata_store import MetadataStore
+from app.services.metrics import REGISTRY
+from app.services.model_registry import get_face_analyzer, FACE_MODEL_NAME, FACE_DET_SIZE
+
+# 上传文件每次读取并写入磁盘的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 探测图片尺寸时保留的文件头字节数，文件头更长时退回到读取磁盘上的文件
+IMAGE_HEADER_PROBE_SIZE = 256 * 1024
+
 class ImageService:
-    def __init__(self, upload_dir: str):
+    def __init__(self, upload_dir: str, extraction_workers: int = 0, extraction_queue_size: int = 1000,
+                 recognition_batch_size: int = 64, upload_concurrency: int = 4,
+                 near_duplicate_distance: Optional[int] = None, detection_scale: int = 1,
+                 thumbnail_workers: int = 1, remote_inference: bool = False,
+                 index_type: str = 'auto', index_rerank: bool = True):
         self.upload_dir = upload_dir
+        # 为 True 时人脸模型只在专用推理进程（app.inference_worker）中加载，本进程不做推理
+        self.remote_inference = remote_inference
         if not os.path.exists(upload_dir):
             os.makedirs(upload_dir)
+        # 同时写入磁盘的上传文件数，每个文件只在内存中保留一个分块
+        self.upload_concurrency = max(1, upload_concurrency)
+        self._upload_executor = ThreadPoolExecutor(max_workers=self.upload_concurrency, thread_name_prefix='upload-io')
         
-        # 初始化人脸分析模型
-        self.face_analyzer = FaceAnalysis(
-            name='buffalo_l',  # 使用大模型以提高准确率
-            providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
+        self.quality_assessor = FaceQualityAssessor()
+        # 人脸特征磁盘缓存，按文件内容哈希 + 模型版本索引
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(upload_dir)), "cache", "features")
+        model_version = f"det{FACE_DET_SIZE[0]}x{FACE_DET_SIZE[1]}"
+        # 金字塔检测的结果与原图检测略有差异，缓存分开存放
+        if detection_scale not in REDUCED_IMREAD_FLAGS:
+            raise ValueError(f"不支持的检测缩小倍数: {detection_scale}，可选 {sorted(REDUCED_IMREAD_FLAGS)}")
+        self.detection_scale = detection_scale
+        if detection_scale > 1:
+            model_version += f"-pyr{detection_scale}"
+        self.feature_cache = FeatureCache(
+            cache_dir=cache_dir,
+            model_name=FACE_MODEL_NAME,
+            model_version=model_version
         )
-        self.face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
-        self.quality_assessor = FaceQualityAssessor() 
-        self.recognizer = FaceRecognizer()
-        # 初始化 Faiss 索引
-        self.feature_dim = 512  # ArcFace 特征维度
-        self.index = faiss.IndexFlatIP(self.feature_dim)  # 使用内积相似度
+        # 缩略图与人脸头像，按原图内容哈希存放；上传后在进程池中生成，workers 为 0 时在请求线程中按需生成
+        self.derivatives = DerivativeStore(os.path.join(os.path.dirname(cache_dir), "derivatives"))
+        self.thumbnail_workers = thumbnail_workers
+        self._thumbnail_executor: Optional[ProcessPoolExecutor] = None
+        self._thumbnail_jobs: Dict[str, Any] = {}
+        self.recognition_batch_size = recognition_batch_size
+        self._batch_extractor = None
+        # 上传后在后台进程中提前提取人脸特征，workers 为 0 时不启用
+        self.extraction_pool = None
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(upload_dir)), "data")
+        # 各进程（本进程、特征提取进程、推理进程）的指标快照，/metrics 合并输出
+        metrics_dir = os.path.join(data_dir, "metrics")
+        REGISTRY.share(metrics_dir)
+        if extraction_workers > 0:
+            self.extraction_pool = ExtractionPool(
+                model_name=FACE_MODEL_NAME,
+                det_size=FACE_DET_SIZE,
+                cache_dir=cache_dir,
+                model_version=model_version,
+                num_workers=extraction_workers,
+                queue_size=extraction_queue_size,
+                detection_scale=detection_scale,
+                metrics_dir=metrics_dir,
+                derivatives_root=self.derivatives.root
+            )
+        # 本地持久化存储（SQLite），保存图片、人脸和分组记录；多个进程共享同一份数据，
+        # 图片和分组不在进程内缓存，每次从数据库读取
+        self.metadata = MetadataStore(os.path.join(data_dir, "metadata.db"))
+        # 已加入识别器的人脸特征（内存映射列式存储），faces 表记录每个人脸在其中的行号
+        self.face_store_path = os.path.join(data_dir, "face_store")
+        # 跨进程的分组锁，同一时间只有一个进程修改人脸存储和聚类结果
+        self._grouping_lock_path = os.path.join(data_dir, "grouping.lock")
+        # 识别器首次分组时加载；其他进程写入人脸或聚类结果后（版本号变化）重新加载
+        self._recognizer: Optional[FaceRecognizer] = None
+        self._face_state_version = None
+        # 人脸索引类型与量化索引的重排开关（见 face_recognizer.INDEX_TYPES）
+        self.index_type = index_type
+        self.index_rerank = index_rerank
+        # 以图搜人使用的只读识别器（索引内存映射加载），人脸状态版本变化时重新加载
+        self._searcher_recognizer: Optional[FaceRecognizer] = None
+        self._searcher_version = None
+        self._searcher_lock = threading.Lock()
+        # 以图搜人上传的照片，放在共享数据目录中以便推理进程读取，查询结束后删除
+        self.probe_dir = os.path.join(data_dir, "probes")
         
-        self.images: Dict[str, ImageModel] = {}
-        self.groups: Dict[str, ImageGroup] = {}
+        # 近似重复检测：dHash 汉明距离不超过该值视为同一张图片，None 表示只做精确去重
+        self.near_duplicate_distance = near_duplicate_distance
+        self.perceptual_index = PerceptualHashIndex()
+        # 索引对应的 (清空次数, 已应用的 dHash 变更日志序号)，None 表示需要整体重建
+        self._perceptual_epoch = None
+        self._perceptual_seq = 0
+        # 查重与写入记录在同一把锁内完成，同时上传的相同图片只保存一份
+        self._perceptual_lock = threading.Lock()
         self._ensure_upload_dir()
 
+    def _new_recognizer(self) -> FaceRecognizer:
+        return FaceRecognizer(store_path=self.face_store_path, index_type=self.index_type, rerank=self.index_rerank)
+
+    def _load_recognizer(self) -> FaceRecognizer:
+        """从持久化存储加载识别器和人脸登记表（faces 表），并恢复上次的聚类结果以便继续增量分组"""
+        recognizer = self._new_recognizer()
+        recognizer.set_registry(self.metadata.face_registry())
+        labels, threshold = self.metadata.load_cluster_labels(len(recognizer.image_ids))
+        if labels is not None and len(labels) > 0:
+            recognizer.restore_clusters(labels, threshold)
+        return recognizer
+
+    @property
+    def recognizer(self) -> FaceRecognizer:
+        if self._recognizer is None:
+            self._sync_recognizer()
+        return self._recognizer
+
+    @recognizer.setter
+    def recognizer(self, recognizer: FaceRecognizer):
+        self._recognizer = recognizer
+
+    def _sync_recognizer(self):
+        """其他进程修改过人脸存储或聚类结果时重新加载识别器"""
+        version = self.metadata.face_state_version()
+        if self._recognizer is None or version != self._face_state_version:
+            self._recognizer = self._load_recognizer()
+            self._face_state_version = version
+
+    @contextmanager
+    def _grouping_lock(self):
+        """跨进程互斥地执行分组（文件锁），不支持 fcntl 的平台只在进程内互斥"""
+        with open(self._grouping_lock_path, 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _persist_faces(self, added_faces: List[tuple]):
+        """把新加入识别器的人脸特征追加到列式存储，并写入人脸记录"""
+        if not added_faces:
+            return
+        self.recognizer.save_model(self.face_store_path)
+        self._face_state_version = self.metadata.add_faces(added_faces)
+
+    @property
+    def face_analyzer(self):
+        """共享的人脸分析模型，首次使用时由 model_registry 加载"""
+        return get_face_analyzer(FACE_MODEL_NAME, FACE_DET_SIZE)  # 使用大模型以提高准确率
+
+    @property
+    def batch_extractor(self) -> BatchFaceExtractor:
+        """分组时跨图片批量识别人脸"""
+        if self._batch_extractor is None:
+            self._batch_extractor = BatchFaceExtractor(
+                self.face_analyzer,
+                self.quality_assessor,
+                self.feature_cache,
+                batch_size=self.recognition_batch_size,
+                detection_scale=self.detection_scale
+            )
+        return self._batch_extractor
+
     def _ensure_upload_dir(self):
         """确保上传目录存在"""
         if not os.path.exists(self.upload_dir):
@@ -57,49 +207,16 @@ class ImageService:
     
     def detect_faces(self, image):
         """检测图片中的人脸"""
-        if len(image.shape) == 2:
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-            
-        faces = self.face_analyzer.get(image)
-        quality_faces = []
-        
-        for face in faces:
-            if face.det_score > 0.5:
-                is_good, quality_score, reasons = self.quality_assessor.is_good_quality(image, face)
-                if is_good:
-                    # 将face对象转换为可序列化的字典
-                    face_dict = {
-                        'bbox': face.bbox.tolist(),
-                        'kps': face.kps.tolist(),
-                        'det_score': float(face.det_score),
-                        'features': face.embedding.tolist(),
-                        'quality_score': quality_score,
-                        # 'confidence': float(quality_score),
-                        # 'gender': face.gender,
-                        # 'age': face.age,
-                        # 'angle': face.pose
-                    }
-                    quality_faces.append(face_dict)
-        
-        return quality_faces
+        return detect_faces(self.face_analyzer, self.quality_assessor, image)
     
     def extract_face_features(self, image_path: str) -> Dict[str, Any]:
-        """使用 RetinaFace 和 ArcFace 提取人脸特征"""
+        """使用 RetinaFace 和 ArcFace 提取人脸特征
+
+        结果按文件内容哈希缓存到磁盘，同一张图片再次分组时直接读取缓存，跳过推理。
+        """
         try:
-            # 读取图片
-            image = cv2.imread(image_path)
-            if image is None:
-                return None
-                
-            faces = self.detect_faces(image)
-            if not faces:
-                print("没0人脸！")
-                return {'total_faces': 0, 'features': []}
-            print(f"{len(faces)}人脸！")
-            return {
-                'faces': faces,
-                'total_faces': len(faces)
-            }
+            return extract_face_features(self.face_analyzer, self.quality_assessor, self.feature_cache, image_path,
+                                         detection_scale=self.detection_scale)
         except Exception as e:
             print(f"Error extracting face features: {str(e)}")
             return None
@@ -123,54 +240,117 @@ class ImageService:
         
         return float(max_similarity)
         
-    def auto_group_images(self, image_ids: List[str], similarity_threshold: float = 0.7) -> List[Dict[str, Any]]:
+    def auto_group_images(self, image_ids: List[str], similarity_threshold: float = 0.7,
+                          incremental: bool = False,
+                          progress: Optional[Callable[[str, int, int], None]] = None) -> List[Dict[str, Any]]:
+        """分组入口：持有跨进程分组锁，并在分组前同步其他进程写入的人脸与聚类结果"""
+        with self._grouping_lock():
+            self._sync_recognizer()
+            return self._auto_group_images(image_ids, similarity_threshold, incremental, progress)
+
+    def _auto_group_images(self, image_ids: List[str], similarity_threshold: float = 0.7,
+                          incremental: bool = False,
+                          progress: Optional[Callable[[str, int, int], None]] = None) -> List[Dict[str, Any]]:
         """使用 RetinaFace 和 ArcFace 进行智能分组
         Args:
             image_ids: 图片ID列表
             similarity_threshold: 相似度阈值，默认0.55
+            incremental: 是否增量分组，只把新图片的人脸分配到已有分组，不重新全量聚类
+            progress: 可选的进度回调 progress(阶段, 当前, 总数)，阶段依次为 'extraction'、'indexing'、
+                'distance_matrix'、'threshold_sweep'、'clustering'（增量模式为 'assigning'）
         Returns:
             List[Dict[str, Any]]: 分组结果列表
         """
+        if progress is None:
+            progress = lambda stage, current=0, total=0: None
         # 存储每张图片的特征
         features_dict = {}
         embeddings_list = []
         image_map = []
         
         print("正在提取人脸特征...")
-        for img_id in tqdm(image_ids):
-            if img_id in self.images:
-                image_name = self.images[img_id].filename
+        records = self.metadata.get_images(image_ids)
+        path_map = {}
+        for img_id in image_ids:
+            # 已登记人脸、且当前提取配置下的特征仍在缓存中的图片直接使用登记表中的特征；
+            # 提取配置变化（如检测缩小倍数）导致缓存未命中时重新提取，并替换登记的人脸
+            if img_id in records and not (self.recognizer.has_image(img_id) and (
+                    not records[img_id]['content_hash'] or self.feature_cache.contains(records[img_id]['content_hash']))):
+                image_name = records[img_id]['filename']
                 full_path = os.path.join(self.upload_dir, image_name)
                 if not os.path.exists(full_path):
                     continue
-                    
-                # 提取人脸特征
-                features = self.extract_face_features(full_path)
-                if features is not None and features['total_faces'] > 0:
-                    features_dict[img_id] = features
+                # 等待后台提取完成，随后直接命中特征缓存
+                if self.extraction_pool is not None:
+                    self.extraction_pool.wait(img_id)
+                path_map[img_id] = full_path
+
+        # 提取人脸特征（未缓存的图片跨图片批量识别），上传时已计算的内容哈希直接复用
+        content_hashes = {
+            full_path: records[img_id]['content_hash']
+            for img_id, full_path in path_map.items()
+            if records[img_id]['content_hash']
+        }
+        batch_results = self.batch_extractor.extract(
+            list(path_map.values()),
+            progress=lambda done, total: progress('extraction', done, total),
+            content_hashes=content_hashes
+        )
+        for img_id, full_path in path_map.items():
+            features = batch_results.get(full_path)
+            if features is not None and features['total_faces'] > 0:
+                features_dict[img_id] = features
         # 第二步：根据人脸特征相似度进行分组
         # 处理结果
         face_count = 0
-        for img_path, feature1 in features_dict.items():
+        # (image_id, 人脸序号, 在识别器中的行号, 人脸信息)
+        added_faces = []
+        for img_id, feature1 in features_dict.items():
             if feature1['faces']:
-                for face_dict in feature1['faces']:
+                for face_index, face_dict in enumerate(feature1['faces']):
                     try:
-                        self.recognizer.add_face(face_dict, img_path)
+                        offset = self.recognizer.upsert_face(img_id, face_index, face_dict)
+                        added_faces.append((img_id, face_index, offset, face_dict))
                         face_count += 1
                     except Exception as e:
-                        print(f"添加人脸时出错 ({img_path}): {str(e)}")
+                        print(f"添加人脸时出错 ({img_id}): {str(e)}")
+        # 重新提取后人脸变少的图片，注销多出的旧人脸
+        stale_faces = [
+            (img_id, face_index)
+            for img_id in path_map
+            for face_index in list(self.recognizer.registry.get(img_id, {}))
+            if face_index >= len(features_dict.get(img_id, {}).get('faces', []))
+        ]
+        for img_id, face_index in stale_faces:
+            self.recognizer.delete_face(img_id, face_index)
+        self._persist_faces(added_faces)
+        if stale_faces:
+            self._face_state_version = self.metadata.delete_faces(stale_faces)
         
+        # 本次分组的人脸：按登记表选出请求中图片的人脸行号，其他图片的人脸不参与
+        rows = self.recognizer.rows_for_images(image_ids)
         print(f"共处理 {len(image_ids)} 张图片，"
-            f"检测到 {face_count} 个人脸")
+            f"新检测到 {face_count} 个人脸，参与分组 {len(rows)} 个人脸")
         
-        # 构建索引并聚类
-        if len(self.recognizer.face_features) > 0:
-            print("开始构建索引...")
-            self.recognizer.build_index()
-            
-            print("开始聚类分析...")
-            groups = self.recognizer.cluster_faces(threshold=similarity_threshold)
+        # 更新索引并聚类
+        if len(rows) > 0:
+            # 持久化的索引只加入新增人脸、删除已删除图片的人脸，不再每次重新训练
+            print("开始更新索引...")
+            progress('indexing', 0, 1)
+            self.recognizer.update_index(self.recognizer.rows_for_images())
+            progress('indexing', 1, 1)
+            if incremental and self.recognizer.has_clusters():
+                print("开始增量分组...")
+                progress('assigning', 0, 1)
+                groups = self.recognizer.assign_new_faces(rows=rows)
+                progress('assigning', 1, 1)
+            else:
+                print("开始聚类分析...")
+                groups = self.recognizer.cluster_faces(threshold=similarity_threshold, progress=progress, rows=rows)
             print(f"聚类完成，找到 {len(groups)} 个分组")
+            if self.recognizer.labels is not None:
+                self._face_state_version = self.metadata.save_cluster_labels(
+                    self.recognizer.labels, self.recognizer.cluster_threshold, self.recognizer.label_changes)
             
             # 格式化输出结果
             result = []
@@ -189,81 +369,470 @@ class ImageService:
             return []
 
     async def save_images(self, files: List[UploadFile]) -> List[str]:
-        """保存上传的图片文件"""
+        """保存上传的图片文件
+
+        文件按块流式写入磁盘并同时计算内容哈希，最多 upload_concurrency 个文件并发写入，
+        返回的图片ID与 files 顺序一致。内容重复（或开启近似去重时近似重复）的图片不会保存，
+        返回已有图片的ID。任一文件保存失败时整个请求回滚：删除本次写入的文件和创建的图片记录，
+        已有图片不受影响，然后抛出第一个错误。
+        """
+        semaphore = asyncio.Semaphore(self.upload_concurrency)
+
+        async def save(file: UploadFile) -> ImageModel:
+            async with semaphore:
+                return await self._save_upload(file)
+
+        saved = await asyncio.gather(*(save(file) for file in files), return_exceptions=True)
+        loop = asyncio.get_running_loop()
+
+        written = [image for image in saved if not isinstance(image, BaseException)]
+        created = []
         image_ids = []
-        for file in files:
-            # 生成唯一ID
-            image_id = str(uuid.uuid4())
-            
-            # 构建文件路径
-            file_ext = os.path.splitext(file.filename)[1]
-            filename = f"{image_id}{file_ext}"
-            filepath = os.path.join(self.upload_dir, filename)
-            # 保存文件
-            with open(filepath, "wb") as f:
-                content = await file.read()
-                f.write(content)
+        try:
+            for image in saved:
+                if isinstance(image, BaseException):
+                    raise image
+            for image in written:
+                # 查重和创建图片记录涉及数据库与 dHash 索引，放到线程池中执行
+                existing_id = await loop.run_in_executor(self._upload_executor, self._record_upload, image)
+                if existing_id is not None:
+                    os.remove(os.path.join(self.upload_dir, image.filename))
+                    image_ids.append(existing_id)
+                    continue
+                created.append(image)
+                image_ids.append(image.id)
+        except BaseException:
+            for image in created:
+                await loop.run_in_executor(self._upload_executor, self.metadata.delete_image, image.id)
+            for image in written:
+                filepath = os.path.join(self.upload_dir, image.filename)
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+            raise
+
+        # 所有文件都保存成功后再提交后台特征提取和缩略图生成
+        for image in created:
+            if self.extraction_pool is not None:
+                self.extraction_pool.submit(image.id, os.path.join(self.upload_dir, image.filename), image.content_hash)
+            if self.thumbnail_workers > 0:
+                self._submit_thumbnails(image)
+        return image_ids
+
+    async def _save_upload(self, file: UploadFile) -> ImageModel:
+        """分块读取上传内容，在线程池中写入磁盘并计算 SHA-256，只用文件头探测图片尺寸"""
+        # 生成唯一ID
+        image_id = str(uuid.uuid4())
+        
+        # 构建文件路径
+        file_ext = os.path.splitext(file.filename)[1]
+        filename = f"{image_id}{file_ext}"
+        filepath = os.path.join(self.upload_dir, filename)
+
+        loop = asyncio.get_running_loop()
+        digest = hashlib.sha256()
+        header = bytearray()
+        size = 0
+        f = await loop.run_in_executor(self._upload_executor, open, filepath, 'wb')
+        try:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await loop.run_in_executor(self._upload_executor, self._write_chunk, f, digest, chunk)
+                size += len(chunk)
+                if len(header) < IMAGE_HEADER_PROBE_SIZE:
+                    header += chunk[:IMAGE_HEADER_PROBE_SIZE - len(header)]
+            await loop.run_in_executor(self._upload_executor, f.close)
             # 获取图片信息
+            width, height = await loop.run_in_executor(self._upload_executor, self._probe_size, bytes(header), filepath)
+            perceptual_hash = None
+            if self.near_duplicate_distance is not None:
+                perceptual_hash = format(await loop.run_in_executor(self._upload_executor, dhash, filepath), '016x')
+        except BaseException:
+            f.close()
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            raise
+
+        return ImageModel(
+            id=image_id,
+            filename=filename,
+            name=file.filename,
+            url=f"/uploads/{filename}",
+            size=size,
+            score =0,
+            width=width,
+            height=height,
+            content_hash=digest.hexdigest(),
+            perceptual_hash=perceptual_hash,
+            thumbnail_url=f"/api/images/{image_id}/thumbnail?size={THUMBNAIL_SIZES[0]}",
+            preview_url=f"/api/images/{image_id}/thumbnail?size={THUMBNAIL_SIZES[-1]}",
+            created_at=datetime.now()
+        )
+
+    def _record_upload(self, image: ImageModel) -> Optional[str]:
+        """新上传的图片与已有图片重复时返回已有图片ID，否则创建图片记录并返回 None
+
+        _perceptual_lock 只在本进程内有效；其他进程同时上传同一文件时由 content_hash 唯一索引兜底。
+        """
+        with self._perceptual_lock:
+            existing_id = self._find_duplicate(image)
+            if existing_id is None:
+                existing_id = self.metadata.insert_image(image.dict())
+                if existing_id is not None:
+                    print(f"跳过重复图片 {image.name} -> {existing_id}")
+            return existing_id
+
+    def _sync_perceptual_index(self):
+        """把本进程和其他进程的 dHash 变更同步到索引（需持有 _perceptual_lock）
+
+        数据被清空过（或首次使用）时一次性批量重建，否则只应用上次同步之后新增和删除的记录。
+        """
+        epoch, seq = self.metadata.perceptual_hash_state()
+        if epoch != self._perceptual_epoch:
+            # 先记下日志序号再读全量数据，期间写入的记录会在下次同步时重复应用，add/remove 是幂等的
+            self.perceptual_index.bulk_load(
+                [(image_id, int(perceptual_hash, 16)) for image_id, perceptual_hash in self.metadata.perceptual_hashes()])
+            self._perceptual_epoch, self._perceptual_seq = epoch, seq
+            return
+        if seq == self._perceptual_seq:
+            return
+        for seq, image_id, perceptual_hash in self.metadata.perceptual_hash_changes(self._perceptual_seq):
+            if perceptual_hash is None:
+                self.perceptual_index.remove(image_id)
+            else:
+                self.perceptual_index.add(image_id, int(perceptual_hash, 16))
+            self._perceptual_seq = seq
+
+    def _find_duplicate(self, image: ImageModel) -> Optional[str]:
+        """查找与新上传图片重复的已有图片ID（内容哈希走数据库索引）"""
+        existing_id = self.metadata.find_image_by_hash(image.content_hash)
+        if existing_id is not None:
+            print(f"跳过重复图片 {image.name} -> {existing_id}")
+            return existing_id
+        if self.near_duplicate_distance is not None and image.perceptual_hash is not None:
+            self._sync_perceptual_index()
+            match = self.perceptual_index.find(int(image.perceptual_hash, 16), self.near_duplicate_distance)
+            if match is not None:
+                print(f"跳过近似重复图片 {image.name} -> {match[0]} (汉明距离 {match[1]})")
+                return match[0]
+        return None
+
+    @staticmethod
+    def _write_chunk(f, digest, chunk: bytes):
+        f.write(chunk)
+        digest.update(chunk)
+
+    @staticmethod
+    def _probe_size(header: bytes, filepath: str):
+        """PIL 打开图片时只解析文件头，不解码像素；缓存的文件头不完整时再读取磁盘文件"""
+        try:
+            with Image.open(io.BytesIO(header)) as img:
+                return img.size
+        except Exception:
             with Image.open(filepath) as img:
-                width, height = img.size
-            
-            # 创建图片记录
-            self.images[image_id] = ImageModel(
-                id=image_id,
-                filename=filename,
-                name=file.filename,
-                url=f"/uploads/{filename}",
-                size=os.path.getsize(filepath),
-                score =0,
-                width=width,
-                height=height,
-                created_at=datetime.now()
+                return img.size
+
+    def _submit_thumbnails(self, image: ImageModel):
+        """把缩略图生成任务提交到进程池，返回对应的 Future"""
+        job = self._thumbnail_jobs.get(image.content_hash)
+        if job is not None:
+            return job
+        if self._thumbnail_executor is None:
+            self._thumbnail_executor = ProcessPoolExecutor(
+                max_workers=self.thumbnail_workers,
+                mp_context=multiprocessing.get_context('spawn')
             )
-            
-            image_ids.append(image_id)
-        
-        return image_ids
+        job = self._thumbnail_executor.submit(
+            generate_thumbnails,
+            os.path.join(self.upload_dir, image.filename),
+            self.derivatives.root,
+            image.content_hash
+        )
+        self._thumbnail_jobs[image.content_hash] = job
+        job.add_done_callback(lambda _, content_hash=image.content_hash: self._thumbnail_jobs.pop(content_hash, None))
+        return job
+
+    async def get_thumbnail(self, image_id: str, size: int):
+        """获取缩略图，返回 (文件路径, ETag)；尚未生成时等待后台任务或立即生成"""
+        if size not in THUMBNAIL_SIZES:
+            raise ValueError(f"不支持的缩略图尺寸: {size}，可选 {list(THUMBNAIL_SIZES)}")
+        image = await self.get_image(image_id)
+        key = self.derivatives.thumbnail_key(image.content_hash, size)
+        if not self.derivatives.exists(key):
+            if self.thumbnail_workers > 0:
+                await asyncio.wrap_future(self._submit_thumbnails(image))
+            else:
+                await asyncio.get_running_loop().run_in_executor(
+                    self._upload_executor, generate_thumbnails,
+                    os.path.join(self.upload_dir, image.filename), self.derivatives.root, image.content_hash
+                )
+        return self.derivatives.path(key), key
+
+    async def get_face_thumbnail(self, image_id: str, face_index: int):
+        """获取人脸头像（用于分组封面），返回 (文件路径, ETag)
+
+        头像通常在后台提取人脸特征后已经生成；没有后台提取的图片按特征缓存中的人脸框即时生成。
+        """
+        image = await self.get_image(image_id)
+        key = self.derivatives.face_key(image.content_hash, face_index)
+        if not self.derivatives.exists(key):
+            result = self.feature_cache.get(image.content_hash)
+            if result is None:
+                raise ValueError(f"图片尚未提取人脸特征: {image_id}")
+            faces = result.get('faces', [])
+            if not 0 <= face_index < len(faces):
+                raise ValueError(f"Face not found: {image_id}#{face_index}")
+            await asyncio.get_running_loop().run_in_executor(
+                self._upload_executor, generate_face_crop,
+                os.path.join(self.upload_dir, image.filename), self.derivatives.root,
+                image.content_hash, face_index, faces[face_index]['bbox']
+            )
+        return self.derivatives.path(key), key
+
+    def _searcher(self) -> FaceRecognizer:
+        """以图搜人使用的识别器：索引以只读内存映射方式加载，不需要等待正在进行的分组
+
+        其他进程写入人脸或聚类结果后（版本号变化）重新加载；还没有持久化的索引时在分组锁内构建。
+        """
+        version = self.metadata.face_state_version()
+        with self._searcher_lock:
+            if self._searcher_recognizer is None or version != self._searcher_version:
+                searcher = self._new_recognizer()
+                live_offsets = self.metadata.face_offsets()
+                if not searcher.load_index(mmap=True):
+                    with self._grouping_lock():
+                        if not searcher.load_index(mmap=True):
+                            searcher.update_index(live_offsets)
+                # 分组进程的增量更新不会每次都持久化，持久化的索引中缺少的人脸在查询时精确比较
+                searcher.set_unindexed(live_offsets)
+                self._searcher_recognizer, self._searcher_version = searcher, version
+            return self._searcher_recognizer
+
+    def _library_face_features(self, searcher: FaceRecognizer, image_id: str, face_index: int) -> np.ndarray:
+        """图库中人脸的特征：已分组的人脸按行号从列式存储读取，否则从特征缓存读取，不会重新推理"""
+        for face in self.metadata.get_faces(image_id):
+            if face['face_index'] == face_index and face['store_offset'] < len(searcher.face_features):
+                return searcher.face_features[face['store_offset']]
+        record = self.metadata.get_image(image_id)
+        if record is None:
+            raise ValueError(f"Image not found: {image_id}")
+        result = self.feature_cache.get(record['content_hash']) if record['content_hash'] else None
+        if result is None:
+            raise ValueError(f"图片尚未提取人脸特征: {image_id}")
+        faces = result.get('faces', [])
+        if not 0 <= face_index < len(faces):
+            raise ValueError(f"Face not found: {image_id}#{face_index}")
+        return np.asarray(faces[face_index]['features'], dtype=np.float32)
+
+    def search_faces(self, probes: List[Dict[str, Any]], k: int = 50,
+                     min_similarity: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+        """以图搜人：在人脸索引中查找与探针人脸相似的图片，多个探针合并为一次批量查询
+
+        Args:
+            probes: 探针列表，每项为图库中的人脸 {'image_id', 'face_index'}，或已提取的特征 {'features': [...]}
+            k: 每个探针最多返回的图片数
+            min_similarity: 为 None 时做 top-k 检索，否则返回余弦相似度不低于该值的图片（最多 k 张）
+        Returns:
+            每个探针的匹配列表 [{'image_id', 'face_index', 'score'}]，按相似度降序；
+            同一张图片只保留最相似的人脸，探针人脸本身不在结果中
+        """
+        if not probes:
+            return []
+        searcher = self._searcher()
+        queries = FaceRecognizer._normalize(np.stack([
+            np.asarray(probe['features'], dtype=np.float32) if probe.get('features') is not None
+            else self._library_face_features(searcher, probe['image_id'], probe['face_index'])
+            for probe in probes
+        ]))
+        if searcher.index is None or searcher.searchable_count() == 0:
+            return [[] for _ in probes]
+
+        if min_similarity is None:
+            # 一张图片可能有多个人脸命中，多取一些候选以便按图片去重后仍有 k 张
+            similarities, neighbors = searcher.search(queries, min(searcher.searchable_count(), 2 * k + 1))
+            hits = [(sims[ids >= 0], ids[ids >= 0]) for sims, ids in zip(similarities, neighbors)]
+        else:
+            hits = searcher.range_search(queries, min_similarity)
+
+        # 索引可能比人脸记录稍旧，已删除图片的人脸在这里过滤掉
+        faces = self.metadata.faces_by_offsets(np.unique(np.concatenate([ids for _, ids in hits])))
+        results = []
+        for probe, (sims, ids) in zip(probes, hits):
+            matches: Dict[str, Dict[str, Any]] = {}
+            for similarity, offset in zip(sims, ids):
+                face = faces.get(int(offset))
+                if face is None or face[0] in matches:
+                    continue
+                if face == (probe.get('image_id'), probe.get('face_index')):
+                    continue
+                matches[face[0]] = {'image_id': face[0], 'face_index': face[1], 'score': float(similarity)}
+                if len(matches) >= k:
+                    break
+            results.append(list(matches.values()))
+        return results
+
+    async def save_probe(self, file: UploadFile) -> str:
+        """保存以图搜人上传的照片，返回文件路径（不加入图库，调用方用完后删除）"""
+        os.makedirs(self.probe_dir, exist_ok=True)
+        path = os.path.join(self.probe_dir, f"{uuid.uuid4()}{os.path.splitext(file.filename or '')[1]}")
+        loop = asyncio.get_running_loop()
+        with open(path, 'wb') as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await loop.run_in_executor(self._upload_executor, f.write, chunk)
+        return path
+
+    def probe_faces(self, image_path: str, progress: Optional[Callable[[str, int, int], None]] = None) -> List[Dict[str, Any]]:
+        """识别以图搜人照片中的人脸，返回 [{'bbox', 'det_score', 'quality_score', 'features'}]
+
+        结果按内容哈希写入特征缓存，同一张照片再次查询（或之后上传到图库）时不再推理。
+        """
+        result = self.extract_face_features(image_path)
+        if result is None:
+            raise ValueError("无法读取图片")
+        return [
+            {key: face[key] for key in ('bbox', 'det_score', 'quality_score', 'features')}
+            for face in result.get('faces', [])
+        ]
+
+    def get_extraction_status(self, image_ids: List[str] = None) -> Dict[str, Any]:
+        """获取后台人脸特征提取进度
+
+        remote_inference 时提取在推理进程中进行，状态由共享的特征缓存判断：已缓存为 done，否则为 pending。
+        """
+        if self.remote_inference:
+            if image_ids is None:
+                image_ids = [record['id'] for record in self.metadata.all_images()]
+            records = self.metadata.get_images(image_ids)
+            items = {
+                image_id: {'status': STATUS_DONE if self.feature_cache.contains(record['content_hash']) else STATUS_PENDING}
+                for image_id, record in records.items()
+            }
+            done = sum(1 for item in items.values() if item['status'] == STATUS_DONE)
+            return {'enabled': True, 'total': len(items), STATUS_PENDING: len(items) - done, STATUS_DONE: done,
+                    'items': items}
+        if self.extraction_pool is None:
+            return {'enabled': False, 'total': 0, 'items': {}}
+        if image_ids is None:
+            image_ids = [record['id'] for record in self.metadata.all_images()]
+        summary = self.extraction_pool.get_summary(image_ids)
+        # 进程池不保留已完成任务的状态，按特征缓存补全
+        records = self.metadata.get_images([image_id for image_id in image_ids if image_id not in summary['items']])
+        done = {
+            image_id: {'status': STATUS_DONE}
+            for image_id, record in records.items()
+            if record['content_hash'] and self.feature_cache.contains(record['content_hash'])
+        }
+        summary['items'].update(done)
+        summary['total'] += len(done)
+        summary[STATUS_DONE] += len(done)
+        return {'enabled': True, **summary}
+
+    def prefetch_features(self, image_ids: List[str], progress: Optional[Callable[[str, int, int], None]] = None) -> int:
+        """提前提取图片的人脸特征（写入特征缓存），推理进程处理上传后的提取任务时调用
+
+        有后台提取进程池时只提交任务，否则在当前进程中批量提取。返回提交或提取的图片数。
+        """
+        records = self.metadata.get_images(image_ids)
+        paths = {
+            image_id: os.path.join(self.upload_dir, record['filename'])
+            for image_id, record in records.items()
+            if not self.feature_cache.contains(record['content_hash'])
+        }
+        if self.extraction_pool is not None:
+            for image_id, path in paths.items():
+                self.extraction_pool.submit(image_id, path, records[image_id]['content_hash'])
+        elif paths:
+            content_hashes = {path: records[image_id]['content_hash'] for image_id, path in paths.items()}
+            results = self.batch_extractor.extract(
+                list(paths.values()),
+                progress=(lambda done, total: progress('extraction', done, total)) if progress else None,
+                content_hashes=content_hashes
+            )
+            # 提取后立即生成人脸头像，分组封面不需要再按需裁剪
+            for path, result in results.items():
+                if result is not None and result.get('faces') and content_hashes.get(path):
+                    try:
+                        generate_face_crops(path, self.derivatives.root, content_hashes[path], result['faces'])
+                    except Exception as e:
+                        print(f"生成人脸头像失败 ({path}): {str(e)}")
+        return len(paths)
+
+    def shutdown(self):
+        """保存尚未持久化的索引更新，关闭后台提取进程池和上传写入线程池"""
+        if self._recognizer is not None:
+            with self._grouping_lock():
+                # 其他进程已经更新过人脸状态时，本进程的索引已过期，不覆盖持久化的版本
+                if self.metadata.face_state_version() == self._face_state_version:
+                    self._recognizer.flush_index()
+        if self.extraction_pool is not None:
+            self.extraction_pool.shutdown()
+        self._upload_executor.shutdown(wait=False)
+        if self._thumbnail_executor is not None:
+            self._thumbnail_executor.shutdown(wait=False, cancel_futures=True)
 
     async def get_image(self, image_id: str) -> ImageModel:
         """获取单个图片信息"""
-        if image_id not in self.images:
+        record = self.metadata.get_image(image_id)
+        if record is None:
             raise ValueError(f"Image not found: {image_id}")
-        return self.images[image_id]
+        return ImageModel(**record)
+
+    def list_images(self, sort: str = 'created_at', order: str = 'desc', limit: int = 50,
+                    cursor: Optional[str] = None, group_id: Optional[str] = None):
+        """分页获取图片列表，返回 (图片列表, 下一页游标)"""
+        records, next_cursor = self.metadata.list_images(sort, order, limit, cursor, group_id)
+        return [ImageModel(**record) for record in records], next_cursor
 
     async def delete_image(self, image_id: str):
         """删除图片"""
-        if image_id not in self.images:
-            raise ValueError(f"Image not found: {image_id}")
-        
-        image = self.images[image_id]
+        image = await self.get_image(image_id)
         filepath = os.path.join(os.getcwd(), image.url.lstrip('/'))
         
         # 删除文件
         if os.path.exists(filepath):
             os.remove(filepath)
         
-        # 删除记录
-        del self.images[image_id]
+        # 删除记录（dHash 索引在下次查重时按变更日志同步），等待分组锁不阻塞事件循环
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._delete_image_records, image_id)
+
+    def _delete_image_records(self, image_id: str):
+        """在分组锁内删除图片记录并注销其人脸，本进程的识别器不需要重新加载"""
+        with self._grouping_lock():
+            # 识别器尚未加载时无需注销，之后加载时直接读取删除后的人脸记录
+            if self._recognizer is not None:
+                self._sync_recognizer()
+                self.recognizer.delete_image(image_id)
+            version = self.metadata.delete_image(image_id)
+            if version is not None and self._recognizer is not None:
+                self._face_state_version = version
 
     async def create_group(self, group: ImageGroup) -> ImageGroup:
         """创建新的图片分组"""
         group_id = str(uuid.uuid4())
         group.id = group_id
         group.created_at = datetime.now()
-        self.groups[group_id] = group
+        self.metadata.upsert_group(group.dict())
         return group
 
     async def get_groups(self) -> List[ImageGroup]:
         """获取所有图片分组"""
-        return list(self.groups.values())
+        return [ImageGroup(**record) for record in self.metadata.all_groups()]
 
     async def update_group(self, group_id: str, group: ImageGroup) -> ImageGroup:
         """更新图片分组信息"""
-        if group_id not in self.groups:
+        existing = self.metadata.get_group(group_id)
+        if existing is None:
             raise ValueError(f"Group not found: {group_id}")
         
+        group.id = group_id
+        group.created_at = existing['created_at']
         group.updated_at = datetime.now()
-        self.groups[group_id] = group
+        self.metadata.upsert_group(group.dict())
         return group
 
     async def delete_group(self, group_id: str):
@@ -273,29 +842,21 @@ class ImageService:
         Returns:
             bool: 是否删除成功
         """
-        try:
-            group_file = os.path.join(os.path.dirname(self.upload_dir), "groups.json")
-            if not os.path.exists(group_file):
-                return False
-            
-            with open(group_file, 'r', encoding='utf-8') as f:
-                groups = json.load(f)
-            
-            # 查找并删除分组
-            groups = [g for g in groups if g['id'] != group_id]
-            
-            with open(group_file, 'w', encoding='utf-8') as f:
-                json.dump(groups, f, ensure_ascii=False, default=str)
-            
-            return True
-            
-        except Exception as e:
-            print(f"Error deleting group: {str(e)}")
-            raise 
+        if not self.metadata.delete_group(group_id):
+            raise ValueError(f"Group not found: {group_id}")
+        return True
 
     def reset(self):
         """重置服务状态，清除所有图片和分组信息"""
-        self.images.clear()
-        self.groups.clear()
-        # 重置人脸识别器的状态
-        self.recognizer = FaceRecognizer() 
\ No newline at end of file
+        if self.extraction_pool is not None:
+            self.extraction_pool.clear()
+        # 重置人脸识别器的数据；模型由 model_registry 共享，不会重新加载
+        with self._grouping_lock():
+            self._face_state_version = self.metadata.clear()
+            with self._perceptual_lock:
+                self.perceptual_index.clear()
+                self._perceptual_epoch = None
+            if EmbeddingStore.exists(self.face_store_path):
+                EmbeddingStore(self.face_store_path).clear()
+            self.recognizer = self._new_recognizer()
+            self.recognizer.clear_index()
\ No newline at end of file
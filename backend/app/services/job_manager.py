@@ -0,0 +1,150 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, Any, Optional
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# 共享任务队列中的任务类型
+JOB_KIND_GROUP = 'group'      # 人脸分组，payload 为 GroupRequest 的字段
+JOB_KIND_EXTRACT = 'extract'  # 上传后提前提取人脸特征，payload 为 {'image_ids': [...]}
+JOB_KIND_PROBE = 'probe'      # 以图搜人时识别上传照片中的人脸，payload 为 {'image_path': ...}
+
+
+class JobManager:
+    """在后台线程中执行分组任务并记录阶段进度
+
+    分组会修改共享的 FaceRecognizer 状态，因此任务在单个工作线程中依次执行；
+    接口只负责提交任务和查询进度，不会阻塞事件循环。
+    """
+
+    def __init__(self, max_finished_jobs: int = 100):
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='grouping-job')
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def submit(self, func: Callable[..., Any], *args, **kwargs) -> (str, Future):
+        """提交任务，func 需接受关键字参数 progress(stage, current, total)"""
+        job_id = str(uuid.uuid4())
+        now = datetime.now()
+        with self._lock:
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': JOB_QUEUED,
+                'stage': None,
+                'current': 0,
+                'total': 0,
+                'result': None,
+                'error': None,
+                'created_at': now,
+                'updated_at': now,
+                'version': 0,
+            }
+            self._prune()
+
+        def progress(stage: str, current: int = 0, total: int = 0):
+            self._update(job_id, stage=stage, current=current, total=total)
+
+        def run():
+            self._update(job_id, status=JOB_RUNNING)
+            try:
+                result = func(*args, progress=progress, **kwargs)
+            except Exception as e:
+                print(f"分组任务失败 ({job_id}): {str(e)}")
+                self._update(job_id, status=JOB_FAILED, error=str(e))
+                raise
+            self._update(job_id, status=JOB_DONE, result=result)
+            return result
+
+        return job_id, self._executor.submit(run)
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job['updated_at'] = datetime.now()
+            job['version'] += 1
+
+    def _prune(self):
+        """只保留最近的若干个已结束任务"""
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in (JOB_DONE, JOB_FAILED)]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    @staticmethod
+    def is_finished(job: Dict[str, Any]) -> bool:
+        return job['status'] in (JOB_DONE, JOB_FAILED)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SharedJobQueue:
+    """多进程共享的任务队列，任务记录保存在 MetadataStore 的 jobs 表中
+
+    多个 API 进程只负责提交任务和查询进度，专用的推理进程（app.inference_worker）
+    依次领取并执行任务，任何一个 API 进程都能查到同一个任务的状态。
+    """
+
+    def __init__(self, store, max_finished_jobs: int = 100, progress_interval: float = 0.2):
+        self.store = store
+        self.max_finished_jobs = max_finished_jobs
+        # 进度写入数据库的最短间隔（秒），阶段变化和最后一步总会写入
+        self.progress_interval = progress_interval
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        """提交任务，返回任务ID"""
+        job_id = str(uuid.uuid4())
+        self.store.create_job(job_id, kind, payload, max_finished_jobs=self.max_finished_jobs)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get_job(job_id)
+
+    is_finished = staticmethod(JobManager.is_finished)
+
+    def run_next(self, handlers: Dict[str, Callable[..., Any]]) -> bool:
+        """领取一个排队中的任务并执行，没有任务时返回 False
+
+        handlers 为 任务类型 -> 处理函数，处理函数以 payload 为关键字参数调用，
+        并接受关键字参数 progress(stage, current, total)。
+        """
+        job = self.store.claim_job(list(handlers))
+        if job is None:
+            return False
+        job_id = job['job_id']
+        last = {'stage': None, 'time': 0.0}
+
+        def progress(stage: str, current: int = 0, total: int = 0):
+            now = time.monotonic()
+            if stage == last['stage'] and current < total and now - last['time'] < self.progress_interval:
+                return
+            last['stage'], last['time'] = stage, now
+            self.store.update_job(job_id, stage=stage, current=current, total=total)
+
+        try:
+            result = handlers[job['kind']](progress=progress, **job['payload'])
+        except Exception as e:
+            print(f"任务失败 ({job['kind']} {job_id}): {str(e)}")
+            self.store.update_job(job_id, status=JOB_FAILED, error=str(e))
+            return True
+        self.store.update_job(job_id, status=JOB_DONE, result=result)
+        return True
+
+    def shutdown(self):
+        """任务在推理进程中执行，API 进程无需清理"""
@@ -0,0 +1,553 @@
+import os
+import json
+import base64
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.job_manager import JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+
+# 可排序的列，每列都有 (列, id) 复合索引，分页查询只读取一页数据
+SORT_COLUMNS = ('created_at', 'size', 'score')
+# images 表的列，与 schemas.Image 字段一致；时间字段以 UNIX 时间戳存储，便于排序
+IMAGE_COLUMNS = (
+    'id', 'filename', 'name', 'url', 'size', 'width', 'height', 'format', 'mode', 'score',
+    'content_hash', 'perceptual_hash', 'thumbnail_url', 'preview_url', 'created_at', 'updated_at',
+)
+_TIME_COLUMNS = ('created_at', 'updated_at')
+# 人脸与聚类状态的版本号，每次写入人脸或聚类结果时递增，其他进程据此判断是否需要重新加载
+FACE_STATE_VERSION_KEY = 'face_state_version'
+# 图片数据被清空的次数，各进程据此判断 dHash 索引需要整体重建（清空时 dHash 变更日志也被清空）
+PERCEPTUAL_EPOCH_KEY = 'perceptual_hash_epoch'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    name TEXT NOT NULL,
+    url TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    width INTEGER,
+    height INTEGER,
+    format TEXT,
+    mode TEXT,
+    score REAL NOT NULL DEFAULT 0,
+    content_hash TEXT,
+    perceptual_hash TEXT,
+    thumbnail_url TEXT,
+    preview_url TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_images_created_at ON images (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_images_size ON images (size, id);
+CREATE INDEX IF NOT EXISTS idx_images_score ON images (score, id);
+CREATE TABLE IF NOT EXISTS group_members (
+    group_id TEXT NOT NULL,
+    image_id TEXT NOT NULL,
+    PRIMARY KEY (group_id, image_id)
+);
+CREATE INDEX IF NOT EXISTS idx_group_members_image ON group_members (image_id, group_id);
+CREATE TABLE IF NOT EXISTS groups (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS faces (
+    image_id TEXT NOT NULL,
+    face_index INTEGER NOT NULL,
+    store_offset INTEGER NOT NULL,
+    bbox TEXT NOT NULL,
+    det_score REAL,
+    quality_score REAL,
+    cluster_label INTEGER NOT NULL DEFAULT -1,
+    PRIMARY KEY (image_id, face_index)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_faces_store_offset ON faces (store_offset);
+CREATE TABLE IF NOT EXISTS perceptual_hash_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_id TEXT NOT NULL,
+    perceptual_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    current INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+"""
+
+
+def _encode_cursor(value, image_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, image_id]).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str):
+    try:
+        value, image_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError(f"无效的分页游标: {cursor}")
+    return value, image_id
+
+
+class MetadataStore:
+    """图片、人脸和分组的本地持久化存储（SQLite，WAL 模式）
+
+    - images: 图片记录，列表接口按 (排序列, id) 做 keyset 分页，每次查询只读取一页数据；
+    - faces: 人脸记录，特征向量不在表中，store_offset 指向 EmbeddingStore（内存映射）中的行；
+    - groups / group_members: 分组及其成员，修改分组只更新对应的行；
+    - perceptual_hash_log: dHash 的变更日志（perceptual_hash 为 NULL 表示图片已删除），
+      各进程的近似去重索引只应用上次同步之后的记录；
+    - settings: 最近一次聚类的阈值等少量键值；
+    - jobs: 多进程共享的任务队列，见 job_manager.SharedJobQueue。
+    每个写操作在一个事务中完成，服务重启后从这里恢复状态；多个 API 进程打开同一个数据库文件，
+    看到的是同一份数据。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # WAL 模式下读不阻塞写；synchronous=NORMAL 在 WAL 下断电也不会损坏数据库
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # 其他进程持有写锁时等待而不是立即报错
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            self._ensure_unique_content_hash()
+
+    def _ensure_unique_content_hash(self):
+        """content_hash 唯一索引，保证多个进程同时上传同一文件时只有一条记录
+
+        旧版本的索引不唯一，并发上传可能留下内容相同的多条记录：保留最早的一条，其余记录的
+        分组成员转移到保留的记录，人脸记录删除（上传文件留在磁盘上，不再被引用）。
+        """
+        if self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+                              ('idx_images_content_hash_unique',)).fetchone() is not None:
+            return
+        self._conn.execute("DROP INDEX IF EXISTS idx_images_content_hash")
+        rows = self._conn.execute(
+            "SELECT id, content_hash FROM images WHERE content_hash IN ("
+            "SELECT content_hash FROM images WHERE content_hash IS NOT NULL "
+            "GROUP BY content_hash HAVING COUNT(*) > 1) ORDER BY content_hash, created_at, id").fetchall()
+        keep, faces_deleted = {}, 0
+        for image_id, content_hash in rows:
+            if content_hash not in keep:
+                keep[content_hash] = image_id
+                continue
+            self._conn.execute("UPDATE OR IGNORE group_members SET image_id = ? WHERE image_id = ?",
+                               (keep[content_hash], image_id))
+            self._conn.execute("DELETE FROM group_members WHERE image_id = ?", (image_id,))
+            faces_deleted += self._conn.execute("DELETE FROM faces WHERE image_id = ?", (image_id,)).rowcount
+            self._conn.execute("DELETE FROM images WHERE id = ?", (image_id,))
+            self._conn.execute("INSERT INTO perceptual_hash_log (image_id) VALUES (?)", (image_id,))
+            print(f"合并重复图片记录 {image_id} -> {keep[content_hash]}")
+        if faces_deleted:
+            self._bump_face_state()
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_images_content_hash_unique ON images (content_hash)")
+
+    @staticmethod
+    def _to_row(image: Dict[str, Any]) -> Tuple:
+        values = []
+        for column in IMAGE_COLUMNS:
+            value = image.get(column)
+            if column in _TIME_COLUMNS and isinstance(value, datetime):
+                value = value.timestamp()
+            elif column in ('size', 'score') and value is None:
+                value = 0
+            values.append(value)
+        return tuple(values)
+
+    @staticmethod
+    def _from_row(row: sqlite3.Row) -> Dict[str, Any]:
+        record = dict(row)
+        for column in _TIME_COLUMNS:
+            if record.get(column) is not None:
+                record[column] = datetime.fromtimestamp(record[column])
+        return record
+
+    @staticmethod
+    def _timestamp(value: Optional[datetime]) -> Optional[float]:
+        return value.timestamp() if isinstance(value, datetime) else value
+
+    def insert_image(self, image: Dict[str, Any]) -> Optional[str]:
+        """插入图片记录；已有相同 content_hash 的图片时不插入并返回已有图片ID
+
+        查重和插入是同一条语句，由唯一索引保证，多个进程同时上传同一文件时也只有一条记录。
+        """
+        placeholders = ', '.join('?' for _ in IMAGE_COLUMNS)
+        with self._lock, self._conn:
+            inserted = self._conn.execute(
+                f"INSERT INTO images ({', '.join(IMAGE_COLUMNS)}) VALUES ({placeholders}) "
+                "ON CONFLICT (content_hash) DO NOTHING",
+                self._to_row(image)
+            ).rowcount
+            if not inserted:
+                return self._conn.execute("SELECT id FROM images WHERE content_hash = ?",
+                                          (image['content_hash'],)).fetchone()[0]
+            if image.get('perceptual_hash') is not None:
+                self._conn.execute("INSERT INTO perceptual_hash_log (image_id, perceptual_hash) VALUES (?, ?)",
+                                   (image['id'], image['perceptual_hash']))
+            return None
+
+    def get_image(self, image_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM images WHERE id = ?", (image_id,)).fetchone()
+        return self._from_row(row) if row is not None else None
+
+    def get_images(self, image_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量查询图片，返回 image_id -> 记录，不存在的 ID 不出现在结果中"""
+        records = {}
+        ids = list(dict.fromkeys(image_ids))
+        # SQLite 默认最多 999 个参数，分批查询
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT * FROM images WHERE id IN ({', '.join('?' for _ in batch)})", batch).fetchall()
+                for row in rows:
+                    records[row['id']] = self._from_row(row)
+        return records
+
+    def find_image_by_hash(self, content_hash: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM images WHERE content_hash = ?", (content_hash,)).fetchone()
+        return row[0] if row is not None else None
+
+    def perceptual_hashes(self) -> List[Tuple[str, str]]:
+        """所有已计算 dHash 的图片 (image_id, 十六进制 dHash)"""
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute(
+                "SELECT id, perceptual_hash FROM images WHERE perceptual_hash IS NOT NULL ORDER BY created_at, id")]
+
+    def perceptual_hash_state(self) -> Tuple[int, int]:
+        """(清空次数, dHash 变更日志的最新序号)"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (PERCEPTUAL_EPOCH_KEY,)).fetchone()
+            seq = self._conn.execute("SELECT MAX(seq) FROM perceptual_hash_log").fetchone()[0]
+        return (int(row[0]) if row is not None else 0), (seq or 0)
+
+    def perceptual_hash_changes(self, after_seq: int) -> List[Tuple[int, str, Optional[str]]]:
+        """序号大于 after_seq 的 dHash 变更 (序号, image_id, dHash 或 None)，按序号升序"""
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute(
+                "SELECT seq, image_id, perceptual_hash FROM perceptual_hash_log WHERE seq > ? ORDER BY seq",
+                (after_seq,))]
+
+    def delete_image(self, image_id: str) -> Optional[int]:
+        """删除图片及其分组成员和人脸记录
+
+        删除了人脸时递增人脸状态版本号并返回新值（其他进程的识别器随之重新加载），否则返回 None。
+        """
+        with self._lock, self._conn:
+            if self._conn.execute("DELETE FROM images WHERE id = ?", (image_id,)).rowcount > 0:
+                self._conn.execute("INSERT INTO perceptual_hash_log (image_id) VALUES (?)", (image_id,))
+            self._conn.execute("DELETE FROM group_members WHERE image_id = ?", (image_id,))
+            if self._conn.execute("DELETE FROM faces WHERE image_id = ?", (image_id,)).rowcount > 0:
+                return self._bump_face_state()
+            return None
+
+    def all_images(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM images ORDER BY created_at, id").fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def _replace_members(self, group_id: str, image_ids: List[str]):
+        """只删除移出的成员、插入新增的成员（需在事务中调用）"""
+        current = {row[0] for row in self._conn.execute(
+            "SELECT image_id FROM group_members WHERE group_id = ?", (group_id,))}
+        wanted = set(image_ids)
+        self._conn.executemany(
+            "DELETE FROM group_members WHERE group_id = ? AND image_id = ?",
+            [(group_id, image_id) for image_id in current - wanted]
+        )
+        self._conn.executemany(
+            "INSERT INTO group_members (group_id, image_id) VALUES (?, ?)",
+            [(group_id, image_id) for image_id in wanted - current]
+        )
+
+    def upsert_group(self, group: Dict[str, Any]):
+        """新建或更新一个分组：分组信息为单行 upsert，成员按差异增删"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO groups (id, name, created_at, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET name = excluded.name, updated_at = excluded.updated_at",
+                (group['id'], group['name'], self._timestamp(group.get('created_at')),
+                 self._timestamp(group.get('updated_at')))
+            )
+            self._replace_members(group['id'], group.get('image_ids', []))
+
+    def delete_group(self, group_id: str) -> bool:
+        """删除分组，返回是否存在该分组"""
+        with self._lock, self._conn:
+            deleted = self._conn.execute("DELETE FROM groups WHERE id = ?", (group_id,)).rowcount
+            self._conn.execute("DELETE FROM group_members WHERE group_id = ?", (group_id,))
+        return deleted > 0
+
+    def get_group(self, group_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM groups WHERE id = ?", (group_id,)).fetchone()
+            if row is None:
+                return None
+            group = self._from_row(row)
+            group['image_ids'] = [r[0] for r in self._conn.execute(
+                "SELECT image_id FROM group_members WHERE group_id = ?", (group_id,))]
+        return group
+
+    def all_groups(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            groups = [self._from_row(row) for row in self._conn.execute(
+                "SELECT * FROM groups ORDER BY created_at, id")]
+            members: Dict[str, List[str]] = {}
+            for group_id, image_id in self._conn.execute("SELECT group_id, image_id FROM group_members"):
+                members.setdefault(group_id, []).append(image_id)
+        for group in groups:
+            group['image_ids'] = members.get(group['id'], [])
+        return groups
+
+    def add_faces(self, faces: List[Tuple[str, int, int, Dict[str, Any]]]) -> int:
+        """写入一批人脸记录 (image_id, 人脸序号, EmbeddingStore 中的行号, 人脸信息)，返回新的人脸状态版本号"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO faces (image_id, face_index, store_offset, bbox, det_score, quality_score) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(image_id, face_index, offset, json.dumps([float(v) for v in face['bbox']]),
+                  face.get('det_score'), face.get('quality_score'))
+                 for image_id, face_index, offset, face in faces]
+            )
+            return self._bump_face_state()
+
+    def delete_faces(self, faces: List[Tuple[str, int]]) -> int:
+        """删除一批人脸记录 (image_id, 人脸序号)，返回新的人脸状态版本号"""
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM faces WHERE image_id = ? AND face_index = ?", faces)
+            return self._bump_face_state()
+
+    def get_faces(self, image_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM faces WHERE image_id = ? ORDER BY face_index", (image_id,)).fetchall()
+        faces = []
+        for row in rows:
+            face = dict(row)
+            face['bbox'] = json.loads(face['bbox'])
+            faces.append(face)
+        return faces
+
+    def face_offsets(self) -> np.ndarray:
+        """现存人脸在 EmbeddingStore 中的行号（升序）；已删除图片的人脸不在其中"""
+        with self._lock:
+            rows = self._conn.execute("SELECT store_offset FROM faces ORDER BY store_offset").fetchall()
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def face_registry(self) -> List[Tuple[str, int, int]]:
+        """全部现存人脸 (image_id, 人脸序号, EmbeddingStore 中的行号)，用于恢复识别器的人脸登记表"""
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute(
+                "SELECT image_id, face_index, store_offset FROM faces ORDER BY store_offset")]
+
+    def faces_by_offsets(self, offsets) -> Dict[int, Tuple[str, int]]:
+        """批量按 EmbeddingStore 行号查询人脸，返回 行号 -> (image_id, 人脸序号)，已删除的人脸不出现在结果中"""
+        faces = {}
+        offsets = [int(offset) for offset in offsets]
+        with self._lock:
+            for start in range(0, len(offsets), 500):
+                batch = offsets[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT store_offset, image_id, face_index FROM faces "
+                    f"WHERE store_offset IN ({', '.join('?' for _ in batch)})", batch).fetchall()
+                for offset, image_id, face_index in rows:
+                    faces[offset] = (image_id, face_index)
+        return faces
+
+    def _bump_face_state(self) -> int:
+        """递增人脸状态版本号并返回新值（需在事务中调用）"""
+        self._conn.execute(
+            "INSERT INTO settings (key, value) VALUES (?, '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+            (FACE_STATE_VERSION_KEY,)
+        )
+        return int(self._conn.execute(
+            "SELECT value FROM settings WHERE key = ?", (FACE_STATE_VERSION_KEY,)).fetchone()[0])
+
+    def face_state_version(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM settings WHERE key = ?", (FACE_STATE_VERSION_KEY,)).fetchone()
+        return int(row[0]) if row is not None else 0
+
+    def save_cluster_labels(self, labels, threshold: float, offsets=None) -> int:
+        """保存聚类结果：labels[i] 为 EmbeddingStore 第 i 行人脸的分组标签，返回新的人脸状态版本号
+
+        offsets 为标签有变化的行号，只更新这些行；为 None 时更新全部行。
+        """
+        if offsets is None:
+            offsets = range(len(labels))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE faces SET cluster_label = ? WHERE store_offset = ?",
+                [(int(labels[offset]), int(offset)) for offset in offsets]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('cluster_threshold', ?)",
+                (repr(float(threshold)),)
+            )
+            return self._bump_face_state()
+
+    def load_cluster_labels(self, face_count: int):
+        """返回 (长度为 face_count 的标签数组, 阈值)；从未聚类时返回 (None, None)
+
+        没有人脸记录的行（例如图片已删除）标签为 -1。
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = 'cluster_threshold'").fetchone()
+            if row is None:
+                return None, None
+            labels = np.full(face_count, -1, dtype=np.int64)
+            for offset, label in self._conn.execute(
+                    "SELECT store_offset, cluster_label FROM faces WHERE store_offset < ?", (face_count,)):
+                labels[offset] = label
+        return labels, float(row[0])
+
+    def clear(self) -> int:
+        """清空图片、人脸和分组（保留任务记录），返回新的人脸状态版本号"""
+        with self._lock, self._conn:
+            for table in ('images', 'group_members', 'groups', 'faces', 'perceptual_hash_log'):
+                self._conn.execute(f"DELETE FROM {table}")
+            # 版本号保持递增，其他进程才能发现数据已被清空
+            self._conn.execute("DELETE FROM settings WHERE key NOT IN (?, ?)",
+                               (FACE_STATE_VERSION_KEY, PERCEPTUAL_EPOCH_KEY))
+            self._conn.execute(
+                "INSERT INTO settings (key, value) VALUES (?, '1') "
+                "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                (PERCEPTUAL_EPOCH_KEY,)
+            )
+            return self._bump_face_state()
+
+    @staticmethod
+    def _job_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        for column in _TIME_COLUMNS:
+            job[column] = datetime.fromtimestamp(job[column])
+        return job
+
+    def create_job(self, job_id: str, kind: str, payload: Dict[str, Any], max_finished_jobs: int = 100):
+        """新建排队中的任务，并只保留最近的若干个已结束任务"""
+        now = datetime.now().timestamp()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, kind, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), JOB_QUEUED, now, now)
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND job_id NOT IN "
+                "(SELECT job_id FROM jobs WHERE status IN (?, ?) ORDER BY updated_at DESC LIMIT ?)",
+                (JOB_DONE, JOB_FAILED, JOB_DONE, JOB_FAILED, max_finished_jobs)
+            )
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._job_from_row(row) if row is not None else None
+
+    def claim_job(self, kinds: List[str]) -> Optional[Dict[str, Any]]:
+        """领取最早排队的一个任务并标记为运行中；多个进程同时领取时只有一个会成功"""
+        placeholders = ', '.join('?' for _ in kinds)
+        with self._lock:
+            while True:
+                row = self._conn.execute(
+                    f"SELECT job_id FROM jobs WHERE status = ? AND kind IN ({placeholders}) "
+                    "ORDER BY created_at LIMIT 1", (JOB_QUEUED, *kinds)).fetchone()
+                if row is None:
+                    return None
+                with self._conn:
+                    claimed = self._conn.execute(
+                        "UPDATE jobs SET status = ?, updated_at = ?, version = version + 1 "
+                        "WHERE job_id = ? AND status = ?",
+                        (JOB_RUNNING, datetime.now().timestamp(), row[0], JOB_QUEUED)
+                    ).rowcount
+                if claimed:
+                    job = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (row[0],)).fetchone()
+                    return self._job_from_row(job)
+
+    def update_job(self, job_id: str, **fields):
+        """更新任务字段（status / stage / current / total / result / error），版本号加一"""
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'], default=str)
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ?, version = version + 1 WHERE job_id = ?",
+                (*fields.values(), datetime.now().timestamp(), job_id)
+            )
+
+    def fail_running_jobs(self, error: str) -> int:
+        """把仍标记为运行中的任务置为失败（推理进程重启时调用），返回任务数"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?, version = version + 1 WHERE status = ?",
+                (JOB_FAILED, error, datetime.now().timestamp(), JOB_RUNNING)
+            ).rowcount
+
+    def list_images(self, sort: str = 'created_at', order: str = 'desc', limit: int = 50,
+                    cursor: Optional[str] = None, group_id: Optional[str] = None):
+        """分页查询图片，返回 (图片列表, 下一页游标)；没有更多数据时游标为 None"""
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"不支持的排序字段: {sort}，可选 {list(SORT_COLUMNS)}")
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"不支持的排序方向: {order}")
+
+        comparison = '<' if order == 'desc' else '>'
+        direction = 'DESC' if order == 'desc' else 'ASC'
+        conditions = []
+        params: List[Any] = []
+        if cursor is not None:
+            value, last_id = _decode_cursor(cursor)
+            conditions.append(f"({sort}, id) {comparison} (?, ?)")
+            params.extend([value, last_id])
+        if group_id is not None:
+            # 从分组成员表出发只读取该分组的图片，代价与分组大小相关而不是图片总数
+            conditions.append("id IN (SELECT image_id FROM group_members WHERE group_id = ?)")
+            params.append(group_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # 多取一条用于判断是否还有下一页
+        sql = f"SELECT * FROM images {where} ORDER BY {sort} {direction}, id {direction} LIMIT ?"
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = _encode_cursor(last[sort], last['id'])
+        return [self._from_row(row) for row in rows], next_cursor
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
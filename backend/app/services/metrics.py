@@ -0,0 +1,320 @@
+"""轻量级的进程内指标（直方图 / 计数器 / 仪表），以 Prometheus 文本格式导出
+
+不依赖第三方库，记录一次观测只需要一次加锁和几次算术运算。
+人脸检测和识别在特征提取进程、推理进程中运行，各进程通过 share() 把自己的指标快照
+写入共享目录（每个进程一个文件），/metrics 接口渲染时合并所有存活进程的快照：
+计数器和直方图按标签求和，仪表按进程（pid 标签）分别输出。
+进程退出后其快照被丢弃，合并后的计数器随之回落，Prometheus 按计数器重置处理。
+"""
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+import contextlib
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows 下用 pid 是否存在判断进程存活
+    fcntl = None
+
+from app.services.model_registry import current_rss_mb
+
+# 默认的耗时直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._registry: Optional["MetricsRegistry"] = None
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _changed(self):
+        if self._registry is not None:
+            self._registry.dirty = True
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self._lock:
+            return [(key, self._copy(value)) for key, value in self._values.items()]
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self._changed()
+
+
+class Gauge(_Metric):
+    """可以任意设置的当前值；set_function 设置的回调在导出时求值"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+        self._changed()
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            return [((), float(self._function()))]
+        return super().samples()
+
+
+class Histogram(_Metric):
+    """固定分桶的直方图，每个标签组合记录 (各分桶计数, 总和, 次数)"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # 落在最后一个分桶之外的观测只计入 +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+        self._changed()
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """记录 with 代码块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self.dirty = False
+        self._shared_dir: Optional[str] = None
+        self._lock_file = None
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标 {metric.name} 已注册")
+            self._metrics[metric.name] = metric
+        metric._registry = self
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, dict]:
+        """当前进程全部指标的可序列化快照"""
+        result = {}
+        for metric in list(self._metrics.values()):
+            entry = {'kind': metric.kind, 'help': metric.documentation, 'labelnames': list(metric.labelnames),
+                     'samples': [[list(key), value] for key, value in metric.samples()]}
+            if isinstance(metric, Histogram):
+                entry['buckets'] = list(metric.buckets)
+            result[metric.name] = entry
+        return result
+
+    def share(self, directory: str):
+        """把本进程的指标共享到 directory，供其他进程的 /metrics 合并；重复调用同一目录无影响"""
+        if self._shared_dir == directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self._shared_dir = directory
+        if fcntl is not None:
+            # 进程存活期间一直持有该文件锁，其他进程据此判断快照是否过期（进程退出时自动释放）
+            self._lock_file = open(os.path.join(directory, f"{os.getpid()}.lock"), 'w')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self.flush(force=True)
+
+    def flush(self, force: bool = False):
+        """指标有变化时把快照写入共享目录（先写临时文件再原子替换）"""
+        if self._shared_dir is None or not (self.dirty or force):
+            return
+        self.dirty = False
+        data = json.dumps({'pid': os.getpid(), 'metrics': self.snapshot()})
+        fd, tmp_path = tempfile.mkstemp(dir=self._shared_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self._shared_dir, f"{os.getpid()}.json"))
+        except OSError as e:
+            print(f"写入指标快照失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _process_alive(self, pid: int) -> bool:
+        if fcntl is not None:
+            lock_path = os.path.join(self._shared_dir, f"{pid}.lock")
+            try:
+                with open(lock_path, 'a') as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        return True
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                return False
+            except OSError:
+                return False
+        try:
+            os.kill(pid, 0)
+        except PermissionError:
+            return True
+        except OSError:
+            return False
+        return True
+
+    def _other_snapshots(self) -> List[Tuple[int, Dict[str, dict]]]:
+        """读取共享目录中其他存活进程的快照，删除已退出进程留下的文件"""
+        if self._shared_dir is None:
+            return []
+        snapshots = []
+        for filename in os.listdir(self._shared_dir):
+            stem, ext = os.path.splitext(filename)
+            if ext != '.json' or not stem.isdigit() or int(stem) == os.getpid():
+                continue
+            pid = int(stem)
+            path = os.path.join(self._shared_dir, filename)
+            if not self._process_alive(pid):
+                for stale in (path, os.path.join(self._shared_dir, f"{pid}.lock")):
+                    with contextlib.suppress(OSError):
+                        os.remove(stale)
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append((pid, json.load(f)['metrics']))
+            except (OSError, ValueError, KeyError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """合并本进程与共享目录中其他进程的指标，输出 Prometheus 文本格式"""
+        self.flush()
+        snapshots = [(os.getpid(), self.snapshot())] + self._other_snapshots()
+        names = sorted({name for _, snapshot in snapshots for name in snapshot})
+        lines = []
+        for name in names:
+            entries = [(pid, snapshot[name]) for pid, snapshot in snapshots if name in snapshot]
+            first = entries[0][1]
+            lines.append(f"# HELP {name} {first['help']}")
+            lines.append(f"# TYPE {name} {first['kind']}")
+            labelnames = first['labelnames']
+            if first['kind'] == 'gauge':
+                for pid, entry in entries:
+                    for key, value in entry['samples']:
+                        labels = _format_labels(list(labelnames) + ['pid'], key + [str(pid)])
+                        lines.append(f"{name}{labels} {_format_value(value)}")
+                continue
+
+            merged: Dict[Tuple[str, ...], object] = {}
+            for _, entry in entries:
+                for key, value in entry['samples']:
+                    key = tuple(key)
+                    if first['kind'] == 'counter':
+                        merged[key] = merged.get(key, 0) + value
+                    elif key not in merged:
+                        merged[key] = [list(value[0]), value[1], value[2]]
+                    else:
+                        total = merged[key]
+                        total[0] = [a + b for a, b in zip(total[0], value[0])]
+                        total[1] += value[1]
+                        total[2] += value[2]
+            for key in sorted(merged):
+                value = merged[key]
+                if first['kind'] == 'counter':
+                    lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(first['buckets']) + ['+Inf'], value[0]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(list(labelnames) + ['le'], list(key) + [le])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(value[1])}")
+                lines.append(f"{name}_count{_format_labels(labelnames, key)} {value[2]}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str]) -> str:
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = MetricsRegistry()
+
+# 特征提取各阶段
+DECODE_SECONDS = REGISTRY.histogram('face_image_decode_seconds', '人脸检测前解码一张图片的耗时')
+DETECTION_SECONDS = REGISTRY.histogram('face_detection_seconds', '一张图片的人脸检测耗时')
+RECOGNITION_SECONDS = REGISTRY.histogram('face_recognition_seconds', '一次人脸识别（一个批次）的耗时')
+QUALITY_SECONDS = REGISTRY.histogram('face_quality_seconds', '一张图片中全部人脸的质量评估耗时')
+FACES_KEPT = REGISTRY.counter('faces_kept_total', '通过质量评估的人脸数')
+FACES_REJECTED = REGISTRY.counter('faces_rejected_total', '未通过质量评估的人脸数（按原因，一个人脸可能有多个原因）',
+                                  labelnames=('reason',))
+
+# 索引与聚类
+INDEX_BUILD_SECONDS = REGISTRY.histogram('face_index_build_seconds', '构建 Faiss 人脸索引的耗时')
+INDEX_UPDATE_SECONDS = REGISTRY.histogram('face_index_update_seconds', '增量更新 Faiss 人脸索引（添加/删除人脸）的耗时')
+DISTANCE_MATRIX_SECONDS = REGISTRY.histogram('face_distance_matrix_seconds', '计算聚类距离矩阵（稠密或稀疏）的耗时',
+                                             labelnames=('method',))
+DBSCAN_SECONDS = REGISTRY.histogram('face_dbscan_seconds', '每次 DBSCAN 的耗时（阈值扫描、最终聚类、增量局部聚类）',
+                                    labelnames=('phase',))
+INDEX_SIZE = REGISTRY.gauge('face_index_vectors', 'Faiss 人脸索引中的向量数')
+MEMORY_RSS = REGISTRY.gauge('process_resident_memory_bytes', '进程常驻内存（字节）')
+MEMORY_RSS.set_function(lambda: current_rss_mb() * 1024 * 1024)
@@ -0,0 +1,99 @@
+import sys
+import time
+import threading
+import resource
+from typing import Dict, Any, Optional, Sequence, Tuple
+
+# 人脸模型名称与参数，决定特征缓存的键
+FACE_MODEL_NAME = 'buffalo_l'
+FACE_DET_SIZE = (640, 640)
+
+# 按优先级排列的 ONNX 执行提供程序
+PREFERRED_PROVIDERS = ['CUDAExecutionProvider', 'CoreMLExecutionProvider', 'CPUExecutionProvider']
+
+_lock = threading.Lock()
+_face_analyzers: Dict[Tuple, Any] = {}
+_load_stats: Dict[str, Dict[str, float]] = {}
+
+
+def select_providers():
+    """根据当前系统可用的执行提供程序选择最佳组合，始终保留 CPU 作为回退"""
+    import onnxruntime as ort
+
+    available = ort.get_available_providers()
+    providers = [p for p in PREFERRED_PROVIDERS if p in available]
+    if 'CPUExecutionProvider' not in providers:
+        providers.append('CPUExecutionProvider')
+    return providers
+
+
+def current_rss_mb() -> float:
+    """当前进程常驻内存（MB），无法读取 /proc 时使用峰值 RSS"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 返回字节，Linux 返回 KB
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def get_face_analyzer(name: str = FACE_MODEL_NAME, det_size: Tuple[int, int] = FACE_DET_SIZE,
+                      allowed_modules: Optional[Sequence[str]] = None):
+    """获取共享的 FaceAnalysis 实例，同一进程内相同配置只加载一次"""
+    key = (name, tuple(det_size), tuple(allowed_modules) if allowed_modules else None)
+    analyzer = _face_analyzers.get(key)
+    if analyzer is not None:
+        return analyzer
+
+    with _lock:
+        analyzer = _face_analyzers.get(key)
+        if analyzer is not None:
+            return analyzer
+
+        from insightface.app import FaceAnalysis
+
+        providers = select_providers()
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        analyzer = FaceAnalysis(
+            name=name,
+            providers=providers,
+            allowed_modules=list(allowed_modules) if allowed_modules else None
+        )
+        analyzer.prepare(ctx_id=0, det_size=tuple(det_size))
+        elapsed = time.perf_counter() - start
+        rss_after = current_rss_mb()
+
+        _face_analyzers[key] = analyzer
+        _load_stats[f"{name}@{det_size[0]}x{det_size[1]}"] = {
+            'load_seconds': round(elapsed, 3),
+            'rss_delta_mb': round(rss_after - rss_before, 1),
+            'rss_mb': round(rss_after, 1),
+        }
+        print(f"已加载人脸模型 {name} (providers={providers}): "
+              f"耗时 {elapsed:.2f}s, RSS +{rss_after - rss_before:.0f}MB -> {rss_after:.0f}MB")
+        return analyzer
+
+
+def warm_up(name: str = FACE_MODEL_NAME, det_size: Tuple[int, int] = FACE_DET_SIZE):
+    """加载模型并对空白图片各执行一次检测和识别，消除首个请求的初始化开销"""
+    import numpy as np
+
+    analyzer = get_face_analyzer(name, det_size)
+    start = time.perf_counter()
+    analyzer.get(np.zeros((det_size[1], det_size[0], 3), dtype=np.uint8))
+    recognizer = analyzer.models.get('recognition')
+    if recognizer is not None:
+        size = recognizer.input_size[0]
+        recognizer.get_feat(np.zeros((size, size, 3), dtype=np.uint8))
+    print(f"模型 {name} 预推理完成，耗时 {time.perf_counter() - start:.2f}s")
+
+
+def get_load_stats() -> Dict[str, Dict[str, float]]:
+    """已加载模型的加载耗时与内存占用"""
+    with _lock:
+        return {name: dict(stats) for name, stats in _load_stats.items()}
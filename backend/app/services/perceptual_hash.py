@@ -0,0 +1,91 @@
+import threading
+import numpy as np
+from PIL import Image
+from typing import Optional, Tuple
+
+# dHash 边长，hash_size × hash_size 位
+HASH_SIZE = 8
+
+
+def dhash(path: str, hash_size: int = HASH_SIZE) -> int:
+    """计算图片的差值哈希（dHash）
+
+    JPEG 使用 draft 模式按 1/2~1/8 比例直接解码缩小后的图像，不需要解码全分辨率像素。
+    """
+    with Image.open(path) as img:
+        img.draft('L', (hash_size * 8, hash_size * 8))
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class PerceptualHashIndex:
+    """保存 image_id -> dHash，按汉明距离查找近似重复的图片
+
+    哈希保存在按倍数扩容的数组中，逐个添加的均摊开销为 O(1)；删除时用最后一个元素填补空位。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._image_ids = []
+        # image_id -> 在 _hashes 中的下标
+        self._positions = {}
+
+    def __len__(self) -> int:
+        return len(self._image_ids)
+
+    def add(self, image_id: str, image_hash: int):
+        """添加或更新一张图片的 dHash"""
+        with self._lock:
+            position = self._positions.get(image_id)
+            if position is None:
+                position = len(self._image_ids)
+                if position == len(self._hashes):
+                    grown = np.empty(max(16, 2 * position), dtype=np.uint64)
+                    grown[:position] = self._hashes[:position]
+                    self._hashes = grown
+                self._image_ids.append(image_id)
+                self._positions[image_id] = position
+            self._hashes[position] = np.uint64(image_hash)
+
+    def bulk_load(self, entries):
+        """用 [(image_id, dHash)] 一次性替换全部内容，重建索引时使用"""
+        image_ids = [image_id for image_id, _ in entries]
+        hashes = np.array([image_hash for _, image_hash in entries], dtype=np.uint64)
+        with self._lock:
+            self._image_ids = image_ids
+            self._hashes = hashes
+            self._positions = {image_id: i for i, image_id in enumerate(image_ids)}
+
+    def remove(self, image_id: str):
+        with self._lock:
+            position = self._positions.pop(image_id, None)
+            if position is None:
+                return
+            last = len(self._image_ids) - 1
+            if position != last:
+                moved = self._image_ids[last]
+                self._image_ids[position] = moved
+                self._hashes[position] = self._hashes[last]
+                self._positions[moved] = position
+            self._image_ids.pop()
+
+    def clear(self):
+        with self._lock:
+            self._hashes = np.empty(0, dtype=np.uint64)
+            self._image_ids = []
+            self._positions = {}
+
+    def find(self, image_hash: int, max_distance: int) -> Optional[Tuple[str, int]]:
+        """返回汉明距离最小且不超过 max_distance 的 (image_id, 距离)，没有时返回 None"""
+        with self._lock:
+            if not self._image_ids:
+                return None
+            xor = np.bitwise_xor(self._hashes[:len(self._image_ids)], np.uint64(image_hash))
+            distances = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+            best = int(np.argmin(distances))
+            if distances[best] > max_distance:
+                return None
+            return self._image_ids[best], int(distances[best])
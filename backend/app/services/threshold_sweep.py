@@ -0,0 +1,107 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
+
+
+class ThresholdSweep:
+    """一次计算即可得到所有候选阈值下 DBSCAN 分组数的阈值扫描器
+
+    DBSCAN(min_samples=k) 在阈值 eps 下的分组数等于核心点之间连通分量的个数：
+    - 点 i 为核心点 <=> 其第 k 近邻（含自身）的距离 core_i <= eps
+    - 两个核心点相连 <=> d_ij <= eps
+    令互达距离 w_ij = max(d_ij, core_i, core_j)（HDBSCAN 的 mutual reachability），
+    在最大阈值下的图上求一次最小生成森林，则对任意 eps：
+        分组数(eps) = #{core_i <= eps} - #{生成森林中 w <= eps 的边}
+    因此只需扫描一次距离矩阵，而不是对每个候选阈值各跑一次 DBSCAN。
+    """
+
+    def __init__(self, core_distances, merge_weights):
+        self.core_distances = core_distances
+        self.merge_weights = merge_weights
+
+    @staticmethod
+    def _core_distances(distances, min_samples, block_size):
+        """逐块计算每个点第 min_samples 近邻（含自身）的距离"""
+        n = distances.shape[0]
+        core = np.full(n, np.inf, dtype=distances.dtype)
+        if n < min_samples:
+            return core
+        for start in range(0, n, block_size):
+            block = distances[start:start + block_size]
+            core[start:start + block_size] = np.partition(block, min_samples - 1, axis=1)[:, min_samples - 1]
+        return core
+
+    @classmethod
+    def from_dense(cls, distances, max_eps, min_samples=3, block_size=1024):
+        """基于稠密预计算距离矩阵构建扫描器
+
+        使用 Prim 算法在最大阈值图上求互达距离的最小生成森林，
+        每一步只处理一行距离，额外内存为 O(N)。
+        """
+        core = cls._core_distances(distances, min_samples, block_size)
+        # 在最大阈值下都不是核心点的样本不会参与任何分组
+        core_idx = np.flatnonzero(core <= max_eps)
+        m = len(core_idx)
+        merge_weights = []
+        if m > 1:
+            core_sub = core[core_idx]
+            key = np.full(m, np.inf, dtype=distances.dtype)
+            visited = np.zeros(m, dtype=bool)
+            current = 0
+            visited[current] = True
+            for _ in range(m - 1):
+                row = distances[core_idx[current], core_idx]
+                reach = np.maximum(np.maximum(row, core_sub[current]), core_sub)
+                reach[~(row <= max_eps)] = np.inf
+                np.minimum(key, reach, out=key)
+                key[visited] = np.inf
+                current = int(np.argmin(key))
+                weight = key[current]
+                if np.isfinite(weight):
+                    merge_weights.append(weight)
+                else:
+                    # 当前连通分量已处理完，从下一个未访问的核心点开始新的树
+                    current = int(np.argmin(visited))
+                visited[current] = True
+        return cls(core, np.array(merge_weights, dtype=distances.dtype))
+
+    @classmethod
+    def from_sparse(cls, graph, max_eps, min_samples=3):
+        """基于稀疏预计算距离图（CSR，每行只存近邻，需包含自身）构建扫描器
+
+        未存储的元素视为无穷远，与 DBSCAN(metric='precomputed') 对稀疏输入的处理一致。
+        内存与存储的边数成正比。
+        """
+        graph = csr_matrix(graph)
+        n = graph.shape[0]
+        core = np.full(n, np.inf, dtype=graph.dtype)
+        row_lengths = np.diff(graph.indptr)
+        for i in np.flatnonzero(row_lengths >= min_samples):
+            row = graph.data[graph.indptr[i]:graph.indptr[i + 1]]
+            core[i] = np.partition(row, min_samples - 1)[min_samples - 1]
+
+        coo = graph.tocoo()
+        mask = (coo.row < coo.col) & (coo.data <= max_eps)
+        rows, cols, dists = coo.row[mask], coo.col[mask], coo.data[mask]
+        reach = np.maximum(np.maximum(dists, core[rows]), core[cols])
+        keep = reach <= max_eps
+        rows, cols, reach = rows[keep], cols[keep], reach[keep]
+        if len(reach) == 0:
+            return cls(core, np.array([], dtype=graph.dtype))
+
+        # 用边的排名代替权重求最小生成森林：排名全为正数，避免 0 距离被当作"无边"，
+        # 且生成森林只依赖边的相对顺序
+        order = np.argsort(reach, kind='stable')
+        ranks = np.empty(len(reach), dtype=np.float64)
+        ranks[order] = np.arange(1, len(reach) + 1)
+        forest = minimum_spanning_tree(csr_matrix((ranks, (rows, cols)), shape=(n, n))).tocoo()
+        merge_weights = reach[order[forest.data.astype(np.int64) - 1]]
+        return cls(core, merge_weights)
+
+    def cluster_count(self, eps):
+        """给定阈值下 DBSCAN 的分组数（不含噪声）"""
+        return int(np.count_nonzero(self.core_distances <= eps) - np.count_nonzero(self.merge_weights <= eps))
+
+    def cluster_counts(self, thresholds):
+        """所有候选阈值下的分组数"""
+        return [self.cluster_count(eps) for eps in thresholds]
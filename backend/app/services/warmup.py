@@ -0,0 +1,61 @@
+import time
+import threading
+import traceback
+from typing import Callable, Dict, Any, Optional
+
+# 预热阶段
+STATE_PENDING = 'pending'
+STATE_LOADING = 'loading'
+STATE_READY = 'ready'
+STATE_FAILED = 'failed'
+
+
+class Warmup:
+    """在后台线程中加载模型并执行一次推理，服务端口无需等待模型加载即可响应"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.state = STATE_PENDING
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def start(self, target: Callable[[], None]):
+        """启动预热线程，重复调用不会重复预热"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(target,), name='model-warmup', daemon=True)
+            self._thread.start()
+
+    def _run(self, target: Callable[[], None]):
+        self.state = STATE_LOADING
+        self.started_at = time.time()
+        try:
+            target()
+            self.state = STATE_READY
+            print(f"模型预热完成，耗时 {time.time() - self.started_at:.2f}s")
+        except Exception as e:
+            self.error = str(e)
+            self.state = STATE_FAILED
+            print(f"模型预热失败: {str(e)}")
+            traceback.print_exc()
+        finally:
+            self.finished_at = time.time()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == STATE_READY
+
+    def status(self) -> Dict[str, Any]:
+        status = {'ready': self.ready, 'state': self.state}
+        if self.error:
+            status['error'] = self.error
+        if self.started_at is not None:
+            end = self.finished_at or time.time()
+            status['elapsed_seconds'] = round(end - self.started_at, 3)
+        return status
+
+
+warmup = Warmup()
@@ -0,0 +1,83 @@
+"""对比逐张图片提取与跨图片批量识别的吞吐量（faces/sec）
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.extraction_throughput <图片目录> --batch-sizes 16 64 128
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import cv2
+
+from app.services.face_quality import FaceQualityAssessor
+from app.services.feature_cache import FeatureCache
+from app.services.face_extraction import detect_faces, BatchFaceExtractor
+from app.services.model_registry import get_face_analyzer, FACE_MODEL_NAME, FACE_DET_SIZE
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def list_images(image_dir: str, limit: int):
+    paths = sorted(
+        os.path.join(image_dir, name) for name in os.listdir(image_dir)
+        if name.lower().endswith(IMAGE_EXTS)
+    )
+    return paths[:limit] if limit else paths
+
+
+def run_per_image(face_analyzer, quality_assessor, paths):
+    """当前的逐张图片路径：每张图片调用一次 FaceAnalysis.get"""
+    faces = 0
+    start = time.perf_counter()
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        faces += len(detect_faces(face_analyzer, quality_assessor, image))
+    elapsed = time.perf_counter() - start
+    return faces, elapsed
+
+
+def run_batched(face_analyzer, quality_assessor, paths, batch_size):
+    """批量识别路径，每次使用全新的缓存目录，保证不命中缓存"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = FeatureCache(cache_dir, model_name=FACE_MODEL_NAME)
+        extractor = BatchFaceExtractor(face_analyzer, quality_assessor, cache, batch_size=batch_size)
+        extractor.extract(paths)
+        return extractor.stats['faces'], extractor.stats['total_seconds']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('image_dir')
+    parser.add_argument('--limit', type=int, default=0, help='最多使用的图片数量')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[16, 64, 128])
+    args = parser.parse_args()
+
+    paths = list_images(args.image_dir, args.limit)
+    if not paths:
+        print(f"目录中没有图片: {args.image_dir}")
+        sys.exit(1)
+
+    face_analyzer = get_face_analyzer(FACE_MODEL_NAME, FACE_DET_SIZE)
+    quality_assessor = FaceQualityAssessor()
+
+    # 预热，避免首次推理的初始化开销计入结果
+    run_per_image(face_analyzer, quality_assessor, paths[:1])
+
+    faces, elapsed = run_per_image(face_analyzer, quality_assessor, paths)
+    baseline = faces / elapsed if elapsed > 0 else 0.0
+    print(f"\n{'模式':<16}{'人脸数':>8}{'耗时(s)':>10}{'faces/sec':>12}{'加速比':>8}")
+    print(f"{'per-image':<16}{faces:>8}{elapsed:>10.2f}{baseline:>12.1f}{1.0:>8.2f}")
+
+    for batch_size in args.batch_sizes:
+        faces, elapsed = run_batched(face_analyzer, quality_assessor, paths, batch_size)
+        throughput = faces / elapsed if elapsed > 0 else 0.0
+        speedup = throughput / baseline if baseline > 0 else 0.0
+        print(f"{'batch=' + str(batch_size):<16}{faces:>8}{elapsed:>10.2f}{throughput:>12.1f}{speedup:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""人脸索引类型的召回率 / 内存 / 速度对比，使用合成特征离线运行，输出 JSON
+
+对每个规模生成合成人脸特征（与 benchmarks.pipeline 相同），写入列式存储后
+用 FaceRecognizer 依次构建各类型的索引，随机抽取若干人脸作为查询：
+- recall_at_k:   与精确内积检索的 k 近邻的重合比例
+- index_bytes:   序列化后的索引大小（约等于索引常驻内存）
+- build_seconds / queries_per_sec
+量化索引（ivf_sq8 / ivf_pq）分别给出重排前后的结果；重排读取内存映射的原始特征，不计入 index_bytes。
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.index_recall --sizes 10000 100000 --output recall.json
+"""
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from benchmarks.pipeline import synthetic_embeddings, environment, quiet, FEATURE_DIM
+
+
+def exact_neighbors(features: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """精确内积检索的 k 近邻（特征已归一化）"""
+    import faiss
+
+    index = faiss.IndexFlatIP(features.shape[1])
+    index.add(features)
+    return index.search(queries, k)[1]
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(a[a >= 0], b)) for a, b in zip(found, truth))
+    return hits / truth.size
+
+
+def run_size(n_faces: int, args) -> dict:
+    import faiss
+    from app.services.embedding_store import EmbeddingStore
+    from app.services.face_recognizer import FaceRecognizer, QUANTIZED_INDEX_TYPES
+
+    features, quality, _ = synthetic_embeddings(n_faces, args.faces_per_identity, args.noise, args.seed)
+    normalized = features / np.linalg.norm(features, axis=1, keepdims=True)
+    rng = np.random.default_rng(args.seed)
+    query_rows = np.sort(rng.choice(n_faces, min(args.queries, n_faces), replace=False))
+    queries = normalized[query_rows]
+    k = min(args.k, n_faces)
+    truth = exact_neighbors(normalized, queries, k)
+    result = {'n_faces': n_faces, 'queries': len(queries), 'k': k,
+              'raw_bytes': int(normalized.nbytes), 'indexes': []}
+    del normalized
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        EmbeddingStore(store_dir, dim=FEATURE_DIM).append(features, [str(i) for i in range(n_faces)], quality)
+        del features
+        for index_type in args.index_types:
+            recognizer = FaceRecognizer(store_path=store_dir, index_type=index_type, rerank=False)
+            with quiet(not args.verbose):
+                start = time.perf_counter()
+                recognizer.build_index()
+                build_seconds = time.perf_counter() - start
+            if recognizer.index is None:
+                result['indexes'].append({'index_type': index_type, 'error': '索引构建失败'})
+                continue
+            index_bytes = int(faiss.serialize_index(recognizer.index).nbytes)
+            for rerank in ([False, True] if recognizer.built_index_type in QUANTIZED_INDEX_TYPES else [False]):
+                recognizer.rerank = rerank
+                start = time.perf_counter()
+                _, found = recognizer.search(queries, k)
+                seconds = time.perf_counter() - start
+                entry = {
+                    'index_type': index_type,
+                    'built_index_type': recognizer.built_index_type,
+                    'rerank': rerank,
+                    'recall_at_k': round(recall(found, truth), 4),
+                    'index_bytes': index_bytes,
+                    'bytes_per_face': round(index_bytes / n_faces, 1),
+                    'build_seconds': round(build_seconds, 4),
+                    'queries_per_sec': round(len(queries) / seconds, 1),
+                }
+                result['indexes'].append(entry)
+                print(f"  {index_type:<8} rerank={str(rerank):<5} recall@{k}={entry['recall_at_k']:.3f} "
+                      f"{entry['bytes_per_face']:>7.1f} B/face  build {build_seconds:.2f}s  "
+                      f"{entry['queries_per_sec']:.0f} q/s", file=sys.stderr)
+    return result
+
+
+def main():
+    from app.services.face_recognizer import INDEX_TYPES, SPARSE_NEIGHBORS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='人脸数量')
+    parser.add_argument('--index-types', nargs='+', choices=[t for t in INDEX_TYPES if t != 'auto'],
+                        default=['flat', 'ivf_flat', 'ivf_sq8', 'ivf_pq', 'hnsw'])
+    parser.add_argument('--queries', type=int, default=1000, help='查询人脸数')
+    parser.add_argument('--k', type=int, default=SPARSE_NEIGHBORS, help='近邻数，默认与稀疏聚类相同')
+    parser.add_argument('--faces-per-identity', type=int, default=50)
+    parser.add_argument('--noise', type=float, default=0.035, help='特征噪声标准差（每维）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果 JSON 文件，默认输出到标准输出')
+    parser.add_argument('--verbose', action='store_true', help='显示被测代码的输出')
+    args = parser.parse_args()
+
+    report = {'environment': environment(), 'args': vars(args), 'results': []}
+    for n_faces in args.sizes:
+        print(f"运行 N={n_faces} ...", file=sys.stderr)
+        report['results'].append(run_size(n_faces, args))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""分组流水线各阶段的基准测试，使用合成数据离线运行，输出可跨提交对比的 JSON
+
+合成数据（固定随机种子，可复现）:
+- 人脸特征：n_faces / faces_per_identity 个身份，每个身份中心为归一化的 512 维高斯向量，
+  人脸特征 = 身份中心 + N(0, noise²) 噪声，质量分数服从 U(0.5, 1)；
+  同一身份两个人脸的期望余弦相似度约为 1 / (1 + 512·noise²)，默认 noise=0.02 时约 0.83；
+- 图片：平滑噪声背景上绘制若干带纹理的“人脸”块，并给出对应的人脸框和关键点。
+
+分别计时的阶段:
+- quality:       FaceQualityAssessor.is_good_quality_batch，共评估 n_faces 个人脸框
+- detect_faces:  buffalo_l 在合成图片上检测；本地没有模型文件时跳过（不会联网下载）
+- build_index:   FaceRecognizer.build_index
+- cluster_faces: FaceRecognizer.cluster_faces，同时给出与真实身份标签的 ARI，
+                 任一规模的 ARI 低于 --min-ari 时以非零状态退出（结果仍会输出）
+
+每个规模在单独的子进程中运行，peak_rss_mb 为该子进程在对应阶段结束时的峰值常驻内存。
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.pipeline --sizes 1000 10000 50000 --output results.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+FEATURE_DIM = 512
+IMAGE_SIZE = (640, 480)
+FACES_PER_IMAGE = 4
+# 合成图片数量，质量评估阶段循环使用这些图片
+SYNTHETIC_IMAGES = 64
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 返回字节，Linux 返回 KB
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def synthetic_embeddings(n_faces: int, faces_per_identity: int, noise: float, seed: int):
+    """返回 (特征 (N, 512) float32, 质量分数 (N,), 身份标签 (N,))"""
+    rng = np.random.default_rng(seed)
+    n_identities = max(1, n_faces // faces_per_identity)
+    centers = rng.standard_normal((n_identities, FEATURE_DIM))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    labels = rng.integers(0, n_identities, n_faces)
+    features = centers[labels] + rng.normal(0, noise, (n_faces, FEATURE_DIM))
+    quality = rng.uniform(0.5, 1.0, n_faces)
+    return features.astype(np.float32), quality, labels
+
+
+def synthetic_images(count: int, seed: int):
+    """返回 [(图片, 人脸框 (k, 4), 关键点 (k, 5, 2))]"""
+    rng = np.random.default_rng(seed)
+    width, height = IMAGE_SIZE
+    images = []
+    for _ in range(count):
+        background = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+        image = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+        bboxes, kpss = [], []
+        for _ in range(FACES_PER_IMAGE):
+            size = int(rng.integers(60, 180))
+            x0 = int(rng.integers(0, width - size))
+            y0 = int(rng.integers(0, height - size))
+            face = rng.integers(60, 200, (size, size, 3), dtype=np.uint8)
+            image[y0:y0 + size, x0:x0 + size] = cv2.GaussianBlur(face, (0, 0), float(rng.uniform(0.5, 3)))
+            bboxes.append([x0, y0, x0 + size, y0 + size])
+            # 双眼、鼻尖、两侧嘴角，带少量随机倾斜
+            tilt = rng.normal(0, 0.05 * size)
+            kpss.append([
+                [x0 + 0.3 * size, y0 + 0.4 * size + tilt], [x0 + 0.7 * size, y0 + 0.4 * size - tilt],
+                [x0 + 0.5 * size, y0 + 0.6 * size],
+                [x0 + 0.35 * size, y0 + 0.8 * size], [x0 + 0.65 * size, y0 + 0.8 * size],
+            ])
+        images.append((image, np.asarray(bboxes, dtype=np.float32), np.asarray(kpss, dtype=np.float32)))
+    return images
+
+
+def local_model_dir(name: str) -> str:
+    """insightface 默认的模型目录"""
+    root = os.path.expanduser(os.environ.get('INSIGHTFACE_HOME', '~/.insightface'))
+    return os.path.join(root, 'models', name)
+
+
+@contextlib.contextmanager
+def quiet(enabled: bool):
+    """屏蔽被测代码的 print 输出"""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_quality(images, n_faces: int):
+    from app.services.face_quality import FaceQualityAssessor
+
+    assessor = FaceQualityAssessor()
+    # 预热
+    image, bboxes, kpss = images[0]
+    assessor.is_good_quality_batch(image, bboxes, kpss)
+
+    start = time.perf_counter()
+    done = 0
+    i = 0
+    while done < n_faces:
+        image, bboxes, kpss = images[i % len(images)]
+        count = min(len(bboxes), n_faces - done)
+        assessor.is_good_quality_batch(image, bboxes[:count], kpss[:count])
+        done += count
+        i += 1
+    seconds = time.perf_counter() - start
+    return {'seconds': round(seconds, 4), 'faces_per_sec': round(n_faces / seconds, 1)}
+
+
+def bench_detection(images, count: int):
+    from app.services.face_quality import FaceQualityAssessor
+    from app.services.face_extraction import detect_faces
+    from app.services.model_registry import get_face_analyzer, FACE_MODEL_NAME, FACE_DET_SIZE
+
+    if not os.path.isdir(local_model_dir(FACE_MODEL_NAME)):
+        return {'skipped': f"本地没有模型文件: {local_model_dir(FACE_MODEL_NAME)}"}
+    analyzer = get_face_analyzer(FACE_MODEL_NAME, FACE_DET_SIZE)
+    assessor = FaceQualityAssessor()
+    detect_faces(analyzer, assessor, images[0][0])
+
+    start = time.perf_counter()
+    faces = 0
+    for i in range(count):
+        faces += len(detect_faces(analyzer, assessor, images[i % len(images)][0]))
+    seconds = time.perf_counter() - start
+    return {'seconds': round(seconds, 4), 'images': count, 'images_per_sec': round(count / seconds, 2),
+            'faces': faces}
+
+
+def run_size(n_faces: int, args) -> dict:
+    """在子进程中运行一个规模的全部阶段"""
+    from sklearn.metrics import adjusted_rand_score
+    from app.services.embedding_store import EmbeddingStore
+    from app.services.face_recognizer import FaceRecognizer, DENSE_CLUSTER_MAX_FACES
+
+    result = {'n_faces': n_faces, 'n_identities': max(1, n_faces // args.faces_per_identity), 'stages': {}}
+    stages = result['stages']
+    images = synthetic_images(SYNTHETIC_IMAGES, args.seed)
+    features, quality, identities = synthetic_embeddings(n_faces, args.faces_per_identity, args.noise, args.seed)
+
+    with quiet(not args.verbose):
+        stages['quality'] = bench_quality(images, n_faces)
+        stages['quality']['peak_rss_mb'] = round(peak_rss_mb(), 1)
+
+        if args.skip_detection:
+            stages['detect_faces'] = {'skipped': '--skip-detection'}
+        else:
+            stages['detect_faces'] = bench_detection(images, args.detect_images)
+            if 'seconds' in stages['detect_faces']:
+                stages['detect_faces']['peak_rss_mb'] = round(peak_rss_mb(), 1)
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            # 与服务重启时一样从内存映射的列式存储加载人脸
+            EmbeddingStore(store_dir, dim=FEATURE_DIM).append(features, [str(i) for i in range(n_faces)], quality)
+            del features
+            recognizer = FaceRecognizer(store_path=store_dir)
+
+            _, seconds = timed(recognizer.build_index)
+            stages['build_index'] = {'seconds': round(seconds, 4), 'index': type(recognizer.index).__name__,
+                                     'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+            groups, seconds = timed(recognizer.cluster_faces, threshold=0.7, method=args.method)
+            stages['cluster_faces'] = {
+                'seconds': round(seconds, 4),
+                'method': args.method if args.method != 'auto' else
+                ('sparse' if n_faces > DENSE_CLUSTER_MAX_FACES else 'dense'),
+                'groups': len(groups),
+                'noise_faces': int((recognizer.labels == -1).sum()),
+                'threshold': recognizer.cluster_threshold,
+                'ari': round(float(adjusted_rand_score(identities, recognizer.labels)), 4),
+                'peak_rss_mb': round(peak_rss_mb(), 1),
+            }
+
+    result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def environment() -> dict:
+    import faiss
+    import sklearn
+
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'faiss': getattr(faiss, '__version__', None),
+        'sklearn': sklearn.__version__,
+        'opencv': cv2.__version__,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='人脸数量')
+    parser.add_argument('--faces-per-identity', type=int, default=50)
+    # 期望同身份余弦相似度约为 1 / (1 + 512·noise²)：0.02 时约 0.83，聚类结果与真实身份一致；
+    # 0.035 时仅约 0.6，再经质量加权后大部分人脸会被 DBSCAN 判为噪声，基准失去意义
+    parser.add_argument('--noise', type=float, default=0.02, help='特征噪声标准差（每维）')
+    parser.add_argument('--min-ari', type=float, default=0.9,
+                        help='聚类 ARI 下限，低于该值说明合成数据或聚类参数有问题')
+    parser.add_argument('--method', choices=['auto', 'dense', 'sparse'], default='auto')
+    parser.add_argument('--detect-images', type=int, default=32, help='检测阶段的图片数量')
+    parser.add_argument('--skip-detection', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果 JSON 文件，默认输出到标准输出')
+    parser.add_argument('--verbose', action='store_true', help='显示被测代码的输出')
+    args = parser.parse_args()
+
+    report = {'environment': environment(), 'args': vars(args), 'results': []}
+    for n_faces in args.sizes:
+        print(f"运行 N={n_faces} ...", file=sys.stderr)
+        # 每个规模使用全新的进程，峰值内存互不影响
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(run_size, n_faces, args).result()
+        stages = result['stages']
+        print("  " + ", ".join(f"{name}={stage['seconds']:.3f}s" for name, stage in stages.items() if 'seconds' in stage)
+              + f", peak RSS {result['peak_rss_mb']:.0f}MB", file=sys.stderr)
+        report['results'].append(result)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    failed = [r['n_faces'] for r in report['results'] if r['stages']['cluster_faces']['ari'] < args.min_ari]
+    if failed:
+        print(f"聚类 ARI 低于 {args.min_ari}: N={failed}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""对比原图检测与金字塔检测（缩小解码检测 + 原分辨率区域对齐）的吞吐量和召回率
+
+以 scale=1（原图检测）的结果为基准，召回率为基准人脸中在金字塔模式下也被检出
+（人脸框 IoU >= 0.5）的比例，同时给出匹配人脸特征的平均余弦相似度。
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.pyramid_detection <图片目录> --scales 2 4 8
+"""
+import sys
+import argparse
+import tempfile
+
+import numpy as np
+
+from app.services.face_quality import FaceQualityAssessor
+from app.services.feature_cache import FeatureCache
+from app.services.face_extraction import BatchFaceExtractor, REDUCED_IMREAD_FLAGS
+from app.services.model_registry import get_face_analyzer, FACE_MODEL_NAME, FACE_DET_SIZE
+from benchmarks.extraction_throughput import list_images
+
+
+def run(face_analyzer, quality_assessor, paths, scale, batch_size):
+    """使用全新的缓存目录提取一遍，返回 (结果, 耗时)"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = FeatureCache(cache_dir, model_name=FACE_MODEL_NAME)
+        extractor = BatchFaceExtractor(face_analyzer, quality_assessor, cache,
+                                       batch_size=batch_size, detection_scale=scale)
+        results = extractor.extract(paths)
+        return results, extractor.stats['total_seconds']
+
+
+def iou(a, b):
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def compare(baseline, results, min_iou=0.5):
+    """返回 (基准人脸数, 匹配人脸数, 匹配人脸特征的平均余弦相似度)"""
+    total = matched = 0
+    similarities = []
+    for path, base in baseline.items():
+        base_faces = (base or {}).get('faces', [])
+        faces = list((results.get(path) or {}).get('faces', []))
+        total += len(base_faces)
+        for base_face in base_faces:
+            if not faces:
+                break
+            overlaps = [iou(base_face['bbox'], face['bbox']) for face in faces]
+            best = int(np.argmax(overlaps))
+            if overlaps[best] < min_iou:
+                continue
+            face = faces.pop(best)
+            matched += 1
+            a = np.asarray(base_face['features'], dtype=np.float32)
+            b = np.asarray(face['features'], dtype=np.float32)
+            similarities.append(float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))))
+    return total, matched, float(np.mean(similarities)) if similarities else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('image_dir')
+    parser.add_argument('--limit', type=int, default=0, help='最多使用的图片数量')
+    parser.add_argument('--scales', type=int, nargs='+', default=[2, 4],
+                        choices=sorted(s for s in REDUCED_IMREAD_FLAGS if s > 1))
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+
+    paths = list_images(args.image_dir, args.limit)
+    if not paths:
+        print(f"目录中没有图片: {args.image_dir}")
+        sys.exit(1)
+
+    face_analyzer = get_face_analyzer(FACE_MODEL_NAME, FACE_DET_SIZE)
+    quality_assessor = FaceQualityAssessor()
+
+    # 预热，避免首次推理的初始化开销计入结果
+    run(face_analyzer, quality_assessor, paths[:1], 1, args.batch_size)
+
+    baseline, elapsed = run(face_analyzer, quality_assessor, paths, 1, args.batch_size)
+    base_rate = len(paths) / elapsed if elapsed > 0 else 0.0
+    base_faces = sum((r or {}).get('total_faces', 0) for r in baseline.values())
+    print(f"\n{'模式':<12}{'人脸数':>8}{'耗时(s)':>10}{'images/sec':>12}{'加速比':>8}{'召回率':>8}{'特征相似度':>12}")
+    print(f"{'scale=1':<12}{base_faces:>8}{elapsed:>10.2f}{base_rate:>12.2f}{1.0:>8.2f}{1.0:>8.3f}{1.0:>12.4f}")
+
+    for scale in args.scales:
+        results, elapsed = run(face_analyzer, quality_assessor, paths, scale, args.batch_size)
+        rate = len(paths) / elapsed if elapsed > 0 else 0.0
+        faces = sum((r or {}).get('total_faces', 0) for r in results.values())
+        total, matched, similarity = compare(baseline, results)
+        recall = matched / total if total else 1.0
+        speedup = rate / base_rate if base_rate > 0 else 0.0
+        print(f"{'scale=' + str(scale):<12}{faces:>8}{elapsed:>10.2f}{rate:>12.2f}{speedup:>8.2f}{recall:>8.3f}{similarity:>12.4f}")
+
+
+if __name__ == '__main__':
+    main()
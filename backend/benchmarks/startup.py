@@ -0,0 +1,100 @@
+"""服务启动与 /clear-cache 的耗时和常驻内存，对比共享模型注册表（model_registry）前后
+
+分别在全新的子进程中运行:
+- before: 按引入注册表之前的代码加载模型：ImageService 加载一次 buffalo_l，FaceRecognizer 再加载一个
+          检测+识别的 FaceAnalysis，reset()（/clear-cache）新建 FaceRecognizer 时又加载一次；
+- after:  当前代码：创建 ImageService 并像 API 进程启动时一样预热模型，reset() 只重置数据。
+两者的数据部分（元数据库、特征存储）相同，差别只在模型加载。本地没有 buffalo_l 模型文件时
+before 跳过，after 只计不含模型加载的部分（不会联网下载）。
+
+用法（在 backend 目录下运行）:
+    python -m benchmarks.startup --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.pipeline import environment, local_model_dir, quiet
+
+
+def _load_old_models():
+    """引入注册表之前 ImageService 和 FaceRecognizer 各自加载的模型"""
+    from insightface.app import FaceAnalysis
+    from app.services.model_registry import FACE_MODEL_NAME, FACE_DET_SIZE
+
+    service_analyzer = FaceAnalysis(name=FACE_MODEL_NAME, providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+    service_analyzer.prepare(ctx_id=0, det_size=FACE_DET_SIZE)
+    return service_analyzer, _load_old_recognizer_model()
+
+
+def _load_old_recognizer_model():
+    from insightface.app import FaceAnalysis
+
+    analyzer = FaceAnalysis(providers=['CPUExecutionProvider'], allowed_modules=['detection', 'recognition'])
+    analyzer.prepare(ctx_id=0)
+    return analyzer
+
+
+def run_scenario(name: str, verbose: bool) -> dict:
+    """在子进程中模拟一次服务启动和一次 /clear-cache"""
+    from app.services.image_service import ImageService
+    from app.services.model_registry import current_rss_mb, warm_up, FACE_MODEL_NAME, FACE_DET_SIZE
+
+    has_models = os.path.isdir(local_model_dir(FACE_MODEL_NAME))
+    result = {'scenario': name, 'models_loaded': has_models, 'import_rss_mb': round(current_rss_mb(), 1)}
+    with tempfile.TemporaryDirectory() as root, quiet(not verbose):
+        start = time.perf_counter()
+        service = ImageService(os.path.join(root, 'uploads'), thumbnail_workers=0)
+        if has_models:
+            if name == 'before':
+                # 保持引用，与旧代码一样模型常驻内存
+                models = _load_old_models()
+            else:
+                warm_up(FACE_MODEL_NAME, FACE_DET_SIZE)
+        result['startup'] = {'seconds': round(time.perf_counter() - start, 3), 'rss_mb': round(current_rss_mb(), 1)}
+
+        start = time.perf_counter()
+        service.reset()
+        if has_models and name == 'before':
+            # 旧的 reset() 丢弃原 FaceRecognizer（连同其模型）并新建一个
+            models = models[0], _load_old_recognizer_model()
+        result['clear_cache'] = {'seconds': round(time.perf_counter() - start, 3), 'rss_mb': round(current_rss_mb(), 1)}
+        service.shutdown()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='结果 JSON 文件，默认输出到标准输出')
+    parser.add_argument('--verbose', action='store_true', help='显示被测代码的输出')
+    args = parser.parse_args()
+
+    from app.services.model_registry import FACE_MODEL_NAME
+
+    report = {'environment': environment(), 'results': []}
+    for name in ('before', 'after'):
+        if name == 'before' and not os.path.isdir(local_model_dir(FACE_MODEL_NAME)):
+            print(f"跳过 before: 本地没有模型文件 {local_model_dir(FACE_MODEL_NAME)}", file=sys.stderr)
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(run_scenario, name, args.verbose).result()
+        print(f"{name}: 启动 {result['startup']['seconds']:.2f}s / {result['startup']['rss_mb']:.0f}MB, "
+              f"清空 {result['clear_cache']['seconds']:.2f}s / {result['clear_cache']['rss_mb']:.0f}MB", file=sys.stderr)
+        report['results'].append(result)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,36 @@
+import os
+import multiprocessing
 import uvicorn
 
+# API 进程数；大于 1 时人脸模型只在一个单独的推理进程中加载，API 进程共享磁盘上的数据
+API_WORKERS = int(os.environ.get("API_WORKERS", "1"))
+
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        workers=1
-    ) 
\ No newline at end of file
+    if API_WORKERS > 1:
+        # 子进程（uvicorn workers 与推理进程）继承该环境变量
+        os.environ["INFERENCE_MODE"] = "remote"
+        from app.inference_worker import main as run_inference_worker
+
+        inference_worker = multiprocessing.get_context('spawn').Process(
+            target=run_inference_worker, name='inference-worker'
+        )
+        inference_worker.start()
+        try:
+            # 多进程模式不支持 reload
+            uvicorn.run(
+                "app.main:app",
+                host="0.0.0.0",
+                port=8000,
+                workers=API_WORKERS
+            )
+        finally:
+            inference_worker.terminate()
+            inference_worker.join()
+    else:
+        uvicorn.run(
+            "app.main:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=True,
+            workers=1
+        )
@@ -0,0 +1,60 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+
+from app.services.face_recognizer import FaceRecognizer
+
+FACE_MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "app", "models", "face_model.pkl")
+
+
+def _loop_quality_weights(distances, quality_weights):
+    """向量化之前逐对调整距离矩阵的实现"""
+    for i in range(len(quality_weights)):
+        for j in range(i + 1, len(quality_weights)):
+            weight = np.sqrt(min(quality_weights[i], quality_weights[j]))  # 使用平方根减小权重影响
+            adjusted_dist = distances[i][j] / max(weight, 0.5)  # 限制最小权重
+            distances[i][j] = distances[j][i] = max(adjusted_dist, 0)
+
+
+def _cosine_distances(features):
+    normalized = features / np.linalg.norm(features, axis=1)[:, np.newaxis]
+    return 1 - np.clip(normalized @ normalized.T, 0, 1)
+
+
+@pytest.mark.parametrize('block_size', [7, 64, 1024])
+def test_apply_quality_weights_matches_loop(block_size):
+    rng = np.random.default_rng(42)
+    features = rng.standard_normal((150, 512)).astype(np.float32)
+    quality_weights = rng.uniform(0.1, 1.0, 150)
+    expected = _cosine_distances(features)
+    actual = expected.copy()
+
+    _loop_quality_weights(expected, quality_weights)
+    FaceRecognizer._apply_quality_weights(actual, quality_weights, block_size=block_size)
+
+    assert actual.dtype == np.float32
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_dbscan_labels_unchanged(tmp_path):
+    with open(FACE_MODEL_PATH, 'rb') as f:
+        data = pickle.load(f)
+    recognizer = FaceRecognizer(store_path=str(tmp_path / "store"))
+    for image_id, features, quality in zip(data['image_ids'], data['face_features'], data['quality_scores']):
+        recognizer.upsert_face(image_id, len(recognizer.registry.get(image_id, {})),
+                                 {'features': features, 'quality_score': quality})
+    rows = recognizer.rows_for_images()
+
+    expected = _cosine_distances(recognizer.face_features[rows])
+    _loop_quality_weights(expected, recognizer.quality_scores[rows])
+    actual, _ = recognizer._dense_distance_matrix(rows)
+    np.testing.assert_array_equal(actual, expected)
+
+    for eps in np.linspace(0.3, 0.8, 10):
+        expected_labels = DBSCAN(eps=eps, min_samples=3, metric='precomputed').fit_predict(expected)
+        actual_labels = DBSCAN(eps=eps, min_samples=3, metric='precomputed').fit_predict(actual)
+        np.testing.assert_array_equal(actual_labels, expected_labels)
+    assert len(set(expected_labels)) > 1
@@ -0,0 +1,40 @@
+import threading
+
+from app.services.extraction_pool import ExtractionPool, STATUS_PROCESSING, STATUS_DONE, STATUS_FAILED
+
+
+def _pool(tmp_path):
+    # 不提交任务时不会启动进程池，直接驱动状态变化
+    return ExtractionPool('buffalo_l', (640, 640), str(tmp_path / "cache"), 'v1')
+
+
+def _start(pool, image_id):
+    pool._events[image_id] = threading.Event()
+    pool._set_status(image_id, STATUS_PROCESSING)
+
+
+def test_finished_tasks_do_not_accumulate(tmp_path):
+    pool = _pool(tmp_path)
+    _start(pool, 'done')
+    _start(pool, 'failed')
+    assert pool.get_summary()['total'] == 2
+
+    # 完成的结果在特征缓存中，状态立即丢弃
+    pool._set_status('done', STATUS_DONE, faces=1)
+    pool._set_status('failed', STATUS_FAILED, error='boom')
+    summary = pool.get_summary()
+    assert list(summary['items']) == ['failed']
+    assert summary[STATUS_FAILED] == 1
+
+    # 失败状态保留到 wait() 返回
+    assert pool.wait('done', timeout=0)
+    assert pool.wait('failed', timeout=0)
+    assert pool.get_summary()['total'] == 0
+    assert pool._events == {}
+
+
+def test_wait_timeout_keeps_running_task(tmp_path):
+    pool = _pool(tmp_path)
+    _start(pool, 'a')
+    assert not pool.wait('a', timeout=0)
+    assert pool.get_status('a') == {'status': STATUS_PROCESSING}
@@ -0,0 +1,73 @@
+import json
+import os
+
+import numpy as np
+
+from app.services.face_recognizer import FaceRecognizer, INDEX_META_FILE
+
+
+def _register(recognizer, features):
+    for features_row in features:
+        recognizer.upsert_face(f"img{len(recognizer.registry)}", 0,
+                                 {'features': features_row.tolist(), 'quality_score': 1.0})
+    recognizer.save_model(recognizer.store_path)
+
+
+def _saved_ntotal(store_path):
+    with open(os.path.join(store_path, INDEX_META_FILE)) as f:
+        return json.load(f)['ntotal']
+
+
+def test_searcher_covers_unsaved_index_updates(tmp_path):
+    store_path = str(tmp_path / "store")
+    rng = np.random.default_rng(0)
+    features = rng.standard_normal((102, 512)).astype(np.float32)
+    recognizer = FaceRecognizer(store_path=store_path)
+    _register(recognizer, features[:100])
+    recognizer.update_index(recognizer.rows_for_images())
+    assert _saved_ntotal(store_path) == 100
+
+    # 少量增量更新不立即持久化
+    _register(recognizer, features[100:])
+    recognizer.update_index(recognizer.rows_for_images())
+    assert recognizer.index.ntotal == 102
+    assert _saved_ntotal(store_path) == 100
+
+    # 只读加载持久化索引的进程对缺少的人脸做精确比较，结果与最新的索引一致
+    searcher = FaceRecognizer(store_path=store_path)
+    assert searcher.load_index(mmap=True)
+    searcher.set_unindexed(recognizer.rows_for_images())
+    assert searcher.searchable_count() == 102
+    queries = FaceRecognizer._normalize(features[[3, 100, 101]])
+    expected_sims, expected_ids = recognizer.search(queries, 5)
+    sims, ids = searcher.search(queries, 5)
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(sims, expected_sims, rtol=1e-5, atol=1e-5)
+    for (_, ids), (_, expected_ids) in zip(searcher.range_search(queries, 0.5),
+                                           recognizer.range_search(queries, 0.5)):
+        np.testing.assert_array_equal(ids, expected_ids)
+
+    recognizer.flush_index()
+    assert _saved_ntotal(store_path) == 102
+
+
+def test_ivf_pq_uses_flat_until_enough_faces(tmp_path, monkeypatch):
+    monkeypatch.setattr('app.services.face_recognizer.PQ_MIN_TRAINING_FACES', 300)
+    store_path = str(tmp_path / "store")
+    features = np.random.default_rng(0).standard_normal((400, 512)).astype(np.float32)
+    recognizer = FaceRecognizer(store_path=store_path, index_type='ivf_pq')
+    _register(recognizer, features[:200])
+    recognizer.update_index(recognizer.rows_for_images())
+    assert recognizer.built_index_type == 'flat'
+
+    # 人脸数仍不足时增量更新，不重新构建
+    index = recognizer.index
+    _register(recognizer, features[200:210])
+    recognizer.update_index(recognizer.rows_for_images())
+    assert recognizer.index is index
+    assert recognizer.index.ntotal == 210
+
+    _register(recognizer, features[210:])
+    recognizer.update_index(recognizer.rows_for_images())
+    assert recognizer.built_index_type == 'ivf_pq'
+    assert recognizer.index.ntotal == 400
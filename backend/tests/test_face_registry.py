@@ -0,0 +1,164 @@
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from app.services.face_recognizer import FaceRecognizer
+from app.services.image_service import ImageService
+
+
+def _faces(rng, centers, per_image):
+    """每个中心附近生成若干人脸（每张图片一个人脸）"""
+    faces = []
+    for center in centers:
+        for _ in range(per_image):
+            features = center + 0.05 * rng.standard_normal(center.shape)
+            faces.append({'bbox': [0, 0, 10, 10], 'det_score': 0.9, 'quality_score': 1.0,
+                          'features': features.astype(np.float32).tolist()})
+    return faces
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = ImageService(str(tmp_path / "uploads"), thumbnail_workers=0, remote_inference=True)
+    yield service
+    service.shutdown()
+
+
+def _group(service, faces):
+    """登记每张图片的人脸并聚类，返回图片ID列表"""
+    image_ids = [f"img{i}" for i in range(len(faces))]
+    for image_id in image_ids:
+        service.metadata.insert_image({'id': image_id, 'filename': f'{image_id}.jpg', 'name': image_id,
+                                      'created_at': datetime.now()})
+    with service._grouping_lock():
+        added = [(image_id, 0, service.recognizer.upsert_face(image_id, 0, face), face)
+                 for image_id, face in zip(image_ids, faces)]
+        service._persist_faces(added)
+        rows = service.recognizer.rows_for_images(image_ids)
+        service.recognizer.update_index(rows)
+        service.recognizer.cluster_faces(threshold=0.7, rows=rows)
+        service._face_state_version = service.metadata.save_cluster_labels(
+            service.recognizer.labels, service.recognizer.cluster_threshold, service.recognizer.label_changes)
+    return image_ids
+
+
+def test_upsert_face_replaces_row_and_index_entry(service):
+    rng = np.random.default_rng(2)
+    centers = rng.standard_normal((2, 512))
+    image_ids = _group(service, _faces(rng, centers, per_image=4))
+    recognizer = service.recognizer
+    old_row = recognizer.registry[image_ids[0]][0]
+    label = recognizer.labels[old_row]
+    count = recognizer._centroid_counts[label]
+    ntotal = recognizer.index.ntotal
+
+    face = {'bbox': [0, 0, 10, 10], 'det_score': 0.9, 'quality_score': 1.0,
+            'features': rng.standard_normal(512).astype(np.float32).tolist()}
+    with service._grouping_lock():
+        row = recognizer.upsert_face(image_ids[0], 0, face)
+        service._persist_faces([(image_ids[0], 0, row, face)])
+
+    assert row != old_row
+    assert recognizer.registry[image_ids[0]] == {0: row}
+    assert old_row not in recognizer.rows_for_images()
+    # 索引中旧行被删除、新行被加入
+    assert recognizer.index.ntotal == ntotal
+    assert old_row not in recognizer.index_ids and row in recognizer.index_ids
+    similarities, neighbors = recognizer.search(FaceRecognizer._normalize(np.array([face['features']])), 1)
+    assert neighbors[0, 0] == row and similarities[0, 0] == pytest.approx(1.0, abs=1e-5)
+    # 旧行不再属于原分组
+    assert recognizer.labels[old_row] == -1
+    assert recognizer._centroid_counts[label] == count - 1
+    # 持久化的人脸记录指向新行
+    assert service._load_recognizer().registry == recognizer.registry
+
+
+def test_regrouping_reextracted_image_upserts_its_faces(service):
+    rng = np.random.default_rng(3)
+    first = [{'bbox': [0, 0, 10, 10], 'det_score': 0.9, 'quality_score': 1.0,
+              'features': rng.standard_normal(512).astype(np.float32).tolist()} for _ in range(2)]
+    second = [dict(first[0], features=rng.standard_normal(512).astype(np.float32).tolist())]
+
+    class Extractor:
+        """没有写入特征缓存的提取器，每次分组都视为重新提取"""
+        faces = first
+
+        def extract(self, paths, progress=None, content_hashes=None):
+            return {path: {'faces': self.faces, 'total_faces': len(self.faces)} for path in paths}
+
+    service._batch_extractor = Extractor()
+    (Path(service.upload_dir) / 'a.jpg').write_bytes(b'')
+    service.metadata.insert_image({'id': 'a', 'filename': 'a.jpg', 'name': 'a', 'content_hash': 'h',
+                                  'created_at': datetime.now()})
+    service.auto_group_images(['a'])
+    rows = dict(service.recognizer.registry['a'])
+    assert sorted(rows) == [0, 1]
+
+    Extractor.faces = second
+    service.auto_group_images(['a'])
+    registry = service.recognizer.registry['a']
+    assert list(registry) == [0] and registry[0] not in rows.values()
+    np.testing.assert_allclose(service.recognizer.face_features[registry[0]], second[0]['features'])
+    assert [face['face_index'] for face in service.metadata.get_faces('a')] == [0]
+    assert service._load_recognizer().registry == service.recognizer.registry
+
+
+def test_delete_image_unregisters_faces_without_reload(service):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((2, 512))
+    image_ids = _group(service, _faces(rng, centers, per_image=4))
+    recognizer = service.recognizer
+    deleted_row = recognizer.registry[image_ids[0]][0]
+    label = recognizer.labels[deleted_row]
+    assert label >= 0
+    count = recognizer._centroid_counts[label]
+
+    service._delete_image_records(image_ids[0])
+
+    # 本进程的识别器直接注销人脸并采用新的版本号，不会整体重新加载
+    assert service._face_state_version == service.metadata.face_state_version()
+    service._sync_recognizer()
+    assert service.recognizer is recognizer
+    assert not recognizer.has_image(image_ids[0])
+    assert deleted_row not in recognizer.rows_for_images()
+    assert recognizer.labels[deleted_row] == -1
+    assert recognizer._centroid_counts[label] == count - 1
+    assert recognizer.labels[recognizer.registry[image_ids[1]][0]] == label
+    np.testing.assert_allclose(
+        recognizer._centroid_sums[label],
+        FaceRecognizer._normalize(recognizer.face_features[recognizer.labels == label]).sum(axis=0),
+        rtol=1e-5, atol=1e-5)
+
+    # 重新加载得到的状态与增量注销后的一致
+    reloaded = service._load_recognizer()
+    assert reloaded.registry == recognizer.registry
+    np.testing.assert_array_equal(reloaded.labels, recognizer.labels)
+    np.testing.assert_array_equal(reloaded._centroid_counts, recognizer._centroid_counts)
+
+
+def test_incremental_grouping_saves_only_new_labels(service):
+    rng = np.random.default_rng(1)
+    centers = rng.standard_normal((2, 512))
+    _group(service, _faces(rng, centers, per_image=4))
+    recognizer = service.recognizer
+    start = len(recognizer.labels)
+
+    new_faces = _faces(rng, centers, per_image=1)
+    new_ids = [f"new{i}" for i in range(len(new_faces))]
+    for image_id in new_ids:
+        service.metadata.insert_image({'id': image_id, 'filename': f'{image_id}.jpg', 'name': image_id,
+                                      'created_at': datetime.now()})
+    with service._grouping_lock():
+        added = [(image_id, 0, recognizer.upsert_face(image_id, 0, face), face)
+                 for image_id, face in zip(new_ids, new_faces)]
+        service._persist_faces(added)
+        recognizer.assign_new_faces(rows=recognizer.rows_for_images(new_ids))
+        np.testing.assert_array_equal(recognizer.label_changes, np.arange(start, start + len(new_ids)))
+        service.metadata.save_cluster_labels(recognizer.labels, recognizer.cluster_threshold,
+                                             recognizer.label_changes)
+
+    labels, _ = service.metadata.load_cluster_labels(len(recognizer.labels))
+    np.testing.assert_array_equal(labels, recognizer.labels)
+    assert (labels[start:] >= 0).all()
@@ -0,0 +1,50 @@
+import sqlite3
+from datetime import datetime
+
+from app.services.metadata_store import MetadataStore
+
+
+def _image(image_id, content_hash):
+    return {'id': image_id, 'filename': f'{image_id}.jpg', 'name': image_id, 'content_hash': content_hash,
+            'created_at': datetime.now()}
+
+
+def test_insert_image_returns_existing_id_for_same_content(tmp_path):
+    db_path = str(tmp_path / "metadata.db")
+    first, second = MetadataStore(db_path), MetadataStore(db_path)
+
+    assert first.insert_image(_image('a', 'h')) is None
+    # 另一个连接（相当于另一个进程）没有看到查重结果，插入时由唯一索引拒绝
+    assert second.insert_image(_image('b', 'h')) == 'a'
+    assert second.get_image('b') is None
+    # 没有内容哈希的记录互不冲突
+    assert first.insert_image(_image('c', None)) is None
+    assert first.insert_image(_image('d', None)) is None
+    first.close()
+    second.close()
+
+
+def test_duplicate_records_from_old_index_are_merged(tmp_path):
+    db_path = str(tmp_path / "metadata.db")
+    MetadataStore(db_path).close()
+    # 模拟旧版本：索引不唯一，并发上传留下了内容相同的两条记录
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("DROP INDEX idx_images_content_hash_unique")
+        conn.execute("CREATE INDEX idx_images_content_hash ON images (content_hash)")
+        for image_id, created_at in (('old', 1.0), ('new', 2.0)):
+            conn.execute("INSERT INTO images (id, filename, name, content_hash, created_at) VALUES (?, ?, ?, ?, ?)",
+                         (image_id, f'{image_id}.jpg', image_id, 'h', created_at))
+        conn.execute("INSERT INTO groups (id, name) VALUES ('g', 'g')")
+        conn.execute("INSERT INTO group_members (group_id, image_id) VALUES ('g', 'new')")
+        conn.execute("INSERT INTO faces (image_id, face_index, store_offset, bbox) VALUES ('new', 0, 0, '[]')")
+    conn.close()
+
+    store = MetadataStore(db_path)
+    assert store.get_image('new') is None
+    assert store.find_image_by_hash('h') == 'old'
+    assert store.get_group('g')['image_ids'] == ['old']
+    assert store.get_faces('new') == []
+    assert store.face_state_version() == 1
+    assert store.insert_image(_image('b', 'h')) == 'old'
+    store.close()
@@ -0,0 +1,58 @@
+import io
+import asyncio
+
+import numpy as np
+import pytest
+from PIL import Image
+from fastapi import UploadFile
+
+from app.services.image_service import ImageService
+
+
+def _png(seed):
+    pixels = np.random.default_rng(seed).integers(0, 255, (8, 8, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _upload(service, files):
+    return asyncio.run(service.save_images(
+        [UploadFile(file=io.BytesIO(content), filename=name) for name, content in files]))
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = ImageService(str(tmp_path / "uploads"), thumbnail_workers=0, remote_inference=True)
+    yield service
+    service.shutdown()
+
+
+def test_failed_upload_rolls_back_files_written_in_request(service, tmp_path):
+    [existing_id] = _upload(service, [('a.png', _png(0))])
+
+    with pytest.raises(OSError):
+        _upload(service, [('b.png', _png(1)), ('a.png', _png(0)), ('broken.png', b'not an image')])
+
+    # 本次请求新写入的文件和记录被删除，已有图片不受影响
+    assert [record['id'] for record in service.metadata.all_images()] == [existing_id]
+    assert len(list((tmp_path / "uploads").iterdir())) == 1
+    # 回滚的图片可以重新上传
+    assert len(set(_upload(service, [('b.png', _png(1)), ('a.png', _png(0))]))) == 2
+
+
+def test_record_failure_rolls_back_created_records(service, tmp_path, monkeypatch):
+    record_upload = service._record_upload
+    calls = []
+
+    def flaky(image):
+        calls.append(image.id)
+        if len(calls) == 2:
+            raise RuntimeError("database is locked")
+        return record_upload(image)
+
+    monkeypatch.setattr(service, '_record_upload', flaky)
+    with pytest.raises(RuntimeError):
+        _upload(service, [('a.png', _png(0)), ('b.png', _png(1))])
+    assert service.metadata.all_images() == []
+    assert list((tmp_path / "uploads").iterdir()) == []
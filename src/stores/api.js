@@ -37,10 +37,11 @@ export const useApiStore = defineStore('api', () => {
   }
 
   // 获取图片列表
-  const getImages = async () => {
+  // 分页获取图片列表：params 可包含 limit、cursor、sort（created_at/size/score）、order、group_id
+  const getImages = async (params = {}) => {
     try {
       loading.value = true
-      const response = await api.get('/api/images')
+      const response = await api.get('/api/images', { params })
       return response
     } catch (err) {
       error.value = err.message
@@ -78,13 +79,34 @@ export const useApiStore = defineStore('api', () => {
     }
   }
 
+  // 获取后台人脸特征提取进度
+  const getExtractionStatus = async (imageIds = null) => {
+    try {
+      const params = new URLSearchParams()
+      if (imageIds) {
+        imageIds.forEach((id) => params.append('image_ids', id))
+      }
+      const { data: response } = await api.get('/api/images/extraction-status', { params })
+      return response
+    } catch (err) {
+      error.value = err.message
+      throw err
+    }
+  }
+
+  // 人脸头像地址（用作分组封面），由浏览器直接加载并按 ETag 缓存
+  const faceThumbnailUrl = (imageId, faceIndex = 0) => {
+    return `${baseURL}/api/images/${imageId}/faces/${faceIndex}/thumbnail`
+  }
+
   // 智能分组
-  const groupImages = async (imageIds, similarityThreshold = 0.55) => {
+  const groupImages = async (imageIds, similarityThreshold = 0.55, incremental = false) => {
     try {
       loading.value = true
       const response = await api.post('/api/images/group', {
         image_ids: imageIds,
         similarity_threshold: similarityThreshold,
+        incremental,
       })
       return response
     } catch (err) {
@@ -95,6 +117,89 @@ export const useApiStore = defineStore('api', () => {
     }
   }
 
+  // 创建后台分组任务，返回任务信息（含 job_id）
+  const createGroupJob = async (imageIds, similarityThreshold = 0.55, incremental = false) => {
+    try {
+      const { data: response } = await api.post('/api/jobs/group', {
+        image_ids: imageIds,
+        similarity_threshold: similarityThreshold,
+        incremental,
+      })
+      return response
+    } catch (err) {
+      error.value = err.message
+      throw err
+    }
+  }
+
+  // 查询分组任务状态
+  const getGroupJob = async (jobId) => {
+    try {
+      const { data: response } = await api.get(`/api/jobs/${jobId}`)
+      return response
+    } catch (err) {
+      error.value = err.message
+      throw err
+    }
+  }
+
+  // 订阅分组任务进度，任务结束后自动关闭连接；返回 EventSource 以便提前关闭
+  const subscribeGroupJob = (jobId, { onProgress, onDone, onFailed } = {}) => {
+    const source = new EventSource(`${baseURL}/api/jobs/${jobId}/events`)
+    source.addEventListener('progress', (event) => {
+      onProgress && onProgress(JSON.parse(event.data))
+    })
+    source.addEventListener('done', (event) => {
+      source.close()
+      onDone && onDone(JSON.parse(event.data))
+    })
+    source.addEventListener('failed', (event) => {
+      source.close()
+      onFailed && onFailed(JSON.parse(event.data))
+    })
+    source.onerror = () => {
+      source.close()
+    }
+    return source
+  }
+
+  // 以图搜人：probes 为 [{ image_id, face_index }]，设置 minSimilarity 时按相似度阈值检索
+  const searchFaces = async (probes, { k = 50, minSimilarity = null } = {}) => {
+    try {
+      const { data: response } = await api.post('/api/faces/search', {
+        probes,
+        k,
+        min_similarity: minSimilarity,
+      })
+      return response
+    } catch (err) {
+      error.value = err.message
+      throw err
+    }
+  }
+
+  // 以图搜人：上传一张照片（不加入图库），照片中的每个人脸都作为探针
+  const searchFacesByPhoto = async (file, { k = 50, minSimilarity = null } = {}) => {
+    try {
+      const formData = new FormData()
+      formData.append('file', file)
+      const params = { k }
+      if (minSimilarity !== null) {
+        params.min_similarity = minSimilarity
+      }
+      const { data: response } = await api.post('/api/faces/search/upload', formData, {
+        params,
+        headers: {
+          'Content-Type': 'multipart/form-data',
+        },
+      })
+      return response
+    } catch (err) {
+      error.value = err.message
+      throw err
+    }
+  }
+
   // 创建分组
   const createGroup = async (group) => {
     try {
@@ -187,7 +292,14 @@ export const useApiStore = defineStore('api', () => {
     getImages,
     getImage,
     deleteImage,
+    getExtractionStatus,
+    faceThumbnailUrl,
     groupImages,
+    createGroupJob,
+    getGroupJob,
+    subscribeGroupJob,
+    searchFaces,
+    searchFacesByPhoto,
     createGroup,
     getGroups,
     updateGroup,